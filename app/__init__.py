@@ -34,10 +34,18 @@ def create_app():
     from app.routes.test import test_bp
     from app.routes.report import report_bp
     from app.routes.review import review_bp
+    from app.routes.metrics import metrics_bp
     
     # Register blueprints for direct route access (not in Swagger)
     app.register_blueprint(test_bp, url_prefix='/test')
     app.register_blueprint(report_bp)  # /api/exam/report still works
     app.register_blueprint(review_bp)  # /review still works
+    app.register_blueprint(metrics_bp)  # /api/metrics/gemini
+    
+    # Pooled Gemini client + service singletons, built once per worker
+    from app.config import Config
+    from app.services.gemini_client import warm_up
+    if Config.GEMINI_WARMUP_ON_BOOT:
+        warm_up()
     
     return app
@@ -10,6 +10,125 @@ class Config:
     # OpenAI API for image generation (not needed anymore)
     OPENAI_API_KEY = ""
     
+    # ============ Gemini Client Pool Configuration ============
+    
+    # LLM backend: 'gemini' (real API), 'record' (real API, responses saved to
+    # LLM_RECORDINGS_PATH), 'replay' (serve saved responses, no network) or
+    # 'synthetic' (generated responses, no network; 'fake' is an alias)
+    GEMINI_BACKEND = os.getenv('GEMINI_BACKEND', 'gemini')
+    
+    # One pooled client per worker; connections are kept alive between requests
+    GEMINI_HTTP_MAX_CONNECTIONS = int(os.getenv('GEMINI_HTTP_MAX_CONNECTIONS', 32))
+    GEMINI_HTTP_MAX_KEEPALIVE = int(os.getenv('GEMINI_HTTP_MAX_KEEPALIVE', 16))
+    GEMINI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('GEMINI_HTTP_KEEPALIVE_EXPIRY', 120))  # seconds
+    GEMINI_HTTP_TIMEOUT_MS = int(os.getenv('GEMINI_HTTP_TIMEOUT_MS', 120000))
+    
+    # Build client and services at worker boot (ping opens the first connection)
+    GEMINI_WARMUP_ON_BOOT = os.getenv('GEMINI_WARMUP_ON_BOOT', '1') == '1'
+    GEMINI_WARMUP_PING = os.getenv('GEMINI_WARMUP_PING', '0') == '1'
+    
+    # Scheduler in front of every generate_content call. Limits are per worker
+    # process (divide the API key's quota by the worker count); 0 disables a bucket
+    GEMINI_SCHEDULER = os.getenv('GEMINI_SCHEDULER', '1') == '1'
+    GEMINI_RPM_LIMIT = int(os.getenv('GEMINI_RPM_LIMIT', 1000))
+    GEMINI_TPM_LIMIT = int(os.getenv('GEMINI_TPM_LIMIT', 1000000))
+    GEMINI_INTERACTIVE_RESERVE = float(os.getenv('GEMINI_INTERACTIVE_RESERVE', 0.2))  # Bucket share bulk may not use
+    GEMINI_IMAGE_TOKEN_ESTIMATE = int(os.getenv('GEMINI_IMAGE_TOKEN_ESTIMATE', 1290))
+    GEMINI_SCHEDULER_POLL_SECONDS = float(os.getenv('GEMINI_SCHEDULER_POLL_SECONDS', 0.05))
+    
+    # Retries (jittered exponential backoff), hedging past the observed latency
+    # quantile, and an overall deadline per generate_content call
+    GEMINI_RETRY_ATTEMPTS = int(os.getenv('GEMINI_RETRY_ATTEMPTS', 4))
+    GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', 0.5))
+    GEMINI_RETRY_MAX_DELAY = float(os.getenv('GEMINI_RETRY_MAX_DELAY', 8))
+    GEMINI_CALL_DEADLINE_SECONDS = float(os.getenv('GEMINI_CALL_DEADLINE_SECONDS', 90))
+    GEMINI_HEDGE = os.getenv('GEMINI_HEDGE', '1') == '1'
+    GEMINI_HEDGE_QUANTILE = float(os.getenv('GEMINI_HEDGE_QUANTILE', 0.95))
+    GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', 20))
+    GEMINI_LATENCY_WINDOW = int(os.getenv('GEMINI_LATENCY_WINDOW', 200))
+    GEMINI_RESILIENCE_WORKERS = int(os.getenv('GEMINI_RESILIENCE_WORKERS', 64))
+    
+    # Async engine: AI routes run on one event loop per worker (client.aio)
+    ASYNC_REQUEST_TIMEOUT_SECONDS = float(os.getenv('ASYNC_REQUEST_TIMEOUT_SECONDS', 600))
+    ASYNC_DISCONNECT_POLL_SECONDS = float(os.getenv('ASYNC_DISCONNECT_POLL_SECONDS', 0.5))
+    
+    # ============ Offline LLM Backend Configuration ============
+    
+    LLM_RECORDINGS_PATH = os.getenv('LLM_RECORDINGS_PATH', '.cache/llm_recordings.jsonl')
+    LLM_REPLAY_LATENCY = os.getenv('LLM_REPLAY_LATENCY', '0') == '1'  # Sleep for the recorded latency
+    # Synthetic backend: log-normal latency (median ms, sigma), failure rate and
+    # weighted failure kinds ('429', '503', 'timeout', ...)
+    LLM_SYNTHETIC_LATENCY_MS = float(os.getenv('LLM_SYNTHETIC_LATENCY_MS', 0))
+    LLM_SYNTHETIC_LATENCY_SIGMA = float(os.getenv('LLM_SYNTHETIC_LATENCY_SIGMA', 0.5))
+    LLM_SYNTHETIC_ERROR_RATE = float(os.getenv('LLM_SYNTHETIC_ERROR_RATE', 0))
+    LLM_SYNTHETIC_ERROR_MIX = os.getenv('LLM_SYNTHETIC_ERROR_MIX', '429:0.5,503:0.4,timeout:0.1')
+    LLM_SYNTHETIC_RPM_LIMIT = int(os.getenv('LLM_SYNTHETIC_RPM_LIMIT', 0))  # Simulated quota, 0 = none
+    LLM_SYNTHETIC_SEED = int(os.getenv('LLM_SYNTHETIC_SEED')) if os.getenv('LLM_SYNTHETIC_SEED') else None
+    
+    # ============ OCR Configuration ============
+    
+    OCR_PDF_ZOOM = float(os.getenv('OCR_PDF_ZOOM', 2))  # PDF render scale (2 = 144 dpi)
+    
+    # What extracted_text holds: the 'full' raw text, a short 'summary', or 'none'
+    # (empty). The raw text roughly doubles output tokens on text-heavy exams;
+    # requests can override this with the extracted_text form field
+    OCR_EXTRACTED_TEXT = os.getenv('OCR_EXTRACTED_TEXT', 'full')
+    
+    # Image preparation: each page is sized to whole Gemini tiles (768 px, 258 tokens
+    # each) by its text density, sent in grayscale unless it has coloured ink, and
+    # re-encoded; with it off, PDFs render at OCR_PDF_ZOOM and images go as uploaded
+    OCR_IMAGE_PREP = os.getenv('OCR_IMAGE_PREP', '1') == '1'
+    OCR_IMAGE_TILES = int(os.getenv('OCR_IMAGE_TILES', 2))  # Tiles along the long side
+    OCR_IMAGE_DENSE_TILES = int(os.getenv('OCR_IMAGE_DENSE_TILES', 3))  # ... for dense pages
+    OCR_IMAGE_DENSE_EDGES = float(os.getenv('OCR_IMAGE_DENSE_EDGES', 0.12))  # Edge-pixel share of a dense page
+    OCR_IMAGE_GRAYSCALE = os.getenv('OCR_IMAGE_GRAYSCALE', '1') == '1'
+    OCR_IMAGE_COLOR_SHARE = float(os.getenv('OCR_IMAGE_COLOR_SHARE', 0.002))  # Coloured-ink share that keeps colour
+    OCR_IMAGE_FORMAT = os.getenv('OCR_IMAGE_FORMAT', 'JPEG')  # JPEG or WEBP
+    OCR_IMAGE_QUALITY = int(os.getenv('OCR_IMAGE_QUALITY', 85))
+    
+    # Pre-flight checks before any OCR call: blank pages are skipped, blurred or
+    # washed-out pages rejected, and sideways/upside-down pages turned upright
+    OCR_PREFLIGHT = os.getenv('OCR_PREFLIGHT', '1') == '1'
+    OCR_PREFLIGHT_AUTO_ROTATE = os.getenv('OCR_PREFLIGHT_AUTO_ROTATE', '1') == '1'
+    OCR_PREFLIGHT_BLANK_INK = float(os.getenv('OCR_PREFLIGHT_BLANK_INK', 0.0005))  # Ink share below which a page is blank
+    OCR_PREFLIGHT_MIN_CONTRAST = float(os.getenv('OCR_PREFLIGHT_MIN_CONTRAST', 30))  # Ink vs paper, gray levels
+    OCR_PREFLIGHT_MIN_SHARPNESS = float(os.getenv('OCR_PREFLIGHT_MIN_SHARPNESS', 0.12))
+    OCR_PREFLIGHT_SIDEWAYS_MARGIN = float(os.getenv('OCR_PREFLIGHT_SIDEWAYS_MARGIN', 0.2))
+    OCR_PREFLIGHT_FLIP_MARGIN = float(os.getenv('OCR_PREFLIGHT_FLIP_MARGIN', 0.12))
+    OCR_PREFLIGHT_BASELINE_MARGIN = float(os.getenv('OCR_PREFLIGHT_BASELINE_MARGIN', 0.06))
+    
+    # Template registry: copies of a registered exam (matched by page layout) reuse
+    # its stored question structure, so only the student's answers are read
+    OCR_TEMPLATES = os.getenv('OCR_TEMPLATES', '1') == '1'
+    OCR_TEMPLATES_PATH = os.getenv('OCR_TEMPLATES_PATH', '.cache/exam_templates.sqlite3')
+    OCR_TEMPLATE_MIN_OVERLAP = float(os.getenv('OCR_TEMPLATE_MIN_OVERLAP', 0.85))  # Template ink found on each page
+    OCR_TEMPLATE_MIN_EXPLAINED = float(os.getenv('OCR_TEMPLATE_MIN_EXPLAINED', 0.8))  # Page ink lying on the template's
+    OCR_TEMPLATE_MIN_MARGIN = float(os.getenv('OCR_TEMPLATE_MIN_MARGIN', 0.05))  # Score lead over the runner-up template
+    OCR_TEMPLATE_COARSE_DISTANCE = int(os.getenv('OCR_TEMPLATE_COARSE_DISTANCE', 16))  # pHash bits (of 63) pre-filter
+    
+    # Born-digital PDFs: pages with a usable text layer are parsed locally (question
+    # and option patterns); only the other pages, and pages with typed answers, go to vision OCR
+    OCR_TEXT_LAYER = os.getenv('OCR_TEXT_LAYER', '1') == '1'
+    OCR_TEXT_LAYER_MIN_WORDS = int(os.getenv('OCR_TEXT_LAYER_MIN_WORDS', 20))
+    OCR_TEXT_LAYER_MAX_IMAGE_SHARE = float(os.getenv('OCR_TEXT_LAYER_MAX_IMAGE_SHARE', 0.15))  # Of the page area
+    
+    # Split multi-page PDFs into groups of OCR_PAGES_PER_REQUEST pages, OCR the
+    # groups concurrently and merge them in document order
+    OCR_PAGE_PARALLEL = os.getenv('OCR_PAGE_PARALLEL', '0') == '1'
+    OCR_PAGES_PER_REQUEST = int(os.getenv('OCR_PAGES_PER_REQUEST', 1))
+    OCR_PAGE_CONCURRENCY = int(os.getenv('OCR_PAGE_CONCURRENCY', 4))  # Groups in flight per document
+    
+    # ============ Gemini Response Cache Configuration ============
+    
+    # Comma-separated services that reuse identical responses ('all' for every one):
+    # ocr, annotation, open_ended, short_answer, definition, compare_contrast,
+    # labeling, labeling_image, math
+    RESPONSE_CACHE_SERVICES = os.getenv('RESPONSE_CACHE_SERVICES', '')
+    RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', '.cache/gemini_responses.sqlite3')
+    RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv('RESPONSE_CACHE_MEMORY_ITEMS', 512))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+    
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     ALLOWED_PDF_EXTENSIONS = {'pdf'}
@@ -46,6 +165,28 @@ class Config:
     # Number of grading passes for consistency
     OPEN_ENDED_GRADING_PASSES = 3
     
+    # Stop once the majority of every criterion is settled (results unchanged)
+    GRADING_EARLY_STOP = os.getenv('GRADING_EARLY_STOP', '1') == '1'
+    # Extra passes allowed when all passes disagree (= passes: median, no escalation)
+    GRADING_MAX_PASSES = int(os.getenv('GRADING_MAX_PASSES', 3))
+    
+    # Ask for several passes as candidates of one request (falls back to separate calls)
+    GRADING_CANDIDATE_SAMPLING = os.getenv('GRADING_CANDIDATE_SAMPLING', '0') == '1'
+    
+    # Passes of one question sent to Gemini at the same time (1 = sequential)
+    GRADING_PASS_FANOUT = int(os.getenv('GRADING_PASS_FANOUT', 3))
+    # Worker threads shared by all AI grading services in the process
+    GRADING_PASS_WORKERS = int(os.getenv('GRADING_PASS_WORKERS', 32))
+    # Questions of one request graded in parallel (1 = sequential)
+    GRADING_QUESTION_WORKERS = int(os.getenv('GRADING_QUESTION_WORKERS', 8))
+    # Global cap on grading calls in flight to Gemini per worker process
+    GRADING_MAX_CONCURRENT_CALLS = int(os.getenv('GRADING_MAX_CONCURRENT_CALLS', 24))
+    # Passes whose call still failed after retries are redrawn instead of voting, up to this many
+    GRADING_MAX_FAILED_PASSES = int(os.getenv('GRADING_MAX_FAILED_PASSES', 3))
+    
+    # Item analysis: graded papers kept per cohort, analysed as new papers arrive
+    ITEM_ANALYSIS_PATH = os.getenv('ITEM_ANALYSIS_PATH', '.cache/item_analysis.sqlite3')
+    
     # ============ Definition Grading Configuration ============
     
     # Meaning units for definition grading (must sum to 1.0)
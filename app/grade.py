@@ -0,0 +1,269 @@
+# Offline bulk grading: stream student answers from CSV or NDJSON, write one result per student
+#
+#     python -m app.grade answer_key.json answers.csv -o results.ndjson [--question-type ordered]
+#                         [--workers 4] [--chunk-size 2000] [--details]
+#
+# The answer key is a JSON list of questions (as sent to /api/grading), or an object with
+# "questions" and optionally "question_type" and "default_points". Answers are read:
+#   - CSV: a student_id column and one column per question number (or "3.a" for
+#     sub-questions); cells holding JSON lists or objects ("[\"C\", \"A\"]",
+#     "{\"1\": \"a\"}") are parsed, for ordering, fill-in-blank and matching answers
+#   - NDJSON: one {"student_id": ..., "answers": {...}} object per line (without
+#     "answers", every other field is an answer)
+# Results go out as NDJSON (totals, or the GradingService result per student with --details)
+# or CSV, chunk by chunk as workers finish, so memory stays bounded by the chunks in flight.
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from app.services.class_grading import ClassAnswerKey
+from app.services.grading import AnswerKey
+
+
+CSV_FIELDS = ('student_id', 'points_earned', 'points_possible', 'percentage', 'error')
+ID_COLUMN = 'student_id'
+
+# Per process: the compiled key and the input/output formats (see _init_worker)
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(questions: List[Dict[str, Any]], question_type: str, default_points: float,
+                 header: Optional[List[str]], output_format: str, details: bool) -> None:
+    key = ClassAnswerKey(questions, question_type, default_points)
+    _worker.update(key=key.answer_key, class_key=key, header=header, output_format=output_format, details=details)
+
+
+def _cell(value: str) -> Any:
+    # CSV cell: JSON lists/objects parsed, empty cells unanswered
+    value = value.strip()
+    if value.startswith(('[', '{')):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value or None
+
+
+def _parse(record: Any, number: int) -> Tuple[str, Dict[str, Any]]:
+    # (student_id, student_answers) of one CSV row (list) or NDJSON line (str)
+    header = _worker['header']
+    if header is not None:
+        row = dict(zip(header, record))
+        student_id = row.pop(ID_COLUMN, '').strip()
+        return student_id or str(number), {column: _cell(value) for column, value in row.items()}
+    line = json.loads(record)
+    if not isinstance(line, dict):
+        raise ValueError('expected a JSON object')
+    student_id = line.get('student_id', number)
+    answers = line['answers'] if 'answers' in line else {k: v for k, v in line.items() if k != 'student_id'}
+    if not isinstance(answers, dict):
+        raise ValueError('answers must be an object')
+    return str(student_id), answers
+
+
+def _write(out: io.StringIO, writer: Any, number: int, student_id: str, result: Optional[Dict[str, Any]],
+           error: Optional[Exception] = None) -> None:
+    if error is not None:
+        if writer:
+            writer.writerow([str(number), '', '', '', f'record {number}: {error}'])
+        else:
+            out.write(json.dumps({'student_id': None, 'record': number, 'error': str(error)}) + '\n')
+    elif writer:
+        writer.writerow([student_id, result['points_earned'], result['points_possible'],
+                         round(result['percentage'], 2), ''])
+    else:
+        out.write(json.dumps({'student_id': student_id, **result}, ensure_ascii=False, default=str) + '\n')
+
+
+def _grade_chunk(chunk: Tuple[int, List[Any]]) -> Tuple[str, int, int, List[float]]:
+    """Grade one chunk of raw records; returns (output text, students, errors, percentages).
+    
+    Totals alone are scored for the whole chunk at once (ClassAnswerKey);
+    with details every student goes through AnswerKey.grade.
+    """
+    first, records = chunk
+    out = io.StringIO()
+    writer = csv.writer(out) if _worker['output_format'] == 'csv' else None
+    parsed = []
+    for number, record in enumerate(records, first):
+        try:
+            parsed.append((number, *_parse(record, number), None))
+        except (ValueError, KeyError, TypeError) as e:
+            parsed.append((number, None, None, e))
+    valid = [answers for _, _, answers, error in parsed if error is None]
+    
+    if _worker['details']:
+        results = iter([_worker['key'].grade(answers) for answers in valid])
+    else:
+        class_key = _worker['class_key']
+        scores = class_key.score(class_key.encode(valid))
+        results = iter([{'points_earned': earned, 'points_possible': scores['points_possible'], 'percentage': percentage}
+                        for earned, percentage in zip(scores['points_earned'].tolist(), scores['percentage'].tolist())])
+    
+    percentages = []
+    for number, student_id, _, error in parsed:
+        result = next(results) if error is None else None
+        if result is not None:
+            percentages.append(result['percentage'])
+        _write(out, writer, number, student_id, result, error)
+    return out.getvalue(), len(records), len(parsed) - len(valid), percentages
+
+
+def _chunks(records: Iterator[Any], size: int) -> Iterator[Tuple[int, List[Any]]]:
+    # (number of the first record, records) per chunk, read lazily; records are numbered from 1
+    chunk: List[Any] = []
+    first = 1
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield first, chunk
+            first += len(chunk)
+            chunk = []
+    if chunk:
+        yield first, chunk
+
+
+def _records(source: TextIO, input_format: str) -> Tuple[Optional[List[str]], Iterator[Any]]:
+    # (CSV header or None, raw records): CSV rows are split here, NDJSON lines parsed by the workers
+    if input_format == 'csv':
+        reader = csv.reader(source)
+        header = [column.strip() for column in next(reader, [])]
+        if ID_COLUMN not in header:
+            raise SystemExit(f"CSV input needs a '{ID_COLUMN}' column")
+        return header, (row for row in reader if any(cell.strip() for cell in row))
+    return None, (line for line in source if line.strip())
+
+
+def _format(path: str, given: Optional[str], default: str) -> str:
+    if given:
+        return given
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    return default
+
+
+def load_answer_key(path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Questions and options (question_type, default_points) of an answer-key JSON file."""
+    with open(path, encoding='utf-8') as f:
+        key = json.load(f)
+    if isinstance(key, list):
+        return key, {}
+    if isinstance(key, dict) and isinstance(key.get('questions'), list):
+        return key['questions'], {k: key[k] for k in ('question_type', 'default_points') if k in key}
+    raise SystemExit('The answer key must be a JSON list of questions or an object with "questions"')
+
+
+def grade_stream(source: TextIO, output: TextIO, questions: List[Dict[str, Any]], question_type: str = 'ordered',
+                 default_points: float = 1.0, input_format: str = 'csv', output_format: str = 'ndjson',
+                 details: bool = False, workers: int = 1, chunk_size: int = 2000) -> Dict[str, Any]:
+    """Grade every student in `source`, writing results to `output` in input order.
+    
+    Chunks of `chunk_size` records are graded by `workers` processes (in
+    this process when 1); at most two chunks per worker are in flight, so
+    memory does not grow with the input. Returns the run's summary.
+    """
+    header, records = _records(source, input_format)
+    init_args = (questions, question_type, default_points, header, output_format, details)
+    if output_format == 'csv':
+        csv.writer(output).writerow(CSV_FIELDS)
+    
+    started = time.perf_counter()
+    students = errors = chunks = 0
+    total = 0.0
+    lowest, highest = None, None
+    
+    def write(graded: Tuple[str, int, int, List[float]]) -> None:
+        nonlocal students, errors, chunks, total, lowest, highest
+        text, count, failed, percentages = graded
+        output.write(text)
+        output.flush()
+        students += count
+        errors += failed
+        chunks += 1
+        if percentages:
+            total += sum(percentages)
+            lowest = min(percentages) if lowest is None else min(lowest, min(percentages))
+            highest = max(percentages) if highest is None else max(highest, max(percentages))
+    
+    if workers <= 1:
+        _init_worker(*init_args)
+        for chunk in _chunks(records, chunk_size):
+            write(_grade_chunk(chunk))
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+            pending = deque()
+            for chunk in _chunks(records, chunk_size):
+                pending.append(pool.apply_async(_grade_chunk, (chunk,)))
+                if len(pending) >= 2 * workers:
+                    write(pending.popleft().get())
+            while pending:
+                write(pending.popleft().get())
+    
+    seconds = time.perf_counter() - started
+    graded = students - errors
+    return {
+        'students': students,
+        'errors': errors,
+        'chunks': chunks,
+        'workers': max(workers, 1),
+        'seconds': round(seconds, 3),
+        'students_per_second': round(students / seconds, 1) if seconds > 0 else 0,
+        'average_percentage': round(total / graded, 2) if graded else 0,
+        'min_percentage': lowest or 0,
+        'max_percentage': highest or 0
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.grade',
+                                     description='Grade student answers from CSV or NDJSON against an answer key.')
+    parser.add_argument('answer_key', help='Answer-key JSON file')
+    parser.add_argument('answers', help="Student answers (CSV or NDJSON; '-' for stdin)")
+    parser.add_argument('-o', '--output', default='-', help="Results file (CSV or NDJSON; default '-', stdout)")
+    parser.add_argument('--input-format', choices=('csv', 'ndjson'), help='Default: from the file extension')
+    parser.add_argument('--output-format', choices=('csv', 'ndjson'), help='Default: from the file extension')
+    parser.add_argument('--question-type', choices=AnswerKey.MODES,
+                        help="Grading mode (default: the key's question_type, else 'ordered')")
+    parser.add_argument('--default-points', type=float, help='Points per question/pair/position/blank when not given')
+    parser.add_argument('--details', action='store_true', help='Write per-question details (NDJSON output)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Grading processes (default: CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Students per chunk (default: 2000)')
+    args = parser.parse_args(argv)
+    
+    questions, options = load_answer_key(args.answer_key)
+    question_type = args.question_type or options.get('question_type', 'ordered')
+    if question_type not in AnswerKey.MODES:
+        raise SystemExit(f"question_type must be one of {', '.join(AnswerKey.MODES)}")
+    default_points = args.default_points if args.default_points is not None else options.get('default_points', 1.0)
+    input_format = _format(args.answers, args.input_format, 'ndjson')
+    output_format = _format(args.output, args.output_format, 'ndjson')
+    
+    source = sys.stdin if args.answers == '-' else open(args.answers, encoding='utf-8-sig', newline='')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        summary = grade_stream(source, output, questions, question_type, default_points, input_format,
+                               output_format, args.details, args.workers, max(args.chunk_size, 1))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    
+    print(f"{summary['students']:,} students ({summary['errors']} errors) in {summary['seconds']:.2f} s: "
+          f"{summary['students_per_second']:,.0f} students/s with {summary['workers']} worker(s), "
+          f"{summary['chunks']} chunk(s); average {summary['average_percentage']}% "
+          f"(min {summary['min_percentage']:.1f}%, max {summary['max_percentage']:.1f}%)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
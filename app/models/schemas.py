@@ -124,6 +124,25 @@ class OCRResponse(BaseModel):
     confidence_score: float = Field(ge=0.0, le=1.0)
 
 
+# Structured-only extraction: OCRResponse without the raw text (extracted_text 'none')
+class StructuredOCRResponse(BaseModel):
+    structured_data: StructuredData
+    confidence_score: float = Field(ge=0.0, le=1.0)
+
+
+# Answer-only extraction: the questions are already known, only answers are read
+class StudentAnswer(BaseModel):
+    order: int = Field(description="Order of the known question")
+    question_number: str = Field(description="Number of the known question")
+    student_answer: Optional[Union[str, bool, List[str], Dict[str, Any]]] = None
+    student_markings: Optional[str] = None
+
+
+class AnswerSheet(BaseModel):
+    answers: List[StudentAnswer]
+    confidence_score: float = Field(ge=0.0, le=1.0)
+
+
 # Legacy models
 class MultipleChoiceQuestion(BaseModel):
     question_number: int
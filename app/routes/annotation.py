@@ -3,6 +3,9 @@ from flask import request
 from flask_restx import Namespace, Resource, fields
 import base64
 
+from app.services.gemini_client import get_service
+from app.routes.async_support import run_request
+
 annotation_ns = Namespace('annotation', description='Exam paper annotation and correction')
 
 # Request models
@@ -90,8 +93,10 @@ class GenerateAnnotation(Resource):
             
             # Generate annotations (dry run - metadata only for teacher review)
             from app.services.annotation_service import AnnotationService
-            service = AnnotationService()
-            result = service.annotate_exam(exam_bytes, file_type, grading_results, draw_on_image=False)
+            service = get_service(AnnotationService)
+            result = run_request(
+                service.annotate_exam_async(exam_bytes, file_type, grading_results, draw_on_image=False)
+            )
             
             return {'success': True, 'data': result}, 200
             
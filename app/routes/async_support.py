@@ -0,0 +1,49 @@
+# Helpers for routes that run on the async engine
+import socket
+from typing import Any, Awaitable
+
+from flask import request
+
+from app.services.async_engine import run_async
+from app.services.gemini_scheduler import PRIORITIES, INTERACTIVE, priority
+
+
+PRIORITY_HEADER = 'X-Gradeo-Priority'  # 'interactive' (default) or 'bulk'
+
+
+def client_disconnected(environ: dict) -> bool:
+    # Peek at the client socket: an orderly close reads as b'' without blocking
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None or not hasattr(socket, 'MSG_DONTWAIT'):  # e.g. Windows
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+async def _at_priority(coro: Awaitable[Any], level: str) -> Any:
+    with priority(level):
+        return await coro
+
+
+def request_priority() -> str:
+    level = request.headers.get(PRIORITY_HEADER, INTERACTIVE).strip().lower()
+    return level if level in PRIORITIES else INTERACTIVE
+
+
+def run_request(coro: Awaitable[Any]) -> Any:
+    """Await `coro` on the async engine for the current request.
+    
+    Gemini work is cancelled when the client disconnects or the request
+    deadline passes, instead of running on for a response nobody reads.
+    Calls are scheduled at the priority named by the X-Gradeo-Priority header.
+    
+    The calling worker thread blocks until the coroutine finishes: Gemini calls
+    share the loop, but each in-flight request still holds one thread.
+    """
+    environ = request.environ
+    return run_async(_at_priority(coro, request_priority()),
+                     cancelled=lambda: client_disconnected(environ))
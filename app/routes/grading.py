@@ -1,8 +1,13 @@
 # Grading endpoints for exam answers
+import numpy as np
 from flask import request
 from flask_restx import Namespace, Resource, fields
 
-from app.services.grading import GradingService
+from app.services.class_grading import grade_class_matrix
+from app.services.grading import AnswerKey, GradingService
+from app.services.item_analysis import get_item_analysis_store
+from app.services.gemini_client import get_service
+from app.routes.async_support import run_request
 
 
 grading_ns = Namespace('grading', description='Exam grading')
@@ -696,7 +701,7 @@ class GradeMultipleChoice(Resource):
             student_answers = data.get('student_answers', {})
             points = data.get('points_per_question', 1.0)
             
-            grading = GradingService()
+            grading = get_service(GradingService)
             # Always use grade_multiple_choice for this endpoint
             result = grading.grade_multiple_choice(questions, student_answers, points)
             
@@ -722,7 +727,7 @@ class GradeTrueFalse(Resource):
             student_answers = data.get('student_answers', {})
             points = data.get('points_per_question', 1.0)
             
-            grading = GradingService()
+            grading = get_service(GradingService)
             # Always use grade_true_false for this endpoint
             result = grading.grade_true_false(questions, student_answers, points)
             
@@ -748,7 +753,7 @@ class GradeMatching(Resource):
             student_answers = data.get('student_answers', {})
             points_per_pair = data.get('points_per_pair', 1.0)
             
-            result = GradingService().grade_matching(questions, student_answers, points_per_pair)
+            result = get_service(GradingService).grade_matching(questions, student_answers, points_per_pair)
             return {'success': True, 'data': result}, 200
         except Exception as e:
             return {'success': False, 'error': str(e)}, 500
@@ -771,7 +776,7 @@ class GradeFillInBlank(Resource):
             student_answers = data.get('student_answers', {})
             points_per_blank = data.get('points_per_blank', 1.0)
             
-            result = GradingService().grade_fill_in_blank(questions, student_answers, points_per_blank)
+            result = get_service(GradingService).grade_fill_in_blank(questions, student_answers, points_per_blank)
             return {'success': True, 'data': result}, 200
         except Exception as e:
             return {'success': False, 'error': str(e)}, 500
@@ -794,12 +799,222 @@ class GradeOrdering(Resource):
             student_answers = data.get('student_answers', {})
             points_per_position = data.get('points_per_position', 1.0)
             
-            result = GradingService().grade_ordering(questions, student_answers, points_per_position)
+            result = get_service(GradingService).grade_ordering(questions, student_answers, points_per_position)
             return {'success': True, 'data': result}, 200
         except Exception as e:
             return {'success': False, 'error': str(e)}, 500
 
 
+# Whole-class grading models
+class_request_model = grading_ns.model('ClassGradingRequest', {
+    'questions': fields.List(fields.Raw, required=True,
+                             description='Questions with correct answers, as for the per-type endpoints'),
+    'question_type': fields.String(default='ordered', enum=list(AnswerKey.MODES),
+                                   description='Grading mode: one question type, or "ordered" for mixed exams'),
+    'default_points': fields.Float(default=1.0, description='Points per question/pair/position/blank when not given'),
+    'students': fields.Raw(description='Per-student answers: [{"student_id": "s1", "answers": {"1": "A"}}] '
+                                       'or {"s1": {"1": "A"}}'),
+    'answer_rows': fields.List(fields.List(fields.Raw),
+                               description='Answer matrix instead of students: one row per student, one answer '
+                                           'per gradable item (question, matching pair, ordering position, blank) '
+                                           'in question order'),
+    'student_ids': fields.List(fields.String, description='Ids of the answer_rows (default: row index)'),
+    'include_correct': fields.Boolean(default=True, description='Return the students x items correctness matrix')
+})
+
+class_question_result = grading_ns.model('ClassQuestionResult', {
+    'question_number': fields.Raw(),
+    'points_possible': fields.Float(),
+    'average_points': fields.Float(),
+    'correct_rate': fields.Float(description='Share of students with full points')
+})
+
+class_student_result = grading_ns.model('ClassStudentResult', {
+    'student_id': fields.String(),
+    'points_earned': fields.Float(),
+    'percentage': fields.Float(),
+    'correct_count': fields.Integer(description='Gradable items answered correctly')
+})
+
+class_grading_result = grading_ns.model('ClassGradingResult', {
+    'question_type': fields.String(),
+    'student_count': fields.Integer(),
+    'points_possible': fields.Float(),
+    'average_percentage': fields.Float(),
+    'columns': fields.List(fields.Raw, description='Gradable items: question_index, question_number, item, points, '
+                                                   'correct_answer'),
+    'questions': fields.List(fields.Nested(class_question_result)),
+    'students': fields.List(fields.Nested(class_student_result)),
+    'correct': fields.List(fields.List(fields.Integer), description='Per student, 1/0 per column')
+})
+
+class_success_model = grading_ns.model('ClassGradingSuccess', {
+    'success': fields.Boolean(default=True),
+    'data': fields.Nested(class_grading_result)
+})
+
+
+@grading_ns.route('/class')
+class GradeClass(Resource):
+    @grading_ns.doc('grade_class')
+    @grading_ns.expect(class_request_model)
+    @grading_ns.response(200, 'Success', class_success_model)
+    @grading_ns.response(400, 'Bad Request', error_model)
+    def post(self):
+        """Grade a whole class of MCQ, T/F, matching, ordering or fill-in-blank answers at once
+        
+        Answers are encoded as integer codes and scored with NumPy array
+        comparisons; scores equal those of the per-student endpoints.
+        """
+        try:
+            data = request.get_json()
+            if not data:
+                return {'success': False, 'error': 'No JSON data'}, 400
+            
+            questions = data.get('questions', [])
+            question_type = data.get('question_type', 'ordered')
+            if not questions:
+                return {'success': False, 'error': 'No questions provided'}, 400
+            if question_type not in AnswerKey.MODES:
+                return {'success': False, 'error': f"question_type must be one of {', '.join(AnswerKey.MODES)}"}, 400
+            
+            rows = data.get('answer_rows')
+            students = data.get('students')
+            if rows is not None:
+                if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+                    return {'success': False, 'error': 'answer_rows must be a list of answer lists'}, 400
+                student_ids = data.get('student_ids') or list(range(len(rows)))
+                if not isinstance(student_ids, list) or len(student_ids) != len(rows):
+                    return {'success': False, 'error': 'student_ids must have one id per answer row'}, 400
+                answers = None
+            elif isinstance(students, dict):
+                student_ids, answers = list(students), list(students.values())
+            elif isinstance(students, list):
+                student_ids = [s.get('student_id', i) if isinstance(s, dict) else i for i, s in enumerate(students)]
+                answers = [s.get('answers') if isinstance(s, dict) else None for s in students]
+            else:
+                return {'success': False, 'error': 'Provide students or answer_rows'}, 400
+            
+            result = grade_class_matrix(questions, question_type, data.get('default_points', 1.0),
+                                        students=answers, rows=rows)
+            include_correct = data.get('include_correct', True)
+            
+            question_possible = result['question_possible']
+            full_marks = result['question_points'] >= question_possible - 1e-9
+            summary = {
+                'question_type': question_type,
+                'student_count': result['student_count'],
+                'points_possible': result['points_possible'],
+                'average_percentage': float(result['percentage'].mean()) if result['student_count'] else 0,
+                'columns': result['columns'],
+                'questions': [{
+                    'question_number': number,
+                    'points_possible': float(question_possible[i]),
+                    'average_points': float(result['question_points'][:, i].mean()) if result['student_count'] else 0,
+                    'correct_rate': float(full_marks[:, i].mean()) if result['student_count'] else 0
+                } for i, number in enumerate(result['question_numbers'])],
+                'students': [{
+                    'student_id': str(student_id),
+                    'points_earned': points,
+                    'percentage': percentage,
+                    'correct_count': correct
+                } for student_id, points, percentage, correct in zip(
+                    student_ids, result['points_earned'].tolist(), result['percentage'].tolist(),
+                    result['correct_count'].tolist())]
+            }
+            if include_correct:
+                summary['correct'] = result['correct'].astype(np.uint8).tolist()
+            return {'success': True, 'data': summary}, 200
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 500
+
+
+# Item analysis models
+analysis_paper_model = grading_ns.model('AnalysisPaper', {
+    'student_id': fields.String(required=True, description='Student id (later papers of a student add to or replace earlier results)'),
+    'results': fields.List(fields.Raw, required=True,
+                           description='The data of grading endpoint responses for this student (any question types)')
+})
+
+analysis_request_model = grading_ns.model('AnalysisRequest', {
+    'papers': fields.List(fields.Nested(analysis_paper_model), required=True, description='Newly graded papers')
+})
+
+analysis_question_model = grading_ns.model('AnalysisQuestion', {
+    'question': fields.String(description='Question key ("3" or "3.a" for sub-questions)'),
+    'question_number': fields.String(),
+    'question_type': fields.String(),
+    'attempts': fields.Integer(description='Students graded on this question'),
+    'points_possible': fields.Float(),
+    'difficulty': fields.Float(description='Mean share of the points earned (1 = everyone right)'),
+    'discrimination': fields.Float(description='Point-biserial correlation of the question score with the rest of the paper'),
+    'flags': fields.List(fields.String, description='too_easy, too_hard, low_discrimination, '
+                                                    'negative_discrimination, non_functioning_distractors'),
+    'options': fields.List(fields.Raw, description='MCQ/TF: per answer chosen, count, share, is_correct, '
+                                                   'mean_percentage of its choosers, non_functioning'),
+    'criteria': fields.List(fields.Raw, description='AI-graded: per criterion, the count of each status')
+})
+
+analysis_result_model = grading_ns.model('AnalysisResult', {
+    'cohort_id': fields.String(),
+    'student_count': fields.Integer(),
+    'question_count': fields.Integer(),
+    'average_percentage': fields.Float(),
+    'questions': fields.List(fields.Nested(analysis_question_model))
+})
+
+analysis_success_model = grading_ns.model('AnalysisSuccess', {
+    'success': fields.Boolean(default=True),
+    'data': fields.Nested(analysis_result_model)
+})
+
+
+@grading_ns.route('/analysis/<string:cohort_id>')
+class ItemAnalysis(Resource):
+    @grading_ns.doc('item_analysis', description='Item analysis of the papers graded so far in a cohort (e.g. one exam of one class)')
+    @grading_ns.response(200, 'Success', analysis_success_model)
+    @grading_ns.response(404, 'Unknown cohort', error_model)
+    def get(self, cohort_id):
+        analysis = get_item_analysis_store().analysis(cohort_id)
+        if analysis is None:
+            return {'success': False, 'error': 'No papers in this cohort'}, 404
+        return {'success': True, 'data': analysis}, 200
+    
+    @grading_ns.doc('item_analysis_add', description='Add newly graded papers to a cohort and return the updated analysis')
+    @grading_ns.expect(analysis_request_model)
+    @grading_ns.response(200, 'Success', analysis_success_model)
+    @grading_ns.response(400, 'Bad Request', error_model)
+    def post(self, cohort_id):
+        try:
+            data = request.get_json()
+            if not data:
+                return {'success': False, 'error': 'No JSON data'}, 400
+            
+            papers = data.get('papers')
+            if not isinstance(papers, list) or not papers:
+                return {'success': False, 'error': 'papers must be a non-empty list'}, 400
+            for paper in papers:
+                if not isinstance(paper, dict) or not paper.get('student_id') or not isinstance(paper.get('results'), list):
+                    return {'success': False, 'error': 'Each paper needs a student_id and a results list'}, 400
+            
+            store = get_item_analysis_store()
+            store.add_papers(cohort_id, ((str(p['student_id']), p['results']) for p in papers))
+            analysis = store.analysis(cohort_id)
+            if analysis is None:
+                return {'success': False, 'error': 'No scored questions in these papers'}, 400
+            return {'success': True, 'data': analysis}, 200
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 500
+    
+    @grading_ns.doc('item_analysis_delete', description='Delete a cohort and its papers')
+    @grading_ns.response(200, 'Deleted')
+    @grading_ns.response(404, 'Unknown cohort', error_model)
+    def delete(self, cohort_id):
+        if not get_item_analysis_store().delete(cohort_id):
+            return {'success': False, 'error': 'No papers in this cohort'}, 404
+        return {'success': True}, 200
+
+
 @grading_ns.route('/labeling')
 class GradeLabeling(Resource):
     @grading_ns.doc('grade_labeling')
@@ -820,8 +1035,8 @@ class GradeLabeling(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.labeling_grading import LabelingGradingService
-            grading_service = LabelingGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(LabelingGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -848,7 +1063,7 @@ class GradeLabeling(Resource):
               #  return {'success': False, 'error': 'No questions provided'}, 400
             
             #from app.services.labeling_image_grading import LabelingImageGradingService
-            #grading_service = LabelingImageGradingService()
+            #grading_service = get_service(LabelingImageGradingService)
             #result = grading_service.grade_questions(questions, student_images)
             
             #return {'success': True, 'data': result}, 200
@@ -876,8 +1091,8 @@ class GradeCompareContrast(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.compare_contrast_grading import CompareContrastGradingService
-            grading_service = CompareContrastGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(CompareContrastGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -904,8 +1119,8 @@ class GradeTable(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.table_grading import TableGradingService
-            grading_service = TableGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(TableGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -932,8 +1147,8 @@ class GradeDefinition(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.definition_grading import DefinitionGradingService
-            grading_service = DefinitionGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(DefinitionGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -1009,8 +1224,8 @@ class GradeShortAnswer(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.short_answer_grading import ShortAnswerGradingService
-            grading_service = ShortAnswerGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(ShortAnswerGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -1039,8 +1254,8 @@ class GradeOpenEnded(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.open_ended_grading import OpenEndedGradingService
-            grading_service = OpenEndedGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(OpenEndedGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -1067,8 +1282,8 @@ class GradeMathEquations(Resource):
                 return {'success': False, 'error': 'No questions provided'}, 400
             
             from app.services.math_grading import MathGradingService
-            grading_service = MathGradingService()
-            result = grading_service.grade_questions(questions, student_answers)
+            grading_service = get_service(MathGradingService)
+            result = run_request(grading_service.grade_questions_async(questions, student_answers))
             
             return {'success': True, 'data': result}, 200
         except Exception as e:
@@ -0,0 +1,19 @@
+# Operational metrics for the Gemini call path (not in Swagger)
+from flask import Blueprint, jsonify
+
+from app.services.gemini_resilience import resilience_stats
+from app.services.gemini_scheduler import scheduler_stats
+from app.services.response_cache import cache_stats
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/api/metrics/gemini', methods=['GET'])
+def gemini_metrics():
+    """Scheduler, retry/hedge/latency and response cache counters for this worker."""
+    return jsonify({
+        'scheduler': scheduler_stats(),
+        'calls': resilience_stats(),
+        'response_cache': cache_stats()
+    })
@@ -1,10 +1,19 @@
 # OCR endpoints for exam paper extraction
-from flask import request
+import json
+
+from flask import Response, request, stream_with_context
 from flask_restx import Namespace, Resource, fields
 from werkzeug.datastructures import FileStorage
 
 from app.config import Config
+from app.models.schemas import Question
 from app.services.gemini_ocr import GeminiOCRService
+from app.services.ocr_schemas import parse_question_types, parse_text_mode
+from app.services.page_preflight import PageRejected
+from app.services.exam_templates import EmptyTemplate, fingerprint_document, get_template_registry
+from app.services.gemini_client import get_service
+from app.routes.async_support import request_priority, run_request
+from app.services.gemini_scheduler import priority
 
 
 ocr_ns = Namespace('ocr', description='Exam paper OCR')
@@ -12,6 +21,23 @@ ocr_ns = Namespace('ocr', description='Exam paper OCR')
 upload_parser = ocr_ns.parser()
 upload_parser.add_argument('file', location='files', type=FileStorage, required=True,
                            help='Image (PNG, JPG, WEBP) or PDF file')
+upload_parser.add_argument('questions', location='form', type=str, required=False,
+                           help='Known questions as JSON (e.g. structured_data.questions of an earlier OCR): '
+                                'only the student answers are extracted')
+upload_parser.add_argument('question_types', location='form', type=str, required=False,
+                           help='Comma-separated question types the exam uses (e.g. multiple_choice,true_false): '
+                                'a smaller response schema, so a typical quiz extracts faster')
+upload_parser.add_argument('extracted_text', location='form', type=str, required=False,
+                           choices=('full', 'summary', 'none'),
+                           help='Raw text in the result: full transcription, a short summary, or none '
+                                '(structured questions only, fastest). Default: server setting OCR_EXTRACTED_TEXT')
+
+template_parser = ocr_ns.parser()
+template_parser.add_argument('file', location='files', type=FileStorage, required=True,
+                             help='Blank or answer-key exam (image or PDF)')
+template_parser.add_argument('name', location='form', type=str, required=True, help='Template name')
+template_parser.add_argument('language', location='form', type=str, default='english',
+                             help='Language of the exam (english, arabic, french)')
 
 # ============ Response Models ============
 
@@ -116,11 +142,73 @@ structured_data_model = ocr_ns.model('StructuredData', {
     'metadata': fields.Nested(metadata_model, description='Exam metadata')
 })
 
+page_report_model = ocr_ns.model('OCRPageReport', {
+    'pages': fields.List(fields.Integer, description='Page numbers in this group (1-based)'),
+    'confidence_score': fields.Float(description='Extraction confidence for these pages (null if failed)'),
+    'question_count': fields.Integer(description='Questions found on these pages'),
+    'elapsed_ms': fields.Float(description='Time spent on this page group'),
+    'error': fields.String(description='Why this page group failed, if it did'),
+    'source': fields.String(description='text_layer (parsed from the PDF text) or vision (OCR by the model)')
+})
+
+image_prep_model = ocr_ns.model('OCRImagePrep', {
+    'pages': fields.Integer(description='Page images sent'),
+    'input_bytes': fields.Integer(description='Size of the uploaded file'),
+    'sent_bytes': fields.Integer(description='Size of the page images sent to the model'),
+    'bytes_saved': fields.Integer(description='Upload bytes not sent (images only; null for PDFs)'),
+    'baseline_tokens': fields.Integer(description='Estimated image tokens without preparation'),
+    'sent_tokens': fields.Integer(description='Estimated image tokens sent'),
+    'tokens_saved': fields.Integer(description='Estimated image tokens saved')
+})
+
+page_diagnostics_model = ocr_ns.model('OCRPageDiagnostics', {
+    'page': fields.Integer(description='Page number (1-based)'),
+    'action': fields.String(description='sent, rotated, skipped (blank) or rejected (unreadable)'),
+    'rotation': fields.Integer(description='Clockwise degrees the page was turned before OCR'),
+    'reason': fields.String(description='Why the page was skipped or rejected'),
+    'ink_share': fields.Float(description='Share of the page covered by marks'),
+    'contrast': fields.Float(description='Ink darkness against the paper (0-255)'),
+    'sharpness': fields.Float(description='Edge steepness relative to contrast (low when blurred)')
+})
+
+template_match_model = ocr_ns.model('OCRTemplateMatch', {
+    'id': fields.String(description='Template id'),
+    'name': fields.String(description='Template name'),
+    'overlap': fields.Float(description='Share of the template layout found on the worst-matching page'),
+    'explained': fields.Float(description='Share of the copy\'s ink lying on the template layout, on the worst-matching page')
+})
+
 ocr_result_model = ocr_ns.model('OCRResult', {
-    'extracted_text': fields.String(required=True, description='Complete raw text from document'),
+    'extracted_text': fields.String(required=True, description='Complete raw text from document; a one or two '
+                                                                'sentence summary, or empty, when the request\'s '
+                                                                'extracted_text option (default OCR_EXTRACTED_TEXT) '
+                                                                'is summary or none'),
     'structured_data': fields.Nested(structured_data_model, required=True, description='Structured questions'),
     'confidence_score': fields.Float(required=True, description='Extraction confidence (0.0-1.0)'),
-    'language': fields.String(required=True, description='Language used for extraction')
+    'language': fields.String(required=True, description='Language used for extraction'),
+    'pages': fields.List(fields.Nested(page_report_model), description='Per page group report (page-parallel or text-layer PDF OCR only)'),
+    'image_prep': fields.Nested(image_prep_model, description='Payload saved by image preparation (absent on cache hits)'),
+    'page_diagnostics': fields.List(fields.Nested(page_diagnostics_model), description='Pre-flight check of each page (absent on cache hits)'),
+    'template': fields.Nested(template_match_model, description='Registered exam this copy matched (questions and metadata come from it)')
+})
+
+template_model = ocr_ns.model('OCRTemplate', {
+    'id': fields.String(description='Template id'),
+    'name': fields.String(description='Template name'),
+    'language': fields.String(description='Language of the exam'),
+    'page_count': fields.Integer(description='Pages of the exam'),
+    'created_at': fields.Float(description='Registration time (Unix seconds)'),
+    'structure': fields.Nested(structured_data_model, description='Stored questions and metadata (without answers)')
+})
+
+template_success_model = ocr_ns.model('OCRTemplateSuccess', {
+    'success': fields.Boolean(default=True, description='Request success'),
+    'data': fields.Nested(template_model, description='Template')
+})
+
+template_list_model = ocr_ns.model('OCRTemplateList', {
+    'success': fields.Boolean(default=True, description='Request success'),
+    'data': fields.List(fields.Nested(template_model), description='Registered templates (without structure)')
 })
 
 success_model = ocr_ns.model('OCRSuccess', {
@@ -133,6 +221,12 @@ error_model = ocr_ns.model('OCRError', {
     'error': fields.String(description='Error message')
 })
 
+rejected_model = ocr_ns.model('OCRRejected', {
+    'success': fields.Boolean(default=False, description='Request failed'),
+    'error': fields.String(description='Error message'),
+    'page_diagnostics': fields.List(fields.Nested(page_diagnostics_model), description='Why each page was not sent')
+})
+
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.get_allowed_extensions()
@@ -143,7 +237,11 @@ def get_file_type(filename: str) -> str:
     return 'pdf' if ext in Config.ALLOWED_PDF_EXTENSIONS else 'image'
 
 
-def process_ocr(language: str):
+OCR_LANGUAGES = ('english', 'arabic', 'french')
+
+
+def _upload():
+    # (data, is_pdf, service options) of a valid OCR upload, or an error response
     if 'file' not in request.files:
         return {'success': False, 'error': 'No file provided'}, 400
     
@@ -155,29 +253,87 @@ def process_ocr(language: str):
     if not allowed_file(file.filename):
         return {'success': False, 'error': f'Invalid file type. Allowed: {", ".join(Config.get_allowed_extensions())}'}, 400
     
+    questions = None
+    if request.form.get('questions'):
+        try:
+            questions = [Question.model_validate(q).model_dump() for q in json.loads(request.form['questions'])]
+        except (ValueError, TypeError) as e:
+            return {'success': False, 'error': f'Invalid questions: {str(e)}'}, 400
+    
+    try:
+        output = {'question_types': parse_question_types(request.form.get('question_types')),
+                  'extracted_text': parse_text_mode(request.form.get('extracted_text'))}
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    return file.read(), get_file_type(file.filename) == 'pdf', {'questions': questions, 'output': output}
+
+
+def process_ocr(language: str):
+    upload = _upload()
+    if isinstance(upload[0], dict):
+        return upload
+    data, is_pdf, options = upload
+    
     try:
-        ocr = GeminiOCRService()
-        data = file.read()
+        ocr = get_service(GeminiOCRService)
         
-        if get_file_type(file.filename) == 'pdf':
-            result = ocr.process_pdf(data, language)
+        if is_pdf:
+            result = run_request(ocr.process_pdf_async(data, language, **options))
         else:
-            result = ocr.process_image(data, language)
+            result = run_request(ocr.process_image_async(data, language, **options))
         
         return {'success': True, 'data': result}, 200
-        
+    
+    except PageRejected as e:
+        return {'success': False, 'error': str(e), 'page_diagnostics': e.diagnostics}, 422
     except ValueError as e:
         return {'success': False, 'error': str(e)}, 500
     except Exception as e:
         return {'success': False, 'error': f'OCR failed: {str(e)}'}, 500
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_ocr(language: str):
+    """process_ocr as Server-Sent Events: `question` events as questions are read, then `result`.
+    
+    Failures after the stream has started arrive as an `error` event with
+    the body process_ocr would have returned.
+    """
+    upload = _upload()
+    if isinstance(upload[0], dict):
+        return upload
+    data, is_pdf, options = upload
+    level = request_priority()
+    
+    def events():
+        try:
+            with priority(level):
+                ocr = get_service(GeminiOCRService)
+                stream = ocr.stream_pdf if is_pdf else ocr.stream_image
+                for event, payload in stream(data, language, **options):
+                    yield _sse(event, payload)
+        except PageRejected as e:
+            yield _sse('error', {'success': False, 'error': str(e), 'page_diagnostics': e.diagnostics})
+        except ValueError as e:
+            yield _sse('error', {'success': False, 'error': str(e)})
+        except Exception as e:
+            yield _sse('error', {'success': False, 'error': f'OCR failed: {str(e)}'})
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @ocr_ns.route('/english')
 class EnglishOCR(Resource):
     @ocr_ns.doc('ocr_english', description='Extract English exam paper with all question types')
     @ocr_ns.expect(upload_parser)
     @ocr_ns.response(200, 'Extraction successful', success_model)
     @ocr_ns.response(400, 'Invalid request', error_model)
+    @ocr_ns.response(422, 'No readable pages (blurred or washed out)', rejected_model)
     @ocr_ns.response(500, 'Server error', error_model)
     def post(self):
         # Extract English exam - all question types
@@ -190,6 +346,7 @@ class ArabicOCR(Resource):
     @ocr_ns.expect(upload_parser)
     @ocr_ns.response(200, 'Extraction successful', success_model)
     @ocr_ns.response(400, 'Invalid request', error_model)
+    @ocr_ns.response(422, 'No readable pages (blurred or washed out)', rejected_model)
     @ocr_ns.response(500, 'Server error', error_model)
     def post(self):
         # Extract Arabic exam - all question types
@@ -202,7 +359,108 @@ class FrenchOCR(Resource):
     @ocr_ns.expect(upload_parser)
     @ocr_ns.response(200, 'Extraction successful', success_model)
     @ocr_ns.response(400, 'Invalid request', error_model)
+    @ocr_ns.response(422, 'No readable pages (blurred or washed out)', rejected_model)
     @ocr_ns.response(500, 'Server error', error_model)
     def post(self):
         # Extract French exam - all question types
         return process_ocr('french')
+
+
+@ocr_ns.route('/<string:language>/stream')
+@ocr_ns.param('language', 'english, arabic or french')
+class StreamingOCR(Resource):
+    @ocr_ns.doc('ocr_stream', description='Extract an exam paper as Server-Sent Events: a `question` event '
+                                         'for each question as soon as it is read, then the full `result` '
+                                         '(same data as the non-streaming endpoint), or an `error` event')
+    @ocr_ns.expect(upload_parser)
+    @ocr_ns.produces(['text/event-stream'])
+    @ocr_ns.response(200, 'Event stream')
+    @ocr_ns.response(400, 'Invalid request', error_model)
+    @ocr_ns.response(404, 'Unknown language', error_model)
+    def post(self, language):
+        if language not in OCR_LANGUAGES:
+            return {'success': False, 'error': f'Unknown language: {language}'}, 404
+        return stream_ocr(language)
+
+
+# ============ Exam Templates ============
+
+def _registry():
+    registry = get_template_registry()
+    if registry is None:
+        return None, ({'success': False, 'error': 'Exam templates are disabled (OCR_TEMPLATES=0)'}, 404)
+    return registry, None
+
+
+@ocr_ns.route('/templates')
+class ExamTemplates(Resource):
+    @ocr_ns.doc('list_templates', description='List registered exam templates')
+    @ocr_ns.response(200, 'Templates', template_list_model)
+    def get(self):
+        registry, error = _registry()
+        if error:
+            return error
+        return {'success': True, 'data': registry.templates()}, 200
+    
+    @ocr_ns.doc('register_template', description='Register a blank or answer-key exam. Later copies of it '
+                                                  '(matched by page layout) reuse its questions, and only the '
+                                                  'student answers are extracted.')
+    @ocr_ns.expect(template_parser)
+    @ocr_ns.response(201, 'Template registered', template_success_model)
+    @ocr_ns.response(400, 'Invalid request', error_model)
+    @ocr_ns.response(422, 'No questions found on the exam, or no readable pages', error_model)
+    @ocr_ns.response(500, 'Server error', error_model)
+    def post(self):
+        registry, error = _registry()
+        if error:
+            return error
+        
+        args = template_parser.parse_args()
+        file = args['file']
+        if not file or file.filename == '' or not allowed_file(file.filename):
+            return {'success': False, 'error': f'Invalid file type. Allowed: {", ".join(Config.get_allowed_extensions())}'}, 400
+        
+        try:
+            ocr = get_service(GeminiOCRService)
+            data = file.read()
+            is_pdf = get_file_type(file.filename) == 'pdf'
+            if is_pdf:
+                result = run_request(ocr.process_pdf_async(data, args['language'], use_templates=False))
+            else:
+                result = run_request(ocr.process_image_async(data, args['language'], use_templates=False))
+            
+            template = registry.register(args['name'], args['language'],
+                                         fingerprint_document(data, is_pdf), result['structured_data'])
+            return {'success': True, 'data': template}, 201
+        
+        except PageRejected as e:
+            return {'success': False, 'error': str(e), 'page_diagnostics': e.diagnostics}, 422
+        except EmptyTemplate as e:
+            return {'success': False, 'error': str(e)}, 422
+        except Exception as e:
+            return {'success': False, 'error': f'Template registration failed: {str(e)}'}, 500
+
+
+@ocr_ns.route('/templates/<string:template_id>')
+class ExamTemplate(Resource):
+    @ocr_ns.doc('get_template', description='A registered exam template with its question structure')
+    @ocr_ns.response(200, 'Template', template_success_model)
+    @ocr_ns.response(404, 'Not found', error_model)
+    def get(self, template_id):
+        registry, error = _registry()
+        if error:
+            return error
+        template = registry.get(template_id)
+        if template is None:
+            return {'success': False, 'error': f'Template {template_id} not found'}, 404
+        return {'success': True, 'data': template}, 200
+    
+    @ocr_ns.doc('delete_template', description='Remove a registered exam template')
+    @ocr_ns.response(404, 'Not found', error_model)
+    def delete(self, template_id):
+        registry, error = _registry()
+        if error:
+            return error
+        if not registry.delete(template_id):
+            return {'success': False, 'error': f'Template {template_id} not found'}, 404
+        return {'success': True}, 200
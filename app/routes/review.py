@@ -1118,7 +1118,9 @@ def finalize_review():
 @review_bp.route('/api/review/detect', methods=['POST'])
 def detect_existing():
     """Integrated detection for existing annotations in the review workflow."""
-    from app.services import annotation_service
+    from app.services.annotation_service import AnnotationService
+    from app.services.gemini_client import get_service
+    from app.routes.async_support import run_request
     try:
         data = request.get_json()
         image_data = data.get('image', '')
@@ -1131,6 +1133,7 @@ def detect_existing():
             return jsonify(json.loads(image.info['gradeo_annotations']))
             
         # Fallback to AI
-        return jsonify(annotation_service.detect_existing_annotations(image_bytes))
+        service = get_service(AnnotationService)
+        return jsonify(run_request(service.detect_existing_annotations_async(image_bytes)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,13 +1,19 @@
 # Annotation service using grid-based positioning
 # Shows: checkmarks, X marks, scores, correct answers, and feedback
+import asyncio
 import io
 import base64
 import json
+import logging
 from typing import Dict, Any
 from PIL import Image, ImageDraw, ImageFont
-from google import genai
 
 from app.config import Config
+from app.services.gemini_client import get_client
+from app.services.response_cache import get_response_cache, make_key
+
+
+logger = logging.getLogger(__name__)
 
 
 class AnnotationService:
@@ -19,11 +25,53 @@ class AnnotationService:
     """
     
     GRID_SIZE = 20
+    CACHE_NAMESPACE = 'annotation'  # Opt-in key for RESPONSE_CACHE_SERVICES
+    JSON_CONFIG = {"response_mime_type": "application/json"}
     
     def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        self.client = get_client()
+    
+    def _generate_json(self, contents: list) -> Dict[str, Any]:
+        """Call Gemini for JSON, reusing cached responses for identical images."""
+        cache, key, text = self._cached_json(contents)
+        if text is None:
+            response = self.client.models.generate_content(
+                model=Config.GEMINI_MODEL,
+                contents=contents,
+                config=self.JSON_CONFIG
+            )
+            text = response.text
+            result = json.loads(text)
+            if cache:
+                cache.set(key, text)
+            return result
+        return json.loads(text)
+    
+    async def _generate_json_async(self, contents: list) -> Dict[str, Any]:
+        """_generate_json on the async client."""
+        cache, key = self._cache_slot(contents)
+        text = await cache.get_async(key) if cache else None
+        if text is None:
+            response = await self.client.aio.models.generate_content(
+                model=Config.GEMINI_MODEL,
+                contents=contents,
+                config=self.JSON_CONFIG
+            )
+            text = response.text
+            result = json.loads(text)
+            if cache:
+                await cache.set_async(key, text)
+            return result
+        return json.loads(text)
+    
+    def _cache_slot(self, contents: list):
+        cache = get_response_cache(self.CACHE_NAMESPACE)
+        key = make_key(self.CACHE_NAMESPACE, Config.GEMINI_MODEL, contents, self.JSON_CONFIG) if cache else None
+        return cache, key
+    
+    def _cached_json(self, contents: list):
+        cache, key = self._cache_slot(contents)
+        return cache, key, cache.get(key) if cache else None
     
     def _create_grid_overlay(self, image: Image.Image) -> bytes:
         """Create image with grid overlay."""
@@ -55,8 +103,8 @@ class AnnotationService:
         overlay.save(buffer, format='PNG')
         return buffer.getvalue()
     
-    def _detect_grid_positions(self, grid_image: bytes, num_questions: int) -> Dict[str, Any]:
-        """Detect positions using grid."""
+    def _grid_contents(self, grid_image: bytes, num_questions: int) -> list:
+        """Prompt and image for grid position detection."""
         
         prompt = f"""This image has a 20x20 grid (cols 0-19, rows 0-19).
 There are {num_questions} questions on this exam.
@@ -111,24 +159,32 @@ ORDERING QUESTIONS:
 
 VERIFY: Make sure answer_row increases from q1 to q2 to q3 (unless multi-column or diagram)."""
 
+        image_b64 = base64.b64encode(grid_image).decode('utf-8')
+        return [
+            {"text": prompt},
+            {"inline_data": {"mime_type": "image/png", "data": image_b64}}
+        ]
+    
+    def _detect_grid_positions(self, grid_image: bytes, num_questions: int) -> Dict[str, Any]:
+        """Detect positions using grid."""
         try:
-            image_b64 = base64.b64encode(grid_image).decode('utf-8')
-            
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[
-                    {"text": prompt},
-                    {"inline_data": {"mime_type": "image/png", "data": image_b64}}
-                ],
-                config={"response_mime_type": "application/json"}
-            )
+            result = self._generate_json(self._grid_contents(grid_image, num_questions))
+            logger.debug("Grid positions: %s", json.dumps(result, indent=2))
+            return result
             
-            result = json.loads(response.text)
-            print(f"Grid positions: {json.dumps(result, indent=2)}")
+        except Exception as e:
+            logger.warning("Grid detection failed, using the default grid: %s", e)
+            return self._default_grid(num_questions)
+    
+    async def _detect_grid_positions_async(self, grid_image: bytes, num_questions: int) -> Dict[str, Any]:
+        """Detect positions using grid, on the async client."""
+        try:
+            result = await self._generate_json_async(self._grid_contents(grid_image, num_questions))
+            logger.debug("Grid positions: %s", json.dumps(result, indent=2))
             return result
             
         except Exception as e:
-            print(f"Error: {e}")
+            logger.warning("Grid detection failed, using the default grid: %s", e)
             return self._default_grid(num_questions)
     
     def _default_grid(self, n: int) -> Dict[str, Any]:
@@ -153,12 +209,9 @@ VERIFY: Make sure answer_row increases from q1 to q2 to q3 (unless multi-column
         y = int((row + 0.5) * cell_h)
         return x, y
     
-    def detect_existing_annotations(self, image_bytes: bytes) -> Dict[str, Any]:
-        """Detect existing annotations in an image using AI vision."""
-        image = Image.open(io.BytesIO(image_bytes))
-        width, height = image.size
-        
-        prompt = f"""Analyze this graded exam image and detect ALL existing annotations.
+    def _annotations_prompt(self, width: int, height: int) -> str:
+        """Prompt for detecting existing annotations on a graded image."""
+        return f"""Analyze this graded exam image and detect ALL existing annotations.
 
 IMPORTANT: Each question has a COMBINED annotation with:
 - An ICON (checkmark ✓, X mark ✗, or dash —) in a white circle
@@ -196,17 +249,35 @@ Return JSON:
     ]
 }}"""
 
+    
+    def detect_existing_annotations(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Detect existing annotations in an image using AI vision."""
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        
         try:
             image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[
-                    {"text": prompt},
-                    {"inline_data": {"mime_type": "image/png", "data": image_b64}}
-                ],
-                config={"response_mime_type": "application/json"}
-            )
-            result = json.loads(response.text)
+            result = self._generate_json([
+                {"text": self._annotations_prompt(width, height)},
+                {"inline_data": {"mime_type": "image/png", "data": image_b64}}
+            ])
+            result['image_width'] = width
+            result['image_height'] = height
+            return result
+        except Exception as e:
+            return {"annotations": [], "image_width": width, "image_height": height, "error": str(e)}
+    
+    async def detect_existing_annotations_async(self, image_bytes: bytes) -> Dict[str, Any]:
+        """detect_existing_annotations on the async client."""
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        
+        try:
+            image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+            result = await self._generate_json_async([
+                {"text": self._annotations_prompt(width, height)},
+                {"inline_data": {"mime_type": "image/png", "data": image_b64}}
+            ])
             result['image_width'] = width
             result['image_height'] = height
             return result
@@ -385,11 +456,13 @@ Return JSON:
     def annotate_exam(self, exam_file: bytes, file_type: str,
                       grading_results: Dict[str, Any], 
                       language: str = 'en',
-                      draw_on_image: bool = True) -> Dict[str, Any]:
+                      draw_on_image: bool = True,
+                      grid_positions: Dict[str, Any] = None) -> Dict[str, Any]:
         """Annotate exam with marks, scores, correct answers, and feedback.
         
         Args:
             language: 'en', 'ar', or 'fr' for localized labels
+            grid_positions: already detected positions (skips the Gemini call)
         """
         
         image = Image.open(io.BytesIO(exam_file))
@@ -451,8 +524,10 @@ Return JSON:
             }
         
         # Detect grid positions
-        grid_image = self._create_grid_overlay(image)
-        grid_pos = self._detect_grid_positions(grid_image, num_q)
+        grid_pos = grid_positions
+        if grid_pos is None:
+            grid_image = self._create_grid_overlay(image)
+            grid_pos = self._detect_grid_positions(grid_image, num_q)
         
         draw = ImageDraw.Draw(image)
         
@@ -687,3 +762,23 @@ Return JSON:
             'method': 'grid_complete',
             'is_draft': not draw_on_image
         }
+    
+    async def annotate_exam_async(self, exam_file: bytes, file_type: str,
+                                  grading_results: Dict[str, Any], 
+                                  language: str = 'en',
+                                  draw_on_image: bool = True) -> Dict[str, Any]:
+        """annotate_exam with the grid detection awaited on the async client.
+        
+        Pillow work (grid overlay and drawing) runs in a worker thread so the
+        event loop stays free for other requests.
+        """
+        grid_pos = None
+        num_q = len(grading_results.get('questions', []))
+        if num_q:
+            grid_image = await asyncio.to_thread(
+                lambda: self._create_grid_overlay(Image.open(io.BytesIO(exam_file)).convert('RGBA'))
+            )
+            grid_pos = await self._detect_grid_positions_async(grid_image, num_q)
+        
+        return await asyncio.to_thread(self.annotate_exam, exam_file, file_type, grading_results,
+                                       language, draw_on_image, grid_pos)
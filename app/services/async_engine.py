@@ -0,0 +1,76 @@
+# Process-wide event loop for the async Gemini paths
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Optional
+
+from app.config import Config
+
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the worker's shared event loop, starting it on first use.
+
+    One long-lived loop keeps the async client's connection pool bound to a
+    single loop, and lets every in-flight request share it.
+    """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='gemini-async', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = None,
+              cancelled: Optional[Callable[[], bool]] = None) -> Any:
+    """Run `coro` on the shared loop and block the calling thread for its result.
+
+    The coroutine is cancelled, together with its in-flight Gemini requests,
+    once `timeout` seconds pass (TimeoutError, default
+    ASYNC_REQUEST_TIMEOUT_SECONDS) or `cancelled()` returns True
+    (RequestCancelled); `cancelled` is polled every
+    ASYNC_DISCONNECT_POLL_SECONDS.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    timeout = Config.ASYNC_REQUEST_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    try:
+        while True:
+            step = Config.ASYNC_DISCONNECT_POLL_SECONDS if cancelled else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'Request exceeded {timeout:g}s')
+                step = remaining if step is None else min(step, remaining)
+            
+            done, _ = wait([future], timeout=step, return_when=FIRST_COMPLETED)
+            if done:
+                return future.result()
+            if cancelled and cancelled():
+                raise RequestCancelled('Client disconnected')
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+def _reset_after_fork():
+    # The loop thread does not survive fork; the child starts its own
+    global _lock, _loop
+    _lock = threading.Lock()
+    _loop = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,230 @@
+# Single-request multi-candidate sampling for AI grading passes
+import asyncio
+from typing import Any, Dict, List, Set
+
+from app.config import Config
+from app.services.consensus import FailedPass
+from app.services.pass_executor import async_call_slot, call_slot, run_passes, run_passes_async
+from app.services.response_cache import get_response_cache, make_key
+
+
+JSON_CONFIG = {"response_mime_type": "application/json"}
+
+# Models whose backend rejected candidate_count; they use separate calls from then on
+_unsupported_models: Set[str] = set()
+
+
+class CandidateSamplingUnsupported(Exception):
+    pass
+
+
+def _candidate_text(candidate: Any) -> str:
+    content = getattr(candidate, 'content', None)
+    parts = getattr(content, 'parts', None) or []
+    return ''.join(getattr(part, 'text', None) or '' for part in parts)
+
+
+def _check_candidates_supported(client: Any, model: str) -> None:
+    # Backends that know they cannot sample (supports_candidates=False) are not asked
+    if model in _unsupported_models or getattr(client, 'supports_candidates', True) is False:
+        raise CandidateSamplingUnsupported(model)
+
+
+def _rejected_candidates(model: str, error: Exception) -> bool:
+    # Remember models whose backend refuses candidate_count: a 400 INVALID_ARGUMENT
+    # about candidates, not any failure that happens to mention them
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if code == 400 and 'candidate' in str(error).lower():
+        _unsupported_models.add(model)
+        return True
+    return False
+
+
+def _response_texts(response: Any) -> List[str]:
+    return [_candidate_text(c) for c in (getattr(response, 'candidates', None) or [])]
+
+
+def generate_candidates(client: Any, contents: List[Any], n: int,
+                        config: Dict[str, Any] = JSON_CONFIG) -> List[str]:
+    """Ask for n candidates in one request and return their texts.
+
+    The prompt's input tokens are sent and processed once for all n passes.
+    Raises CandidateSamplingUnsupported when the backend cannot sample or
+    rejects candidate_count.
+    """
+    model = Config.GEMINI_MODEL
+    _check_candidates_supported(client, model)
+    
+    try:
+        response = client.models.generate_content(
+            model=model,
+            contents=contents,
+            config={**config, "candidate_count": n}
+        )
+    except Exception as e:
+        if _rejected_candidates(model, e):
+            raise CandidateSamplingUnsupported(model) from e
+        raise
+    
+    return _response_texts(response)
+
+
+async def generate_candidates_async(client: Any, contents: List[Any], n: int,
+                                    config: Dict[str, Any] = JSON_CONFIG) -> List[str]:
+    # generate_candidates on the SDK's async client
+    model = Config.GEMINI_MODEL
+    _check_candidates_supported(client, model)
+    
+    try:
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config={**config, "candidate_count": n}
+        )
+    except Exception as e:
+        if _rejected_candidates(model, e):
+            raise CandidateSamplingUnsupported(model) from e
+        raise
+    
+    return _response_texts(response)
+
+
+def _cache_for(service: Any):
+    return get_response_cache(getattr(service, 'CACHE_NAMESPACE', ''))
+
+
+def _cache_key(service: Any, contents: List[Any], variant: int) -> str:
+    # Pass index is part of the key so cached passes keep their independent votes
+    return make_key(service.CACHE_NAMESPACE, Config.GEMINI_MODEL, contents, JSON_CONFIG, variant)
+
+
+def call_json(service: Any, contents: List[Any], variant: int = 0) -> Dict[str, Any]:
+    """One Gemini request parsed with the service's hooks.
+
+    Services provide `client`, `_parse_response(text)` and `_error_response(error)`;
+    a failure (after the client's retries) becomes the service's neutral error
+    result for that pass, wrapped as a FailedPass.
+    Services listed in RESPONSE_CACHE_SERVICES reuse the stored response of
+    pass `variant` for identical contents; only parsable responses are stored.
+    """
+    cache = _cache_for(service)
+    key = _cache_key(service, contents, variant) if cache else None
+    try:
+        text = cache.get(key) if cache else None
+        if text is not None:
+            return service._parse_response(text)
+        
+        response = service.client.models.generate_content(
+            model=Config.GEMINI_MODEL,
+            contents=contents,
+            config=JSON_CONFIG
+        )
+        result = service._parse_response(response.text)
+        if cache:
+            cache.set(key, response.text)
+        return result
+    except Exception as e:
+        return FailedPass(service._error_response(e))
+
+
+async def call_json_async(service: Any, contents: List[Any], variant: int = 0) -> Dict[str, Any]:
+    # call_json on the SDK's async client (client.aio)
+    cache = _cache_for(service)
+    key = _cache_key(service, contents, variant) if cache else None
+    try:
+        text = await cache.get_async(key) if cache else None
+        if text is not None:
+            return service._parse_response(text)
+        
+        response = await service.client.aio.models.generate_content(
+            model=Config.GEMINI_MODEL,
+            contents=contents,
+            config=JSON_CONFIG
+        )
+        result = service._parse_response(response.text)
+        if cache:
+            await cache.set_async(key, response.text)
+        return result
+    except Exception as e:
+        return FailedPass(service._error_response(e))
+
+
+def _cached_passes(service: Any, contents: List[Any], variants: List[int]) -> Dict[int, Dict[str, Any]]:
+    cache = _cache_for(service)
+    results: Dict[int, Dict[str, Any]] = {}
+    if cache:
+        for variant in variants:
+            text = cache.get(_cache_key(service, contents, variant))
+            if text is not None:
+                try:
+                    results[variant] = service._parse_response(text)
+                except Exception:
+                    pass
+    return results
+
+
+def _accept_candidates(service: Any, contents: List[Any], variants: List[int],
+                       texts: List[str], results: Dict[int, Dict[str, Any]]) -> None:
+    # Parse candidate texts into the given passes; unparsable ones stay missing
+    cache = _cache_for(service)
+    for variant, text in zip(variants, texts):
+        try:
+            results[variant] = service._parse_response(text)
+        except Exception:
+            continue
+        if cache:
+            cache.set(_cache_key(service, contents, variant), text)
+
+
+def sample_passes(service: Any, contents: List[Any], n: int, start: int = 0) -> List[Dict[str, Any]]:
+    """Return grading passes start .. start+n-1 for the same contents.
+
+    With GRADING_CANDIDATE_SAMPLING on, the passes come from the candidates of a
+    single request; missing or unparsable candidates and unsupported backends
+    fall back to separate concurrent calls, so the vote always gets n passes.
+    """
+    variants = list(range(start, start + n))
+    if not Config.GRADING_CANDIDATE_SAMPLING or n <= 1:
+        return run_passes(lambda i: call_json(service, contents, variants[i]), n)
+    
+    results = _cached_passes(service, contents, variants)
+    missing = [v for v in variants if v not in results]
+    if len(missing) > 1:
+        try:
+            with call_slot():
+                texts = generate_candidates(service.client, contents, len(missing))
+            _accept_candidates(service, contents, missing, texts, results)
+        except Exception:
+            pass
+    
+    missing = [v for v in variants if v not in results]
+    if missing:
+        fallback = run_passes(lambda i: call_json(service, contents, missing[i]), len(missing))
+        results.update(zip(missing, fallback))
+    return [results[v] for v in variants]
+
+
+async def sample_passes_async(service: Any, contents: List[Any], n: int,
+                              start: int = 0) -> List[Dict[str, Any]]:
+    # sample_passes on the async client; same caching and fallbacks
+    variants = list(range(start, start + n))
+    if not Config.GRADING_CANDIDATE_SAMPLING or n <= 1:
+        return await run_passes_async(lambda i: call_json_async(service, contents, variants[i]), n)
+    
+    # The cache is SQLite-backed: read and write it off the event loop
+    results = await asyncio.to_thread(_cached_passes, service, contents, variants)
+    missing = [v for v in variants if v not in results]
+    if len(missing) > 1:
+        try:
+            async with async_call_slot():
+                texts = await generate_candidates_async(service.client, contents, len(missing))
+            await asyncio.to_thread(_accept_candidates, service, contents, missing, texts, results)
+        except Exception:
+            pass
+    
+    missing = [v for v in variants if v not in results]
+    if missing:
+        fallback = await run_passes_async(lambda i: call_json_async(service, contents, missing[i]),
+                                          len(missing))
+        results.update(zip(missing, fallback))
+    return [results[v] for v in variants]
@@ -0,0 +1,140 @@
+# Vectorized whole-class grading: students x items answer-code matrices scored with NumPy
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.services.grading import AnswerKey, GradingService
+
+
+BLANK = 0  # Code of a missing or empty answer; never correct
+
+
+class ClassAnswerKey:
+    """An exam's answer key as integer code arrays, for grading a whole class at once.
+    
+    Every distinct normalized answer gets an integer code (BLANK for none),
+    so a class is a students x items int32 matrix (see AnswerKey.columns for
+    the items) and grading is one array comparison per accepted code. A
+    key item accepts up to a handful of codes (true/false equivalents), kept
+    as the columns of `accepted`, padded with -1. Scores equal those of the
+    GradingService method for `mode`.
+    """
+    
+    def __init__(self, questions: List[Dict[str, Any]], mode: str = 'ordered', default_points: float = 1.0):
+        self.answer_key = AnswerKey(questions, mode, default_points)
+        self.mode = mode
+        self.columns = self.answer_key.columns()
+        self.vocabulary: List[str] = ['']  # Code -> normalized answer
+        self._codes: Dict[str, int] = {'': BLANK}
+        self._answer_codes: Dict[Optional[str], int] = {None: BLANK}  # Raw answer string -> code
+        
+        width = max((len(c['accepted']) for c in self.columns), default=0)
+        self.accepted = np.full((len(self.columns), max(width, 1)), -1, dtype=np.int32)
+        for i, column in enumerate(self.columns):
+            for j, answer in enumerate(sorted(column['accepted'])):
+                self.accepted[i, j] = self._intern(answer)
+        self.points = np.array([float(c['points']) for c in self.columns], dtype=np.float64)
+        
+        # Items of one question are adjacent: question i spans columns starts[i]:starts[i + 1]
+        index = [c['question_index'] for c in self.columns]
+        self.question_starts = np.array([i for i in range(len(index)) if i == 0 or index[i] != index[i - 1]],
+                                        dtype=np.intp)
+        self.question_numbers = [self.columns[i]['question_number'] for i in self.question_starts]
+    
+    def _intern(self, normalized: str) -> int:
+        code = self._codes.get(normalized)
+        if code is None:
+            code = self._codes[normalized] = len(self.vocabulary)
+            self.vocabulary.append(normalized)
+        return code
+    
+    def code(self, answer: Any) -> int:
+        """Integer code of one raw answer (normalized as GradingService does)."""
+        if answer.__class__ is str:
+            code = self._answer_codes.get(answer)
+            if code is None:
+                code = self._answer_codes[answer] = self._intern(GradingService.normalize_answer(answer))
+            return code
+        return self._intern(GradingService.normalize_answer(answer))
+    
+    def encode_rows(self, rows: Iterable[List[Any]]) -> np.ndarray:
+        """Code matrix of raw answer rows, one answer per column in columns() order.
+        
+        Short rows are padded with BLANK; extra answers are ignored.
+        """
+        width = len(self.columns)
+        answers = []
+        count = 0
+        for count, row in enumerate(rows, 1):
+            row = row[:width]
+            answers.extend(row)
+            if len(row) < width:
+                answers.extend([None] * (width - len(row)))
+        # Answer strings (and None) are looked up in C-level passes: new distinct
+        # strings are coded first; other values (numbers, lists) are coded one by one
+        try:
+            codes = list(map(self._answer_codes.get, answers))
+            if None in codes:
+                for answer in dict.fromkeys(answers):
+                    if answer.__class__ is str:
+                        self.code(answer)
+                codes = list(map(self._answer_codes.get, answers))
+        except TypeError:  # Unhashable answers (lists, dicts)
+            codes = [None] * len(answers)
+        if None in codes:
+            codes = [self.code(answer) if code is None else code for answer, code in zip(answers, codes)]
+        return np.array(codes, dtype=np.int32).reshape(count, width)
+    
+    def encode(self, students: Iterable[Dict[str, Any]]) -> np.ndarray:
+        """Code matrix of student_answers dicts (the single-student API format)."""
+        return self.encode_rows(self.answer_key.row(answers or {}) for answers in students)
+    
+    def correct(self, codes: np.ndarray) -> np.ndarray:
+        """Students x items boolean matrix: which answers the key accepts."""
+        is_correct = codes == self.accepted[:, 0]
+        for j in range(1, self.accepted.shape[1]):
+            is_correct |= codes == self.accepted[:, j]
+        return is_correct
+    
+    def score(self, codes: np.ndarray) -> Dict[str, Any]:
+        """Per-student totals and per-question correctness for a code matrix.
+        
+        Arrays are indexed by student (rows of `codes`), then by item
+        (`correct`, as in columns) or question (`question_points`).
+        """
+        is_correct = self.correct(codes)
+        earned = is_correct * self.points
+        question_points = (np.add.reduceat(earned, self.question_starts, axis=1) if len(self.columns)
+                           else np.zeros((len(codes), 0)))
+        points_earned = earned.sum(axis=1)
+        points_possible = float(self.points.sum())
+        percentage = points_earned / points_possible * 100 if points_possible > 0 else np.zeros(len(codes))
+        return {
+            'question_type': self.mode,
+            'student_count': len(codes),
+            'points_possible': points_possible,
+            'points_earned': points_earned,
+            'percentage': percentage,
+            'correct_count': is_correct.sum(axis=1),
+            'correct': is_correct,
+            'question_points': question_points,
+            'question_possible': (np.add.reduceat(self.points, self.question_starts) if len(self.columns)
+                                  else np.zeros(0))
+        }
+
+
+def grade_class_matrix(questions: List[Dict[str, Any]], mode: str = 'ordered', default_points: float = 1.0,
+                       students: Optional[Iterable[Dict[str, Any]]] = None,
+                       rows: Optional[Iterable[List[Any]]] = None) -> Dict[str, Any]:
+    """Vectorized grading of a class given as student_answers dicts or as answer rows.
+    
+    Returns ClassAnswerKey.score() plus the key's columns (without the
+    accepted sets).
+    """
+    key = ClassAnswerKey(questions, mode, default_points)
+    codes = key.encode_rows(rows) if rows is not None else key.encode(students or [])
+    result = key.score(codes)
+    result['columns'] = [{field: c[field] for field in ('question_index', 'question_number', 'item', 'points', 'correct_answer')}
+                         for c in key.columns]
+    result['question_numbers'] = key.question_numbers
+    return result
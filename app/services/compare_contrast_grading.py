@@ -1,19 +1,16 @@
 # Compare/Contrast grading service using Gemini AI
 import json
 from typing import Dict, Any, List
-from collections import Counter
-from google import genai
 
 from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader
 
 
-class CompareContrastGradingService:
+class CompareContrastGradingService(MultiPassGrader):
     # Grade compare/contrast questions using checklist items and multi-pass grading
     
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+    CACHE_NAMESPACE = 'compare_contrast'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     def _build_grading_prompt(self, student_answer: str, 
                                grading_table: List[Dict[str, Any]]) -> str:
@@ -48,36 +45,32 @@ Return ONLY valid JSON in this exact format:
 Include an entry for EVERY checklist item in order."""
         return prompt
     
-    def _call_gemini(self, prompt: str) -> Dict[str, Any]:
-        # Call Gemini and parse JSON response
-        try:
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[prompt],
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            return {"error": str(e), "items": []}
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        return json.loads(text)
     
-    def _calculate_mode_or_median(self, statuses: List[str]) -> str:
-        # Get mode (most frequent), or median if all different
-        counts = Counter(statuses)
-        
-        # Mode: find status appearing 2+ times
-        for status, count in counts.items():
-            if count >= 2:
-                return status
-        
-        # Median: order is absent < partial < present
-        order = {'absent': 0, 'partial': 1, 'present': 2}
-        sorted_statuses = sorted(statuses, key=lambda x: order.get(x, 1))
-        return sorted_statuses[len(sorted_statuses) // 2]
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        return {"error": str(e), "items": []}
+    
+    def _collect_votes(self, pass_results: List[Dict[str, Any]], 
+                       item_count: int) -> Dict[int, List[str]]:
+        # Status of each checklist item in every pass (missing/invalid -> partial)
+        votes = {}
+        for i in range(item_count):
+            statuses = []
+            for pr in pass_results:
+                items = pr.get('items', [])
+                if i < len(items):
+                    status = items[i].get('status', 'partial')
+                    if status not in ['present', 'partial', 'absent']:
+                        status = 'partial'
+                    statuses.append(status)
+                else:
+                    statuses.append('partial')
+            votes[i] = statuses
+        return votes
     
-    def grade_question(self, question: Dict[str, Any], 
-                       student_answer: str) -> Dict[str, Any]:
+    def _grade_steps(self, question: Dict[str, Any], 
+                     student_answer: str) -> GradingSteps:
         # Grade a single compare/contrast question
         grading_table = question.get('grading_table', [])
         total_points = question.get('points', 0)
@@ -118,35 +111,23 @@ Include an entry for EVERY checklist item in order."""
                 'total_percentage': 0
             }
         
-        # Run multiple grading passes
+        # Run grading passes concurrently
         prompt = self._build_grading_prompt(student_answer, grading_table)
-        pass_results = []
-        
-        for _ in range(Config.OPEN_ENDED_GRADING_PASSES):
-            result = self._call_gemini(prompt)
-            pass_results.append(result)
+        collect_votes = lambda results: self._collect_votes(results, len(grading_table))
+        pass_results = yield Consensus([prompt], collect_votes, Config.OPEN_ENDED_GRADING_PASSES)
         
         # Calculate mode/median for each item and track variance
         final_statuses = []
         high_variance_items = []
         
-        for i in range(len(grading_table)):
-            statuses = []
-            for pr in pass_results:
-                items = pr.get('items', [])
-                if i < len(items):
-                    status = items[i].get('status', 'partial')
-                    if status not in ['present', 'partial', 'absent']:
-                        status = 'partial'
-                    statuses.append(status)
-                else:
-                    statuses.append('partial')
+        for i, statuses in collect_votes(pass_results).items():
+            final_status, flagged = resolve_vote(statuses)
             
             # Flag if all passes differ (high variance)
-            if len(set(statuses)) == len(statuses) and len(statuses) >= 3:
+            if flagged:
                 high_variance_items.append(i)
             
-            final_statuses.append(self._calculate_mode_or_median(statuses))
+            final_statuses.append(final_status)
         
         # Calculate scores (CODE, not LLM)
         item_results = []
@@ -186,7 +167,7 @@ Include an entry for EVERY checklist item in order."""
             'question_number': q_num,
             'student_answer': student_answer[:200] + '...' if len(student_answer) > 200 else student_answer,
             'item_results': item_results,
-            'grading_passes': Config.OPEN_ENDED_GRADING_PASSES,
+            'grading_passes': len(pass_results),
             'flag_for_review': len(high_variance_items) > 0,
             'high_variance_items': high_variance_items,
             'points_earned': round(total_earned, 2),
@@ -194,21 +175,14 @@ Include an entry for EVERY checklist item in order."""
             'total_percentage': round((total_earned / total_possible * 100) if total_possible > 0 else 0, 2)
         }
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_answers: Dict[str, str]) -> Dict[str, Any]:
-        # Grade multiple compare/contrast questions
-        results = []
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Summarize the graded compare/contrast questions
         total_earned = 0.0
         total_possible = 0.0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            student_answer = student_answers.get(q_num, '')
-            
-            result = self.grade_question(q, student_answer)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -219,6 +193,7 @@ Include an entry for EVERY checklist item in order."""
             'question_type': 'compare_contrast',
             'total_questions': len(questions),
             'grading_passes_per_question': Config.OPEN_ENDED_GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'flagged_for_review': flagged_count,
             'points_earned': round(total_earned, 2),
             'points_possible': round(total_possible, 2),
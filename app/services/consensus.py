@@ -0,0 +1,102 @@
+# Shared consensus engine for multi-pass AI grading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from app.config import Config
+
+
+# Median order for the status scales used by the graders
+STATUS_ORDER = {'absent': 0, 'partial': 1, 'present': 2, 'full': 2}
+
+
+class FailedPass(dict):
+    """The service's error result for a pass whose call failed after retries.
+
+    Behaves like the plain error dict, but run_until_consensus keeps it out
+    of the vote and draws a replacement pass instead.
+    """
+
+
+VoteCollector = Callable[[List[Any]], Dict[Hashable, List[str]]]
+
+
+def resolve_vote(statuses: List[str], order: Dict[str, int] = STATUS_ORDER) -> Tuple[str, bool]:
+    """Return (final_status, flag_for_review) for one criterion.
+
+    The mode wins when any status repeats; otherwise every pass disagreed and
+    the median is used and the criterion is flagged for review.
+    """
+    counts = Counter(statuses)
+    most_common = counts.most_common()
+    
+    if most_common and most_common[0][1] > 1:
+        return most_common[0][0], False
+    
+    sorted_statuses = sorted(statuses, key=lambda s: order.get(s, 1))
+    return sorted_statuses[len(sorted_statuses) // 2], True
+
+
+def _is_decided(votes: Dict[Hashable, List[str]], remaining: int) -> bool:
+    # A key is decided when the remaining passes cannot overturn its leader
+    for statuses in votes.values():
+        ranked = Counter(statuses).most_common(2)
+        leader = ranked[0][1] if ranked else 0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if leader - runner_up <= remaining:
+            return False
+    return True
+
+
+def _has_mode(votes: Dict[Hashable, List[str]]) -> bool:
+    return all(Counter(statuses).most_common(1)[0][1] > 1 if statuses else False
+               for statuses in votes.values())
+
+
+def _next_draw(results: List[Any], collect_votes: VoteCollector, passes: int) -> int:
+    # Number of passes to draw next; 0 once the vote is settled
+    if not results:
+        if not Config.GRADING_EARLY_STOP or passes <= 1:
+            return passes
+        return passes // 2 + 1
+    if len(results) < passes and not _is_decided(collect_votes(results), passes - len(results)):
+        return 1
+    if len(results) < max(passes, Config.GRADING_MAX_PASSES) and not _has_mode(collect_votes(results)):
+        return 1
+    return 0
+
+
+def run_until_consensus(draw: Callable[[int, int], List[Any]], collect_votes: VoteCollector,
+                        passes: int) -> List[Any]:
+    """Run grading passes until the vote of every criterion is settled.
+
+    Starts with the smallest number of passes that can form a majority of
+    `passes` and adds one pass at a time only while some criterion could
+    still change. If all `passes` passes leave a criterion without a mode,
+    escalates up to GRADING_MAX_PASSES before falling back to the median.
+    The final statuses are identical to always running `passes` passes.
+    Failed passes do not vote; they are redrawn, up to
+    GRADING_MAX_FAILED_PASSES, and only returned when no pass succeeded.
+    `draw(start, n)` returns passes start .. start+n-1 (see sample_passes).
+    Returns the pass results in order; len() is the number of passes used.
+    """
+    results: List[Any] = []
+    failed: List[Any] = []
+    n = _next_draw(results, collect_votes, passes)
+    while n and len(failed) < Config.GRADING_MAX_FAILED_PASSES:
+        for result in draw(len(results) + len(failed), n):
+            (failed if isinstance(result, FailedPass) else results).append(result)
+        n = _next_draw(results, collect_votes, passes)
+    return results or failed
+
+
+async def run_until_consensus_async(draw: Callable[[int, int], Awaitable[List[Any]]],
+                                    collect_votes: VoteCollector, passes: int) -> List[Any]:
+    # Same schedule as run_until_consensus with an awaitable draw
+    results: List[Any] = []
+    failed: List[Any] = []
+    n = _next_draw(results, collect_votes, passes)
+    while n and len(failed) < Config.GRADING_MAX_FAILED_PASSES:
+        for result in await draw(len(results) + len(failed), n):
+            (failed if isinstance(result, FailedPass) else results).append(result)
+        n = _next_draw(results, collect_votes, passes)
+    return results or failed
@@ -0,0 +1,294 @@
+# Exam template registry: known exams recognised by a layout fingerprint of their pages
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.config import Config
+from app.services.ocr_pages import question_key
+from app.services.page_preflight import pdf_page_array, thumbnail_array
+
+
+LAYOUT_WIDTH, LAYOUT_HEIGHT = 576, 768  # Ink bitmap a page layout is compared on (fine enough to tell printed lines apart)
+COARSE_SIDE = 32                        # pHash input side; 8x8 low DCT frequencies -> 63 bits
+ALIGN_SLACK = 1                         # Pixels of misregistration tolerated after alignment
+
+# Per-answer fields: filled from the student's copy, never stored with a template
+ANSWER_FIELDS = ('student_answer', 'student_markings')
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(COARSE_SIDE)
+
+
+def coarse_hash(gray: np.ndarray) -> int:
+    """64-bit perceptual hash of a page (pHash): which low frequencies are above median."""
+    small = np.asarray(Image.fromarray(gray).resize((COARSE_SIDE, COARSE_SIDE), Image.BOX), dtype=np.float32)
+    coefficients = (_DCT @ small @ _DCT.T)[:8, :8].ravel()[1:]
+    bits = coefficients > np.median(coefficients)
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def layout_bitmap(gray: np.ndarray) -> np.ndarray:
+    """Where the page carries ink, on a fixed LAYOUT_WIDTH x LAYOUT_HEIGHT grid."""
+    small = np.asarray(Image.fromarray(gray).resize((LAYOUT_WIDTH, LAYOUT_HEIGHT), Image.BOX), dtype=np.float32)
+    paper = float(np.median(small))
+    darkest = float(np.percentile(small, 1))
+    return small < paper - 0.35 * (paper - darkest)
+
+
+def _hamming(first: int, second: int) -> int:
+    return bin(first ^ second).count('1')
+
+
+def _dilate(bitmap: np.ndarray, radius: int) -> np.ndarray:
+    grown = bitmap.copy()
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            grown |= np.roll(bitmap, (dy, dx), axis=(0, 1))
+    return grown
+
+
+def layout_overlap(template: np.ndarray, page: np.ndarray) -> Tuple[float, float]:
+    """How well a page matches a template: (covered, explained).
+    
+    `covered` is the share of the template's printed ink that the page also
+    carries, `explained` the share of the page's ink that lies on the
+    template's. The page is first aligned to the template by
+    cross-correlation (scans are shifted by a few millimetres). A filled-in
+    copy covers nearly all of the template and adds only its handwriting;
+    a denser, different exam can cover a template too, but most of its own
+    ink is left unexplained.
+    """
+    spectrum = np.fft.rfft2(template.astype(np.float32)).conj() * np.fft.rfft2(page.astype(np.float32))
+    correlation = np.fft.irfft2(spectrum, s=template.shape)
+    dy, dx = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    aligned = np.roll(page, (-dy, -dx), axis=(0, 1))
+    covered = (template & _dilate(aligned, ALIGN_SLACK)).sum() / max(int(template.sum()), 1)
+    explained = (aligned & _dilate(template, ALIGN_SLACK)).sum() / max(int(aligned.sum()), 1)
+    return float(covered), float(explained)
+
+
+def _f1(covered: float, explained: float) -> float:
+    # One score to rank candidates by: harmonic mean of both directions
+    return 2 * covered * explained / (covered + explained) if covered + explained else 0.0
+
+
+def fingerprint_document(source: bytes, is_pdf: bool) -> List[Dict[str, Any]]:
+    """Coarse hash and layout bitmap of each page of an upload."""
+    if is_pdf:
+        with fitz.open(stream=source, filetype="pdf") as pdf_doc:
+            grays = [pdf_page_array(page) for page in pdf_doc]
+    else:
+        grays = [thumbnail_array(ImageOps.exif_transpose(Image.open(io.BytesIO(source))))]
+    return [{'coarse': coarse_hash(gray), 'layout': layout_bitmap(gray)} for gray in grays]
+
+
+def _structure(structured_data: Dict[str, Any]) -> Dict[str, Any]:
+    # What a template keeps of an OCR result: questions without any answers written on it
+    questions = [{field: value for field, value in question.items() if field not in ANSWER_FIELDS}
+                 for question in structured_data.get('questions') or []]
+    return {'questions': questions, 'metadata': structured_data.get('metadata') or {}}
+
+
+class EmptyTemplate(ValueError):
+    """The OCR of an exam to register found no questions."""
+
+
+class TemplateRegistry:
+    """Registered exams and their page fingerprints, kept in SQLite.
+    
+    Every worker keeps the fingerprints in memory and reloads them when
+    another worker registers or deletes a template (SQLite data_version).
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self._version = None
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS templates ('
+            ' id TEXT PRIMARY KEY, name TEXT NOT NULL, language TEXT NOT NULL,'
+            ' page_count INTEGER NOT NULL, coarse TEXT NOT NULL, layouts BLOB NOT NULL,'
+            ' structure TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._db.commit()
+    
+    def _refresh(self) -> None:
+        # Reload when the database changed under us (caller holds the lock)
+        version = self._db.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._version:
+            return
+        self._templates = {}
+        for row in self._db.execute('SELECT id, name, language, page_count, coarse, layouts, created_at FROM templates'):
+            template_id, name, language, page_count, coarse, layouts, created_at = row
+            bits = np.unpackbits(np.frombuffer(layouts, dtype=np.uint8))
+            size = LAYOUT_WIDTH * LAYOUT_HEIGHT
+            self._templates[template_id] = {
+                'id': template_id, 'name': name, 'language': language, 'page_count': page_count,
+                'created_at': created_at,
+                'coarse': [int(value, 16) for value in json.loads(coarse)],
+                # Layouts stored at another LAYOUT size never match (register the exam again)
+                'layouts': ([bits[i * size:(i + 1) * size].reshape(LAYOUT_HEIGHT, LAYOUT_WIDTH).astype(bool)
+                             for i in range(page_count)] if len(layouts) == (page_count * size + 7) // 8 else None)
+            }
+        self._version = version
+    
+    @staticmethod
+    def _summary(template: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: template[field] for field in ('id', 'name', 'language', 'page_count', 'created_at')}
+    
+    def register(self, name: str, language: str, fingerprints: List[Dict[str, Any]],
+                 structured_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an exam's page fingerprints and question structure; returns the new template.
+        
+        Raises EmptyTemplate when there are no questions: every copy matched
+        to such a template would come back blank.
+        """
+        structure = _structure(structured_data)
+        if not structure['questions']:
+            raise EmptyTemplate('No questions were found on the exam; it cannot be registered as a template')
+        template_id = uuid.uuid4().hex[:12]
+        layouts = np.packbits(np.concatenate([f['layout'].ravel() for f in fingerprints])).tobytes()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO templates (id, name, language, page_count, coarse, layouts, structure, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (template_id, name, language, len(fingerprints),
+                 json.dumps([format(f['coarse'], '016x') for f in fingerprints]),
+                 layouts, json.dumps(structure, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+            self._version = None  # data_version only tracks other connections' commits
+            self._refresh()
+            template = dict(self._summary(self._templates[template_id]), structure=structure)
+        return template
+    
+    def templates(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return sorted((self._summary(t) for t in self._templates.values()), key=lambda t: t['created_at'])
+    
+    def is_empty(self) -> bool:
+        with self._lock:
+            self._refresh()
+            return not self._templates
+    
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            template = self._templates.get(template_id)
+            if template is None:
+                return None
+            row = self._db.execute('SELECT structure FROM templates WHERE id = ?', (template_id,)).fetchone()
+        return dict(self._summary(template), structure=json.loads(row[0]))
+    
+    def delete(self, template_id: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM templates WHERE id = ?', (template_id,)).rowcount
+            self._db.commit()
+            self._version = None
+            self._refresh()
+        return deleted > 0
+    
+    def match(self, fingerprints: List[Dict[str, Any]], language: str = None) -> Optional[Dict[str, Any]]:
+        """The registered exam these pages are a copy of, or None.
+        
+        Candidates must have the same page count and language, and a first
+        page within OCR_TEMPLATE_COARSE_DISTANCE bits (cheap pHash pre-filter).
+        On every page a candidate must then have at least OCR_TEMPLATE_MIN_OVERLAP
+        of its layout ink covered and explain at least OCR_TEMPLATE_MIN_EXPLAINED
+        of the upload's ink (see layout_overlap), each taken on the worst page.
+        The best candidate must also beat the runner-up by OCR_TEMPLATE_MIN_MARGIN
+        (both directions' harmonic mean): a copy that fits two templates about
+        as well is not trusted to either, and gets a full OCR.
+        """
+        with self._lock:
+            self._refresh()
+            candidates = [
+                t for t in self._templates.values()
+                if t['page_count'] == len(fingerprints) and t['layouts'] is not None
+                and (language is None or t['language'] == language)
+                and _hamming(t['coarse'][0], fingerprints[0]['coarse']) <= Config.OCR_TEMPLATE_COARSE_DISTANCE
+            ]
+        
+        scored = []
+        for template in candidates:
+            pages = [layout_overlap(layout, f['layout']) for layout, f in zip(template['layouts'], fingerprints)]
+            covered = min(page[0] for page in pages)
+            explained = min(page[1] for page in pages)
+            scored.append((_f1(covered, explained), covered, explained, template))
+        if not scored:
+            return None
+        scored.sort(key=lambda candidate: candidate[0], reverse=True)
+        score, covered, explained, best = scored[0]
+        if covered < Config.OCR_TEMPLATE_MIN_OVERLAP or explained < Config.OCR_TEMPLATE_MIN_EXPLAINED:
+            return None
+        if len(scored) > 1 and score - scored[1][0] < Config.OCR_TEMPLATE_MIN_MARGIN:
+            return None
+        template = self.get(best['id'])
+        return dict(template, overlap=round(covered, 4), explained=round(explained, 4)) if template is not None else None
+
+
+_lock = threading.Lock()
+_registry: Optional[TemplateRegistry] = None
+
+
+def get_template_registry() -> Optional[TemplateRegistry]:
+    """Return the shared registry, or None when OCR_TEMPLATES is off."""
+    if not Config.OCR_TEMPLATES:
+        return None
+    
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = TemplateRegistry(Config.OCR_TEMPLATES_PATH)
+    return _registry
+
+
+def fill_answers(structure: Dict[str, Any], answered: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The known questions with the student's answers read from their copy.
+    
+    Answers are matched to questions by order, or by question number when
+    the order disagrees (numbers can repeat across sections, so order comes
+    first); questions without an answer stay unanswered.
+    """
+    by_order = {q.get('order'): q for q in answered}
+    by_key: Dict[str, Dict[str, Any]] = {}
+    for q in answered:
+        by_key.setdefault(question_key(q), q)
+    
+    questions = []
+    for question in structure['questions']:
+        key = question_key(question)
+        source = by_order.get(question.get('order'))
+        if source is None or (key and question_key(source) not in ('', key)):
+            source = by_key.get(key) if key else None
+        filled = dict(question)
+        for field in ANSWER_FIELDS:
+            filled[field] = source.get(field) if source else None
+        questions.append(filled)
+    return questions
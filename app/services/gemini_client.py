@@ -0,0 +1,150 @@
+# Shared Gemini client registry and long-lived service singletons
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Type, TypeVar
+
+import httpx
+from google import genai
+from google.genai import types
+
+from app.config import Config
+
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()  # re-entrant: service constructors call get_client/get_service
+_clients: Dict[str, Any] = {}
+_services: Dict[type, Any] = {}
+
+
+def _http_options() -> types.HttpOptions:
+    # One sized keep-alive pool per client, shared by every request in the worker
+    limits = httpx.Limits(
+        max_connections=Config.GEMINI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.GEMINI_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=Config.GEMINI_HTTP_KEEPALIVE_EXPIRY
+    )
+    return types.HttpOptions(
+        timeout=Config.GEMINI_HTTP_TIMEOUT_MS,
+        client_args={'limits': limits},
+        async_client_args={'limits': limits}
+    )
+
+
+def _scheduled(client: Any) -> Any:
+    # Every generate_content call goes through the shared rate limiter, and
+    # retries/hedges wrap it so each extra attempt is rate limited too
+    from app.services.gemini_resilience import ResilientClient
+    from app.services.gemini_scheduler import ScheduledClient, get_scheduler
+    
+    if Config.GEMINI_SCHEDULER:
+        client = ScheduledClient(client, get_scheduler())
+    return ResilientClient(client)
+
+
+def _get_offline_client() -> Any:
+    from app.services.llm_backend import build_backend
+    
+    name = Config.GEMINI_BACKEND
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _scheduled(build_backend(name, None))
+    return client
+
+
+def get_client(api_key: Optional[str] = None) -> Any:
+    """Return the process-wide Gemini client for an API key.
+
+    The client owns a pooled httpx transport, so reusing it keeps TLS
+    connections alive across requests instead of reconnecting per call.
+    With an offline GEMINI_BACKEND (replay, synthetic) no key is needed.
+    """
+    from app.services.llm_backend import NETWORK_BACKENDS, build_backend
+    
+    if Config.GEMINI_BACKEND not in NETWORK_BACKENDS:
+        return _get_offline_client()
+    
+    api_key = api_key or Config.GEMINI_API_KEY
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not set")
+    
+    client = _clients.get(api_key)
+    if client is None:
+        with _lock:
+            client = _clients.get(api_key)
+            if client is None:
+                backend = build_backend(
+                    Config.GEMINI_BACKEND,
+                    lambda: genai.Client(api_key=api_key, http_options=_http_options())
+                )
+                client = _clients[api_key] = _scheduled(backend)
+    return client
+
+
+def get_service(service_cls: Type[T]) -> T:
+    """Return the shared instance of a service class.
+
+    Services hold no per-request state, so a single instance per worker
+    can serve concurrent requests over the pooled client.
+    """
+    service = _services.get(service_cls)
+    if service is None:
+        with _lock:
+            service = _services.get(service_cls)
+            if service is None:
+                service = service_cls()
+                _services[service_cls] = service
+    return service
+
+
+def warm_up() -> bool:
+    # Build the client and route services at worker boot so the first request
+    # does not pay for client setup and the TLS handshake
+    from app.services.llm_backend import NETWORK_BACKENDS
+    
+    network = Config.GEMINI_BACKEND in NETWORK_BACKENDS
+    if network and not Config.GEMINI_API_KEY:
+        return False
+    
+    from app.services.grading import GradingService
+    from app.services.gemini_ocr import GeminiOCRService
+    from app.services.annotation_service import AnnotationService
+    from app.services.open_ended_grading import OpenEndedGradingService
+    from app.services.short_answer_grading import ShortAnswerGradingService
+    from app.services.definition_grading import DefinitionGradingService
+    from app.services.compare_contrast_grading import CompareContrastGradingService
+    from app.services.table_grading import TableGradingService
+    from app.services.labeling_grading import LabelingGradingService
+    from app.services.math_grading import MathGradingService
+    
+    for service_cls in (GradingService, GeminiOCRService, AnnotationService,
+                        OpenEndedGradingService, ShortAnswerGradingService,
+                        DefinitionGradingService, CompareContrastGradingService,
+                        TableGradingService, LabelingGradingService, MathGradingService):
+        get_service(service_cls)
+    
+    if Config.GEMINI_WARMUP_PING and network:
+        try:
+            # Cheap metadata call that opens a pooled connection to the API
+            get_client().models.get(model=Config.GEMINI_MODEL)
+        except Exception as e:
+            logger.warning("Gemini warm-up ping failed: %s", e)
+    return True
+
+
+def _reset_after_fork():
+    # Pools inherited from a pre-forking master must not be shared with children
+    global _lock
+    _lock = threading.RLock()
+    _clients.clear()
+    _services.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,11 +1,26 @@
 # Gemini OCR service for exam extraction
+import asyncio
+import contextvars
+import hashlib
 import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Tuple
 from PIL import Image
-import fitz
-from google import genai
 
 from app.config import Config
-from app.models.schemas import OCRResponse
+from app.services.gemini_client import get_client
+from app.services.exam_templates import fill_answers, fingerprint_document, get_template_registry
+from app.services.ocr_pages import merge_page_results, page_groups, page_note, page_runs
+from app.services.ocr_schemas import answer_sheet_schema, ocr_schema, parse_text_mode
+from app.services.ocr_stream import ArrayItemStream
+from app.services.image_prep import open_image, prep_summary, prepare_image
+from app.services.page_preflight import check_sendable, inspect_page, should_send, thumbnail_array, upright
+from app.services.pdf_raster import page_count, pdf_page_parts
+from app.services.pdf_text import read_text_layer
+from app.services.response_cache import get_response_cache, make_key
+from app.models.schemas import AnswerSheet, OCRResponse, Question, StructuredData, StructuredOCRResponse
 
 
 class GeminiOCRService:
@@ -131,52 +146,423 @@ RÈGLES:
 - extracted_text: Texte complet du document"""
     }
     
+    # Answer-only extraction: replaces the full prompt when the questions are already
+    # known (a registered exam, or a question list sent with the request)
+    ANSWERS_PROMPT = """You are reading a student's answered copy of a known exam. Its questions are listed below as JSON, in document order.
+Do NOT extract question text, options or metadata: they are known.
+
+For EVERY listed question, return one entry in `answers` with its order and question_number, and:
+- student_answer: what the student wrote, selected or marked, in the language it was written (null if left blank)
+  - multiple_choice: the selected option key; true_false: true or false
+  - matching: {{"left id": "right id"}}; fill_in_blank and ordering: a list, in order
+  - everything else: the student's text as written
+- student_markings: visible marks (circle vs cross, ink colour, crossed-out answers)
+
+QUESTIONS:
+{questions}"""
+    
+    # Added to the prompt when the request names the question types the exam uses
+    TYPES_NOTE = """
+
+EXPECTED QUESTION TYPES: {types}. Classify every question as one of these."""
+    
+    # Replace the prompts' extracted_text rule when the raw text is not wanted
+    TEXT_NOTES = {
+        'summary': """
+
+extracted_text: do NOT transcribe the document. Give only a one or two sentence summary of it.""",
+        'none': """
+
+Do NOT transcribe the raw text of the document: return only the structured questions."""
+    }
+    
+    # Question fields that identify what the student answers on (sent with ANSWERS_PROMPT)
+    OUTLINE_FIELDS = ('order', 'question_number', 'question_type', 'question_text', 'options', 'blanks',
+                      'left_column', 'right_column', 'ordering_items', 'labeling_items', 'table_headers')
+    
+    CACHE_NAMESPACE = 'ocr'  # Opt-in key for RESPONSE_CACHE_SERVICES
+    
     def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        self.client = get_client()
     
-    def process_image(self, image_data: bytes, language: str) -> dict:
-        prompt = self.PROMPTS.get(language, self.PROMPTS['english'])
-        image = Image.open(io.BytesIO(image_data))
-        
-        response = self.client.models.generate_content(
-            model=Config.GEMINI_MODEL,
-            contents=[prompt, image],
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": OCRResponse.model_json_schema(),
-            }
-        )
-        
-        result = OCRResponse.model_validate_json(response.text)
+    def _answers_prompt(self, known: dict) -> str:
+        outline = [{field: question[field] for field in self.OUTLINE_FIELDS if question.get(field) not in (None, [], {})}
+                   for question in known['structure']['questions']]
+        return self.ANSWERS_PROMPT.format(questions=json.dumps(outline, ensure_ascii=False))
+    
+    def _request(self, source: bytes, language: str, note: str = '', known: dict = None, stream: bool = False,
+                 output: dict = None):
+        # Prompt, config and cache slot of one structured OCR request; `output`
+        # shapes the response (question_types: trimmed schema, extracted_text:
+        # full, summary or none; see ocr_schemas)
+        output = output or {}
+        if known:
+            prompt, schema = self._answers_prompt(known) + note, answer_sheet_schema()
+        else:
+            prompt = self.PROMPTS.get(language, self.PROMPTS['english']) + note
+            question_types = output.get('question_types')
+            if question_types:
+                prompt += self.TYPES_NOTE.format(types=', '.join(question_types))
+            text = self._text_mode(output)
+            prompt += self.TEXT_NOTES.get(text, '')
+            schema = ocr_schema(question_types, stream, text)
+        config = {
+            "response_mime_type": "application/json",
+            "response_json_schema": schema,
+        }
+        cache = get_response_cache(self.CACHE_NAMESPACE)
+        key = make_key(self.CACHE_NAMESPACE, Config.GEMINI_MODEL, prompt, source, config) if cache else None
+        return prompt, config, cache, key
+    
+    def _text_mode(self, output: dict = None) -> str:
+        return parse_text_mode((output or {}).get('extracted_text'))
+    
+    def _result(self, text: str, language: str, cache=None, key=None, known: dict = None,
+                output: dict = None) -> dict:
+        if known:
+            return self._answers_result(AnswerSheet.model_validate_json(text), language, known, cache, key, text)
+        if self._text_mode(output) == 'none':
+            # Same response shape, with the raw text left empty
+            result_dict = {'extracted_text': '', **StructuredOCRResponse.model_validate_json(text).model_dump()}
+        else:
+            result_dict = OCRResponse.model_validate_json(text).model_dump()
+        if cache:
+            cache.set(key, text)
+        result_dict['language'] = language
+        return result_dict
+    
+    def _answers_result(self, sheet: AnswerSheet, language: str, known: dict,
+                        cache=None, key=None, text: str = None) -> dict:
+        # An OCRResponse dict: the known questions and metadata, answers read from this copy
+        if cache:
+            cache.set(key, text)
+        result_dict = {
+            'extracted_text': '',
+            'structured_data': {
+                'questions': fill_answers(known['structure'], sheet.model_dump()['answers']),
+                'metadata': known['structure'].get('metadata') or {}
+            },
+            'confidence_score': sheet.confidence_score,
+            'language': language
+        }
+        if 'id' in known:
+            result_dict['template'] = {field: known[field] for field in ('id', 'name', 'overlap', 'explained')}
+        return result_dict
+    
+    def _empty_result(self, language: str, known: dict = None) -> dict:
+        # Every page was blank (pre-flight): nothing to ask the model about. Full
+        # confidence, so blank pages do not drag down a merged page-parallel score
+        if known:
+            return self._answers_result(AnswerSheet(answers=[], confidence_score=1.0), language, known)
+        result = OCRResponse(extracted_text='', structured_data=StructuredData(questions=[]), confidence_score=1.0)
         result_dict = result.model_dump()
         result_dict['language'] = language
         return result_dict
     
-    def process_pdf(self, pdf_data: bytes, language: str) -> dict:
-        prompt = self.PROMPTS.get(language, self.PROMPTS['english'])
+    def _extract(self, source: bytes, language: str, build_images, note: str = '', known: dict = None,
+                 output: dict = None) -> dict:
+        # Run structured OCR; byte-identical uploads are served from the response
+        # cache (when enabled) before any decoding or rasterizing happens
+        prompt, config, cache, key = self._request(source, language, note, known, output=output)
+        text = cache.get(key) if cache else None
+        if text is not None:
+            return self._result(text, language, known=known, output=output)
         
-        pdf_doc = fitz.open(stream=pdf_data, filetype="pdf")
-        images = []
+        images = build_images()
+        if not images:
+            return self._empty_result(language, known)
+        response = self.client.models.generate_content(
+            model=Config.GEMINI_MODEL,
+            contents=[prompt] + images,
+            config=config
+        )
+        return self._result(response.text, language, cache, key, known, output)
+    
+    async def _extract_async(self, source: bytes, language: str, build_images, note: str = '',
+                             known: dict = None, output: dict = None) -> dict:
+        # _extract on the async client; decoding/rasterizing runs in a worker thread
+        prompt, config, cache, key = self._request(source, language, note, known, output=output)
+        text = await cache.get_async(key) if cache else None
+        if text is not None:
+            return self._result(text, language, known=known, output=output)
         
-        for page_num in range(len(pdf_doc)):
-            page = pdf_doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            images.append(Image.open(io.BytesIO(pix.tobytes("png"))))
+        images = await asyncio.to_thread(build_images)
+        if not images:
+            return self._empty_result(language, known)
+        response = await self.client.aio.models.generate_content(
+            model=Config.GEMINI_MODEL,
+            contents=[prompt] + images,
+            config=config
+        )
+        # Stored only once it validates, as in _result
+        result = self._result(response.text, language, known=known, output=output)
+        if cache:
+            await cache.set_async(key, response.text)
+        return result
+    
+    def _extract_stream(self, source: bytes, language: str, build_images, output: dict = None):
+        """_extract as a generator: yields ('question', question) as the model completes each.
         
-        pdf_doc.close()
+        Returns the validated result. The response streams with questions
+        ahead of the raw text (see streaming_schema); cache hits are replayed
+        as question events.
+        """
+        prompt, config, cache, key = self._request(source, language, stream=True, output=output)
+        text = cache.get(key) if cache else None
+        if text is not None:
+            result = self._result(text, language, output=output)
+            yield from self._question_events(result)
+            return result
         
-        response = self.client.models.generate_content(
+        images = build_images()
+        if not images:
+            return self._empty_result(language)
+        scanner = ArrayItemStream()
+        for chunk in self.client.models.generate_content_stream(
             model=Config.GEMINI_MODEL,
             contents=[prompt] + images,
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": OCRResponse.model_json_schema(),
-            }
-        )
+            config=config
+        ):
+            for question in scanner.feed(chunk.text or ''):
+                yield 'question', Question.model_validate(question).model_dump()
+        return self._result(scanner.text, language, cache, key, output=output)
+    
+    def _question_events(self, result: dict) -> Iterator[Tuple[str, dict]]:
+        for question in result['structured_data']['questions']:
+            yield 'question', question
+    
+    def _image_pages(self, image_data: bytes, report: dict) -> list:
+        if Config.OCR_IMAGE_PREP:
+            image, baseline = open_image(image_data)
+        else:
+            image, baseline = Image.open(io.BytesIO(image_data)), None
+        if Config.OCR_PREFLIGHT:
+            diagnostics = inspect_page(thumbnail_array(image))
+            report['diagnostics'].append(diagnostics)
+            if not should_send(diagnostics):
+                return check_sendable([], [diagnostics])
+            image = upright(image, diagnostics['rotation'])
         
-        result = OCRResponse.model_validate_json(response.text)
-        result_dict = result.model_dump()
+        if not Config.OCR_IMAGE_PREP:
+            return [image]
+        part, page_stats = prepare_image(image, baseline, len(image_data))
+        report['prep'].append(page_stats)
+        return [part]
+    
+    def _pdf_pages(self, pdf_data: bytes, report: dict, pages: range = None) -> list:
+        # Checked, rendered and encoded page by page; see pdf_raster and image_prep
+        diagnostics = []
+        parts = pdf_page_parts(pdf_data, pages, report['prep'], diagnostics)
+        report['diagnostics'].extend(diagnostics)
+        return check_sendable(parts, diagnostics)
+    
+    def _report(self) -> dict:
+        # Filled while pages are built: image prep stats and pre-flight diagnostics
+        return {'prep': [], 'diagnostics': []}
+    
+    def _with_report(self, result: dict, report: dict, source: bytes) -> dict:
+        # Bytes and image tokens saved by image preparation, and what pre-flight
+        # did with each page (neither is there on cache hits)
+        if report['prep']:
+            result['image_prep'] = prep_summary(report['prep'], len(source))
+        if report['diagnostics']:
+            result['page_diagnostics'] = sorted(report['diagnostics'], key=lambda d: d['page'])
+        return result
+    
+    def _page_result(self, outcomes: list, language: str) -> dict:
+        merged, report = merge_page_results(outcomes)
+        result_dict = OCRResponse.model_validate(merged).model_dump()
         result_dict['language'] = language
+        result_dict['pages'] = report
         return result_dict
+    
+    def _ocr_page_group(self, pdf_data: bytes, digest: bytes, language: str, pages: range,
+                        total: int, report: dict, output: dict = None) -> tuple:
+        # One page group: (pages, result, error, seconds); errors stay with the group
+        started = time.monotonic()
+        try:
+            result = self._extract(digest, language, lambda: self._pdf_pages(pdf_data, report, pages),
+                                   page_note(pages, total), output=output)
+            return pages, result, None, time.monotonic() - started
+        except Exception as e:
+            return pages, None, e, time.monotonic() - started
+    
+    async def _ocr_page_group_async(self, pdf_data: bytes, digest: bytes, language: str, pages: range,
+                                    total: int, report: dict, slots: asyncio.Semaphore, output: dict = None) -> tuple:
+        async with slots:
+            started = time.monotonic()
+            try:
+                result = await self._extract_async(digest, language, lambda: self._pdf_pages(pdf_data, report, pages),
+                                                   page_note(pages, total), output=output)
+                return pages, result, None, time.monotonic() - started
+            except Exception as e:
+                return pages, None, e, time.monotonic() - started
+    
+    def _process_pages(self, pdf_data: bytes, language: str, total: int, report: dict,
+                       groups: list, done: list = (), output: dict = None) -> dict:
+        """OCR page groups concurrently and merge them in document order.
+        
+        Each group is its own request, so latency tracks the slowest group
+        rather than the page count, and a failed group is reported in `pages`
+        instead of failing the document. `done` holds outcomes of pages that
+        needed no request (parsed from the PDF text layer).
+        """
+        digest = hashlib.sha256(pdf_data).digest()
+        with ThreadPoolExecutor(max_workers=max(1, Config.OCR_PAGE_CONCURRENCY),
+                                thread_name_prefix='ocr-page') as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self._ocr_page_group,
+                                   pdf_data, digest, language, pages, total, report, output) for pages in groups]
+            outcomes = [f.result() for f in futures]
+        return self._page_result(sorted(list(done) + outcomes, key=lambda o: o[0].start), language)
+    
+    async def _process_pages_async(self, pdf_data: bytes, language: str, total: int, report: dict,
+                                   groups: list, done: list = (), output: dict = None) -> dict:
+        digest = hashlib.sha256(pdf_data).digest()
+        slots = asyncio.Semaphore(max(1, Config.OCR_PAGE_CONCURRENCY))
+        outcomes = await asyncio.gather(*(
+            self._ocr_page_group_async(pdf_data, digest, language, pages, total, report, slots, output)
+            for pages in groups
+        ))
+        return self._page_result(sorted(list(done) + list(outcomes), key=lambda o: o[0].start), language)
+    
+    def _text_layer(self, pdf_data: bytes, text: str = 'full'):
+        """Outcomes of the pages parsed from the text layer, and the groups left for vision OCR.
+        
+        None when no page has a usable text layer (scans): the document is OCR'd as before.
+        Unless `text` is 'full' the parsed pages carry no raw text (there is no summary to give).
+        """
+        started = time.monotonic()
+        parsed = read_text_layer(pdf_data)
+        if not any(parsed):
+            return None
+        if text != 'full':
+            for result in filter(None, parsed):
+                result['extracted_text'] = ''
+        seconds = (time.monotonic() - started) / max(1, len(parsed))
+        done = [(range(index, index + 1), result, None, seconds) for index, result in enumerate(parsed) if result]
+        vision = [index for index, result in enumerate(parsed) if result is None]
+        return done, page_runs(vision, Config.OCR_PAGES_PER_REQUEST if Config.OCR_PAGE_PARALLEL else 0)
+    
+    def known_exam(self, source: bytes, is_pdf: bool, language: str):
+        """The registered exam this upload is a copy of (with its structure), or None."""
+        registry = get_template_registry()
+        if registry is None or registry.is_empty():
+            return None
+        return registry.match(fingerprint_document(source, is_pdf), language)
+    
+    def _known(self, source: bytes, is_pdf: bool, language: str, questions, use_templates: bool):
+        # What answer-only mode works from: the caller's question list, else a matching template
+        if questions is not None:
+            return {'structure': {'questions': questions, 'metadata': {}}}
+        return self.known_exam(source, is_pdf, language) if use_templates else None
+    
+    def process_image(self, image_data: bytes, language: str, use_templates: bool = True,
+                      questions: list = None, output: dict = None) -> dict:
+        """OCR an exam image into an OCRResponse dict.
+        
+        With `questions` (a known question list, e.g. from an earlier OCR of
+        the exam), or when the image matches a registered template, only the
+        student's answers are extracted (answer-only mode). `output` shapes
+        full extraction: 'question_types' (from parse_question_types) trims
+        the response schema to those types, and 'extracted_text' ('full',
+        'summary' or 'none'; default OCR_EXTRACTED_TEXT) sets how much raw
+        text the model writes.
+        """
+        report = self._report()
+        known = self._known(image_data, False, language, questions, use_templates)
+        result = self._extract(image_data, language, lambda: self._image_pages(image_data, report), known=known,
+                               output=output)
+        return self._with_report(result, report, image_data)
+    
+    def process_pdf(self, pdf_data: bytes, language: str, use_templates: bool = True,
+                    questions: list = None, output: dict = None) -> dict:
+        report = self._report()
+        known = self._known(pdf_data, True, language, questions, use_templates)
+        # Answers for known questions come in one short request; page groups and
+        # the text layer are for full extraction
+        total = page_count(pdf_data) if not known else 0
+        text_layer = (self._text_layer(pdf_data, self._text_mode(output))
+                      if Config.OCR_TEXT_LAYER and not known else None)
+        if text_layer or self._page_parallel(total):
+            result = self._pages_result(pdf_data, language, total, report, text_layer, output)
+        else:
+            result = self._extract(pdf_data, language, lambda: self._pdf_pages(pdf_data, report), known=known,
+                                   output=output)
+        return self._with_report(result, report, pdf_data)
+    
+    def _page_parallel(self, total: int) -> bool:
+        return Config.OCR_PAGE_PARALLEL and total > Config.OCR_PAGES_PER_REQUEST
+    
+    def _pages_result(self, pdf_data: bytes, language: str, total: int, report: dict, text_layer,
+                      output: dict = None) -> dict:
+        # Text-layer pages plus vision OCR of the rest, or page groups when there is no text layer
+        if text_layer:
+            return self._process_pages(pdf_data, language, total, report, text_layer[1], text_layer[0], output)
+        return self._process_pages(pdf_data, language, total, report, page_groups(total, Config.OCR_PAGES_PER_REQUEST),
+                                   output=output)
+    
+    def stream_image(self, image_data: bytes, language: str, use_templates: bool = True,
+                     questions: list = None, output: dict = None) -> Iterator[Tuple[str, dict]]:
+        """process_image as events: ('question', question) as each is read, then ('result', result).
+        
+        Answer-only mode is one short request, so its questions follow its result.
+        """
+        report = self._report()
+        known = self._known(image_data, False, language, questions, use_templates)
+        if known:
+            result = self._extract(image_data, language, lambda: self._image_pages(image_data, report), known=known)
+            yield from self._question_events(result)
+        else:
+            result = yield from self._extract_stream(image_data, language,
+                                                     lambda: self._image_pages(image_data, report), output)
+        yield 'result', self._with_report(result, report, image_data)
+    
+    def stream_pdf(self, pdf_data: bytes, language: str, use_templates: bool = True,
+                   questions: list = None, output: dict = None) -> Iterator[Tuple[str, dict]]:
+        """process_pdf as events, like stream_image.
+        
+        Only single-request extraction streams question by question. Known
+        exams, text-layer PDFs and page-parallel OCR emit their questions once
+        the merged result is ready (their pages are merged and renumbered).
+        """
+        report = self._report()
+        known = self._known(pdf_data, True, language, questions, use_templates)
+        total = page_count(pdf_data) if not known else 0
+        text_layer = (self._text_layer(pdf_data, self._text_mode(output))
+                      if Config.OCR_TEXT_LAYER and not known else None)
+        if text_layer or self._page_parallel(total):
+            result = self._pages_result(pdf_data, language, total, report, text_layer, output)
+            yield from self._question_events(result)
+        elif known:
+            result = self._extract(pdf_data, language, lambda: self._pdf_pages(pdf_data, report), known=known)
+            yield from self._question_events(result)
+        else:
+            result = yield from self._extract_stream(pdf_data, language, lambda: self._pdf_pages(pdf_data, report),
+                                                     output)
+        yield 'result', self._with_report(result, report, pdf_data)
+    
+    async def process_image_async(self, image_data: bytes, language: str, use_templates: bool = True,
+                                  questions: list = None, output: dict = None) -> dict:
+        report = self._report()
+        known = await asyncio.to_thread(self._known, image_data, False, language, questions, use_templates)
+        result = await self._extract_async(image_data, language, lambda: self._image_pages(image_data, report),
+                                           known=known, output=output)
+        return self._with_report(result, report, image_data)
+    
+    async def process_pdf_async(self, pdf_data: bytes, language: str, use_templates: bool = True,
+                                questions: list = None, output: dict = None) -> dict:
+        report = self._report()
+        known = await asyncio.to_thread(self._known, pdf_data, True, language, questions, use_templates)
+        total = await asyncio.to_thread(page_count, pdf_data) if not known else 0
+        text_layer = (await asyncio.to_thread(self._text_layer, pdf_data, self._text_mode(output))
+                      if Config.OCR_TEXT_LAYER and not known else None)
+        if text_layer:
+            result = await self._process_pages_async(pdf_data, language, total, report, text_layer[1], text_layer[0],
+                                                     output)
+        elif self._page_parallel(total):
+            result = await self._process_pages_async(pdf_data, language, total, report,
+                                                     page_groups(total, Config.OCR_PAGES_PER_REQUEST), output=output)
+        else:
+            result = await self._extract_async(pdf_data, language, lambda: self._pdf_pages(pdf_data, report),
+                                               known=known, output=output)
+        return self._with_report(result, report, pdf_data)
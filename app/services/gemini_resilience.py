@@ -0,0 +1,369 @@
+# Retries, hedged requests and deadlines for Gemini calls
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+from app.config import Config
+from app.services.gemini_scheduler import estimate_tokens
+
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ('RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'INTERNAL',
+                     'timed out', 'Timeout', 'Connection reset', 'Server disconnected')
+DEADLINE_SLACK = 0.01  # Seconds: the event loop may fire wait_for's timeout this early
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for transient failures: quota, overload, 5xx, timeouts, dropped connections."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    text = str(error)
+    if any(f'{status} ' in text[:8] for status in RETRYABLE_STATUS):
+        return True
+    return any(marker in text for marker in RETRYABLE_MARKERS)
+
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    ceiling = min(Config.GEMINI_RETRY_MAX_DELAY, Config.GEMINI_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+class LatencyTracker:
+    """Rolling call latencies per request shape, for the hedging threshold.
+    
+    Requests are grouped by model and rough input size (log2 of estimated
+    tokens), so an OCR call with page images never sets the bar for a
+    short grading prompt.
+    """
+    
+    def __init__(self, window: int):
+        self._window = window
+        self._samples: Dict[Tuple[str, int], Deque[float]] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, key: Tuple[str, int], seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self._window)
+            samples.append(seconds)
+    
+    def quantile(self, key: Tuple[str, int], q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < Config.GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(s for window in self._samples.values() for s in window)
+        if not samples:
+            return {}
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1)
+        return {'samples': len(samples), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+class ResilienceMetrics:
+    FIELDS = ('calls', 'succeeded', 'failed', 'retries', 'hedges', 'hedge_wins', 'deadline_exceeded')
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {name: 0 for name in self.FIELDS}
+    
+    def incr(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+latencies = LatencyTracker(Config.GEMINI_LATENCY_WINDOW)
+metrics = ResilienceMetrics()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    # Runs blocking attempts so the caller can stop waiting at the deadline
+    # or start a hedge; an abandoned attempt finishes at the HTTP timeout
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=Config.GEMINI_RESILIENCE_WORKERS,
+                                           thread_name_prefix='gemini-call')
+    return _pool
+
+
+def _shape(model: str, contents: Any) -> Tuple[str, int]:
+    return model, estimate_tokens(contents).bit_length()
+
+
+def _hedge_after(key: Tuple[str, int]) -> Optional[float]:
+    if not Config.GEMINI_HEDGE:
+        return None
+    return latencies.quantile(key, Config.GEMINI_HEDGE_QUANTILE)
+
+
+class _ResilientModels:
+    def __init__(self, models: Any):
+        self._models = models
+    
+    def _attempt(self, key: Tuple[str, int], kwargs: Dict[str, Any]) -> Any:
+        started = time.monotonic()
+        response = self._models.generate_content(**kwargs)
+        latencies.record(key, time.monotonic() - started)
+        return response
+    
+    def _hedged(self, key: Tuple[str, int], kwargs: Dict[str, Any], deadline: float) -> Any:
+        pool = _get_pool()
+        submit = lambda: pool.submit(contextvars.copy_context().run, self._attempt, key, kwargs)
+        pending = {submit()}
+        hedge_after = _hedge_after(key)
+        hedge = None
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.incr('deadline_exceeded')
+                raise DeadlineExceeded(f'Gemini call exceeded {Config.GEMINI_CALL_DEADLINE_SECONDS:g}s')
+            timeout = min(remaining, hedge_after) if hedge is None and hedge_after else remaining
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        metrics.incr('hedge_wins')
+                    return future.result()
+                error = future.exception()
+            if not done and hedge is None and hedge_after:
+                # Slower than the observed p95: race a duplicate request
+                metrics.incr('hedges')
+                hedge = submit()
+                pending.add(hedge)
+        raise error
+    
+    def generate_content(self, **kwargs) -> Any:
+        """generate_content with retries, a hedge past p95 and a call deadline."""
+        key = _shape(kwargs.get('model', ''), kwargs.get('contents'))
+        deadline = time.monotonic() + Config.GEMINI_CALL_DEADLINE_SECONDS
+        metrics.incr('calls')
+        attempt = 0
+        while True:
+            try:
+                response = self._hedged(key, kwargs, deadline)
+                metrics.incr('succeeded')
+                return response
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if (not is_retryable(e) or attempt >= Config.GEMINI_RETRY_ATTEMPTS
+                        or time.monotonic() + delay >= deadline):
+                    metrics.incr('failed')
+                    raise
+                metrics.incr('retries')
+                time.sleep(delay)
+    
+    def generate_content_stream(self, **kwargs) -> Iterator[Any]:
+        """generate_content_stream, retried until the first chunk arrives.
+        
+        Once chunks have been handed to the caller a failure is raised as is:
+        a retry would repeat them. Streams are not hedged.
+        """
+        key = _shape(kwargs.get('model', ''), kwargs.get('contents'))
+        deadline = time.monotonic() + Config.GEMINI_CALL_DEADLINE_SECONDS
+        metrics.incr('calls')
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                stream = iter(self._models.generate_content_stream(**kwargs))
+                first = next(stream, None)
+                break
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if (not is_retryable(e) or attempt >= Config.GEMINI_RETRY_ATTEMPTS
+                        or time.monotonic() + delay >= deadline):
+                    metrics.incr('failed')
+                    raise
+                metrics.incr('retries')
+                time.sleep(delay)
+        
+        try:
+            if first is not None:
+                yield first
+                yield from stream
+        except Exception:
+            metrics.incr('failed')
+            raise
+        latencies.record(key, time.monotonic() - started)
+        metrics.incr('succeeded')
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._models, name)
+
+
+class _ResilientAsyncModels(_ResilientModels):
+    async def _attempt_async(self, key: Tuple[str, int], kwargs: Dict[str, Any]) -> Any:
+        started = time.monotonic()
+        response = await self._models.generate_content(**kwargs)
+        latencies.record(key, time.monotonic() - started)
+        return response
+    
+    async def _hedged_async(self, key: Tuple[str, int], kwargs: Dict[str, Any]) -> Any:
+        tasks = [asyncio.ensure_future(self._attempt_async(key, kwargs))]
+        try:
+            hedge_after = _hedge_after(key)
+            if hedge_after:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    # Slower than the observed p95: race a duplicate request
+                    metrics.incr('hedges')
+                    tasks.append(asyncio.ensure_future(self._attempt_async(key, kwargs)))
+            
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            metrics.incr('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser is cancelled, which also closes its HTTP request
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def generate_content(self, **kwargs) -> Any:
+        key = _shape(kwargs.get('model', ''), kwargs.get('contents'))
+        deadline = time.monotonic() + Config.GEMINI_CALL_DEADLINE_SECONDS
+        metrics.incr('calls')
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.wait_for(self._hedged_async(key, kwargs),
+                                                  max(0.0, deadline - time.monotonic()))
+                metrics.incr('succeeded')
+                return response
+            except Exception as e:
+                # asyncio.TimeoutError is the builtin TimeoutError (3.11+): only wait_for
+                # giving up at the deadline is one; an attempt's own timeout is retried
+                if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline - DEADLINE_SLACK:
+                    metrics.incr('deadline_exceeded')
+                    metrics.incr('failed')
+                    raise DeadlineExceeded(f'Gemini call exceeded {Config.GEMINI_CALL_DEADLINE_SECONDS:g}s') from e
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if (not is_retryable(e) or attempt >= Config.GEMINI_RETRY_ATTEMPTS
+                        or time.monotonic() + delay >= deadline):
+                    metrics.incr('failed')
+                    raise
+                metrics.incr('retries')
+                await asyncio.sleep(delay)
+    
+    async def generate_content_stream(self, **kwargs) -> AsyncIterator[Any]:
+        """Async generate_content_stream, retried until the first chunk arrives.
+        
+        Awaiting it waits for that first chunk, so the caller gets either a
+        live stream or the final error (see _ResilientModels.generate_content_stream).
+        """
+        key = _shape(kwargs.get('model', ''), kwargs.get('contents'))
+        deadline = time.monotonic() + Config.GEMINI_CALL_DEADLINE_SECONDS
+        metrics.incr('calls')
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                stream = (await self._models.generate_content_stream(**kwargs)).__aiter__()
+                first = await anext(stream, None)
+                break
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if (not is_retryable(e) or attempt >= Config.GEMINI_RETRY_ATTEMPTS
+                        or time.monotonic() + delay >= deadline):
+                    metrics.incr('failed')
+                    raise
+                metrics.incr('retries')
+                await asyncio.sleep(delay)
+        return self._rest_of_stream(key, started, first, stream)
+    
+    async def _rest_of_stream(self, key: Tuple[str, int], started: float, first: Any,
+                              stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        try:
+            if first is not None:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+        except Exception:
+            metrics.incr('failed')
+            raise
+        latencies.record(key, time.monotonic() - started)
+        metrics.incr('succeeded')
+
+
+class _ResilientAio:
+    def __init__(self, aio: Any):
+        self._aio = aio
+        self.models = _ResilientAsyncModels(aio.models)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._aio, name)
+
+
+class ResilientClient:
+    """Client wrapper adding retries, hedging and deadlines to generate_content.
+    
+    generate_content_stream (sync and async) is retried until its first chunk
+    (see _ResilientModels).
+    
+    Sits outside the scheduler, so every retry and hedge is rate limited
+    like any other request. Other client attributes pass through.
+    """
+    
+    def __init__(self, client: Any):
+        self._client = client
+        self.models = _ResilientModels(client.models)
+        self.aio = _ResilientAio(client.aio)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def resilience_stats() -> Dict[str, Any]:
+    return {**metrics.snapshot(), 'latency': latencies.summary()}
+
+
+def _reset_after_fork():
+    global _lock, _pool
+    _lock = threading.Lock()
+    _pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,325 @@
+# Central rate limiter and priority scheduler for Gemini traffic
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from app.config import Config
+
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = {INTERACTIVE: 0, BULK: 1}
+
+_priority: ContextVar[str] = ContextVar('gemini_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: str):
+    """Run Gemini calls made inside the block at the given priority class."""
+    token = _priority.set(level if level in PRIORITIES else INTERACTIVE)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def estimate_tokens(contents: Any) -> int:
+    # Rough input size: ~4 characters per text token, a fixed cost per image/blob
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (bytes, bytearray)):
+        return Config.GEMINI_IMAGE_TOKEN_ESTIMATE
+    if isinstance(contents, dict):
+        if 'inline_data' in contents:
+            return Config.GEMINI_IMAGE_TOKEN_ESTIMATE
+        return sum(estimate_tokens(v) for v in contents.values())
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(c) for c in contents)
+    if hasattr(contents, 'size') and hasattr(contents, 'mode'):  # PIL image
+        return Config.GEMINI_IMAGE_TOKEN_ESTIMATE
+    return max(1, len(str(contents)) // 4)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute of burst.
+    
+    A limit of 0 disables the bucket. Not thread-safe; the scheduler locks.
+    """
+    
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+    
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, reserve: float = 0.0, now: float = None) -> float:
+        # Seconds until `amount` can be taken while leaving `reserve` in the bucket
+        if not self.enabled:
+            return 0.0
+        self._refill(time.monotonic() if now is None else now)
+        # A request larger than the bucket waits for a full bucket, then overdraws
+        needed = min(amount, self.capacity) + reserve * self.capacity
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+    
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.level -= amount
+    
+    def give(self, amount: float) -> None:
+        if self.enabled:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class GeminiScheduler:
+    """Admits Gemini requests under RPM/TPM budgets, interactive first.
+    
+    Waiting requests form one queue ordered by priority class, then arrival.
+    Only the head of the queue may take budget, and bulk requests also leave
+    GEMINI_INTERACTIVE_RESERVE of each bucket untouched, so a class upload
+    can never drain the quota a teacher's interactive request needs.
+    Token use is charged from an estimate up front and corrected with the
+    response's usage metadata when available (settle).
+    """
+    
+    def __init__(self, rpm: int, tpm: int, reserve: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.reserve = reserve
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._granted = {level: 0 for level in PRIORITIES}
+        self._waited = {level: 0.0 for level in PRIORITIES}
+        self._max_depth = {level: 0 for level in PRIORITIES}
+        self._in_flight = 0
+    
+    def _enqueue(self, level: str) -> Tuple[int, int]:
+        ticket = (PRIORITIES[level], next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        depth = sum(1 for t in self._queue if t[0] == ticket[0])
+        self._max_depth[level] = max(self._max_depth[level], depth)
+        return ticket
+    
+    def _try_grant(self, ticket: Tuple[int, int], cost: int) -> float:
+        # 0 when granted (ticket removed, budget taken), else seconds to wait
+        if self._queue[0] != ticket:
+            return Config.GEMINI_SCHEDULER_POLL_SECONDS
+        reserve = self.reserve if ticket[0] > PRIORITIES[INTERACTIVE] else 0.0
+        now = time.monotonic()
+        wait = max(self.requests.wait_time(1, reserve, now), self.tokens.wait_time(cost, reserve, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self._in_flight += 1
+        return 0.0
+    
+    def _granted_after(self, level: str, started: float) -> None:
+        self._granted[level] += 1
+        self._waited[level] += time.monotonic() - started
+        self._cond.notify_all()
+    
+    def acquire(self, cost: int, level: str = None) -> None:
+        """Block until one request of `cost` estimated tokens may be sent."""
+        level = level or current_priority()
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(level)
+            while True:
+                wait = self._try_grant(ticket, cost)
+                if not wait:
+                    self._granted_after(level, started)
+                    return
+                self._cond.wait(wait)
+    
+    async def acquire_async(self, cost: int, level: str = None) -> None:
+        # acquire without blocking the event loop; queue position is shared
+        level = level or current_priority()
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(level)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_grant(ticket, cost)
+                    if not wait:
+                        self._granted_after(level, started)
+                        return
+                await asyncio.sleep(min(wait, Config.GEMINI_SCHEDULER_POLL_SECONDS))
+        except BaseException:
+            # Cancelled while queued: give up the place in line
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+            raise
+    
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """Finish a request, correcting the token charge with actual usage."""
+        with self._cond:
+            self._in_flight -= 1
+            if actual is not None:
+                if actual > estimated:
+                    self.tokens.take(actual - estimated)
+                else:
+                    self.tokens.give(estimated - actual)
+            self._cond.notify_all()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            self.requests.wait_time(0, now=now)
+            self.tokens.wait_time(0, now=now)
+            return {
+                'queue_depth': {level: sum(1 for t in self._queue if t[0] == rank)
+                                for level, rank in PRIORITIES.items()},
+                'max_queue_depth': dict(self._max_depth),
+                'granted': dict(self._granted),
+                'avg_wait_ms': {level: round(self._waited[level] / self._granted[level] * 1000, 2)
+                                if self._granted[level] else 0.0 for level in PRIORITIES},
+                'in_flight': self._in_flight,
+                'rpm_available': round(self.requests.level, 1) if self.requests.enabled else None,
+                'tpm_available': round(self.tokens.level) if self.tokens.enabled else None
+            }
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', None)
+    return int(total) if total else None
+
+
+class _ScheduledModels:
+    def __init__(self, models: Any, scheduler: GeminiScheduler):
+        self._models = models
+        self._scheduler = scheduler
+    
+    def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        cost = estimate_tokens(contents)
+        self._scheduler.acquire(cost)
+        response = None
+        try:
+            response = self._models.generate_content(model=model, contents=contents, config=config)
+            return response
+        finally:
+            self._scheduler.settle(cost, _usage_tokens(response))
+    
+    def generate_content_stream(self, *, model: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        # Admitted when first iterated; usage arrives with the last chunk
+        cost = estimate_tokens(contents)
+        self._scheduler.acquire(cost)
+        usage = None
+        try:
+            for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config):
+                usage = _usage_tokens(chunk) or usage
+                yield chunk
+        finally:
+            self._scheduler.settle(cost, usage)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._models, name)
+
+
+class _ScheduledAsyncModels(_ScheduledModels):
+    async def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        cost = estimate_tokens(contents)
+        await self._scheduler.acquire_async(cost)
+        response = None
+        try:
+            response = await self._models.generate_content(model=model, contents=contents, config=config)
+            return response
+        finally:
+            self._scheduler.settle(cost, _usage_tokens(response))
+    
+    async def generate_content_stream(self, *, model: str, contents: Any, config: Any = None) -> AsyncIterator[Any]:
+        # Awaited for an async iterator, like the SDK's; admitted when first iterated
+        return self._stream(model, contents, config)
+    
+    async def _stream(self, model: str, contents: Any, config: Any) -> AsyncIterator[Any]:
+        cost = estimate_tokens(contents)
+        await self._scheduler.acquire_async(cost)
+        usage = None
+        try:
+            async for chunk in await self._models.generate_content_stream(model=model, contents=contents, config=config):
+                usage = _usage_tokens(chunk) or usage
+                yield chunk
+        finally:
+            self._scheduler.settle(cost, usage)
+
+
+class _ScheduledAio:
+    def __init__(self, aio: Any, scheduler: GeminiScheduler):
+        self._aio = aio
+        self.models = _ScheduledAsyncModels(aio.models, scheduler)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._aio, name)
+
+
+class ScheduledClient:
+    """Client wrapper that routes every generate_content(_stream) through the scheduler.
+    
+    Exposes the same `models` / `aio.models` surface as genai.Client, so
+    services keep calling `self.client.models.generate_content(...)`.
+    """
+    
+    def __init__(self, client: Any, scheduler: GeminiScheduler):
+        self._client = client
+        self.models = _ScheduledModels(client.models, scheduler)
+        self.aio = _ScheduledAio(client.aio, scheduler)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+_lock = threading.Lock()
+_scheduler: Optional[GeminiScheduler] = None
+
+
+def get_scheduler() -> GeminiScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = GeminiScheduler(Config.GEMINI_RPM_LIMIT, Config.GEMINI_TPM_LIMIT,
+                                             Config.GEMINI_INTERACTIVE_RESERVE)
+    return _scheduler
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    return get_scheduler().stats() if Config.GEMINI_SCHEDULER else {'enabled': False}
+
+
+def _reset_after_fork():
+    # Each worker gets its own budget share; see GEMINI_RPM_LIMIT
+    global _lock, _scheduler
+    _lock = threading.Lock()
+    _scheduler = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,32 +1,40 @@
 # Grading service for MCQ, T/F, Matching, Fill-in-blank, and ordered questions
-import re
-from typing import List, Dict, Any, Optional
+from functools import lru_cache, partial
+from typing import Callable, List, Dict, Any, FrozenSet, Optional, Tuple, Union
+
+
+NORMALIZE_CACHE_SIZE = 1 << 16  # Distinct answer strings kept normalized (answers repeat across students)
+
+# Dropped from answers: . , : ; ! ? - _ ( ) [ ] { }
+_PUNCTUATION = '.,:;!?-_()[]{}'
+# Arabic option letters read as their Latin counterparts
+_ARABIC_LETTERS = {'أ': 'a', 'ا': 'a', 'ب': 'b', 'ج': 'c', 'د': 'd', 'ه': 'e'}
+_NORMALIZE_TABLE = str.maketrans({**dict.fromkeys(_PUNCTUATION), **_ARABIC_LETTERS})
+_NUMBER_TO_LETTER = {'1': 'a', '2': 'b', '3': 'c', '4': 'd', '5': 'e'}
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_text(text: str) -> str:
+    # One translate pass (punctuation out, Arabic letters in), then whitespace runs collapsed
+    normalized = ' '.join(text.lower().translate(_NORMALIZE_TABLE).split())
+    return _NUMBER_TO_LETTER.get(normalized, normalized)
 
 
 class GradingService:
     # Flexible answer grading with normalization
     
     LETTER_TO_NUMBER = {'a': '1', 'b': '2', 'c': '3', 'd': '4', 'e': '5'}
-    NUMBER_TO_LETTER = {'1': 'a', '2': 'b', '3': 'c', '4': 'd', '5': 'e'}
-    ARABIC_LETTERS = {'أ': 'a', 'ا': 'a', 'ب': 'b', 'ج': 'c', 'د': 'd', 'ه': 'e'}
+    NUMBER_TO_LETTER = _NUMBER_TO_LETTER
+    ARABIC_LETTERS = _ARABIC_LETTERS
+    TRUE_VALUES = frozenset({'true', 't', 'yes', 'y', '1', 'صحيح', 'صح', 'vrai', 'oui'})
+    FALSE_VALUES = frozenset({'false', 'f', 'no', 'n', '0', 'خطأ', 'خاطئ', 'faux', 'non'})
     
     @classmethod
     def normalize_answer(cls, answer: Any) -> str:
-        # Normalize: lowercase, strip, letter/number mapping
+        # Normalize: lowercase, strip, letter/number mapping (memoized per distinct answer)
         if answer is None:
             return ""
-        
-        answer_str = str(answer).strip().lower()
-        answer_str = re.sub(r'[.,:;!?\-_()[\]{}]', '', answer_str)
-        answer_str = re.sub(r'\s+', ' ', answer_str).strip()
-        
-        for arabic, latin in cls.ARABIC_LETTERS.items():
-            answer_str = answer_str.replace(arabic, latin)
-        
-        if len(answer_str) == 1 and answer_str in cls.NUMBER_TO_LETTER:
-            return cls.NUMBER_TO_LETTER[answer_str]
-        
-        return answer_str
+        return _normalize_text(answer if isinstance(answer, str) else str(answer))
     
     @classmethod
     def answers_match(cls, student: Any, correct: Any) -> bool:
@@ -50,17 +58,12 @@ class GradingService:
             return s == c
         
         # Boolean matching
-        true_vals = {'true', 't', 'yes', 'y', '1', 'صحيح', 'صح', 'vrai', 'oui'}
-        false_vals = {'false', 'f', 'no', 'n', '0', 'خطأ', 'خاطئ', 'faux', 'non'}
-        
-        if norm_student in true_vals and norm_correct in true_vals:
-            return True
-        if norm_student in false_vals and norm_correct in false_vals:
-            return True
-        
-        return False
+        if norm_student in cls.TRUE_VALUES:
+            return norm_correct in cls.TRUE_VALUES
+        return norm_student in cls.FALSE_VALUES and norm_correct in cls.FALSE_VALUES
     
-    def _make_key(self, q_num: str, sub_id: Optional[str] = None) -> str:
+    @staticmethod
+    def _make_key(q_num: str, sub_id: Optional[str] = None) -> str:
         key = str(q_num).strip()
         return f"{key}.{sub_id.strip()}".lower() if sub_id else key.lower()
     
@@ -71,46 +74,66 @@ class GradingService:
                        points_per_pair: float = 1.0) -> Dict[str, Any]:
         # Grade matching questions
         # student_answers format: {"1": {"1": "a", "2": "b"}} or {"1": "a", "2": "b"}
+        return AnswerKey(questions, 'matching', points_per_pair).grade(student_answers)
+    
+    # ============ Ordering Questions ============
+    
+    def grade_ordering(self, questions: List[Dict[str, Any]],
+                       student_answers: Dict[str, Any],
+                       points_per_position: float = 1.0) -> Dict[str, Any]:
+        # Grade ordering/sequencing questions
+        # student_answers format: {"1": ["C", "A", "B"]} or {"1": "C,A,B"}
+        return AnswerKey(questions, 'ordering', points_per_position).grade(student_answers)
+    
+    # ============ Labeling (Text Input) ============
+    
+    def grade_labeling(self, questions: List[Dict[str, Any]],
+                       student_answers: Dict[str, Any],
+                       points_per_label: float = 1.0) -> Dict[str, Any]:
+        # Grade labeling questions (text input - students type in blanks)
+        # student_answers format: {"1": {"1": "Left Atrium", "2": "Left Ventricle"}}
         results = []
         total_points = 0.0
         earned_points = 0.0
-        correct_pairs = 0
-        total_pairs = 0
+        correct_labels = 0
+        total_labels = 0
         
         for q in questions:
             q_num = str(q.get('question_number', ''))
-            correct_matches = q.get('correct_matches', {})
-            q_points = q.get('points', len(correct_matches) * points_per_pair)
+            labeling_items = q.get('labeling_items', [])
+            q_points = q.get('points', len(labeling_items) * points_per_label)
             
-            # Get student's matches for this question
-            if q_num in student_answers:
-                student_matches = student_answers[q_num]
-                if not isinstance(student_matches, dict):
-                    student_matches = {}
-            else:
-                student_matches = student_answers  # Flat format
+            # Get student's labels for this question
+            student_labels = student_answers.get(q_num) or student_answers.get(q_num.lower())
+            if not isinstance(student_labels, dict):
+                student_labels = {}
             
-            pair_results = []
+            label_results = []
             q_earned = 0.0
             q_correct = 0
-            points_each = q_points / len(correct_matches) if correct_matches else points_per_pair
+            points_each = q_points / len(labeling_items) if labeling_items else points_per_label
             
-            for left_id, correct_right_id in correct_matches.items():
-                student_right = student_matches.get(left_id) or student_matches.get(str(left_id))
-                is_correct = self.answers_match(student_right, correct_right_id)
+            for item in labeling_items:
+                label_id = str(item.get('label_id', ''))
+                correct_label = item.get('correct_label', '')
+                pointer_desc = item.get('pointer_description', '')
                 
-                total_pairs += 1
+                student_label = student_labels.get(label_id) or student_labels.get(label_id.lower())
+                is_correct = self.answers_match(student_label, correct_label)
+                
+                total_labels += 1
                 total_points += points_each
                 
                 if is_correct:
                     q_earned += points_each
                     q_correct += 1
-                    correct_pairs += 1
+                    correct_labels += 1
                 
-                pair_results.append({
-                    'left_id': left_id,
-                    'student_match': student_right,
-                    'correct_match': correct_right_id,
+                label_results.append({
+                    'label_id': label_id,
+                    'pointer_description': pointer_desc,
+                    'student_label': student_label,
+                    'correct_label': correct_label,
                     'is_correct': is_correct
                 })
             
@@ -118,79 +141,369 @@ class GradingService:
             
             results.append({
                 'question_number': q_num,
-                'question_type': 'matching',
-                'total_pairs': len(correct_matches),
-                'correct_pairs': q_correct,
+                'question_type': 'labeling',
+                'diagram_description': q.get('diagram_description', ''),
+                'total_labels': len(labeling_items),
+                'correct_labels': q_correct,
                 'points_earned': q_earned,
                 'points_possible': q_points,
-                'pair_details': pair_results
+                'label_details': label_results
             })
         
         return {
-            'question_type': 'matching',
+            'question_type': 'labeling',
             'total_questions': len(questions),
-            'total_pairs': total_pairs,
-            'correct_pairs': correct_pairs,
-            'incorrect_pairs': total_pairs - correct_pairs,
+            'total_labels': total_labels,
+            'correct_labels': correct_labels,
+            'incorrect_labels': total_labels - correct_labels,
             'points_earned': earned_points,
             'points_possible': total_points,
             'percentage': (earned_points / total_points * 100) if total_points > 0 else 0,
             'details': results
         }
     
-    # ============ Ordering Questions ============
+    # ============ Fill in the Blank ============
     
-    def grade_ordering(self, questions: List[Dict[str, Any]],
-                       student_answers: Dict[str, Any],
-                       points_per_position: float = 1.0) -> Dict[str, Any]:
-        # Grade ordering/sequencing questions
-        # student_answers format: {"1": ["C", "A", "B"]} or {"1": "C,A,B"}
+    def grade_fill_in_blank(self, questions: List[Dict[str, Any]],
+                             student_answers: Dict[str, Any],
+                             points_per_blank: float = 1.0) -> Dict[str, Any]:
+        # Grade fill-in-the-blank questions
+        # student_answers format: {"1": ["ans1", "ans2"]} or {"1": "single_answer"}
+        # blanks format: ["answer1", "answer2"] or 
+        #   [["acceptable1", "acceptable2"], "single_answer"] for multiple acceptable answers per blank
+        return AnswerKey(questions, 'fill_in_blank', points_per_blank).grade(student_answers)
+    
+    # ============ MCQ and T/F ============
+    
+    def grade_multiple_choice(self, questions, student_answers, points_per_question=1.0):
+        return self._grade_section(questions, student_answers, points_per_question, 'multiple_choice')
+    
+    def grade_true_false(self, questions, student_answers, points_per_question=1.0):
+        return self._grade_section(questions, student_answers, points_per_question, 'true_false')
+    
+    def _grade_section(self, questions, student_answers, points, q_type):
+        return AnswerKey(questions, q_type, points).grade(student_answers)
+    
+    # ============ Ordered Format ============
+    
+    def grade_ordered_questions(self, questions: List[Dict[str, Any]], 
+                                 student_answers: Dict[str, Any],
+                                 default_points: float = 1.0) -> Dict[str, Any]:
+        # Grade ordered format - all gradable types
+        return AnswerKey(questions, 'ordered', default_points).grade(student_answers)
+    
+    # ============ Whole Class ============
+    
+    def grade_class(self, questions: List[Dict[str, Any]],
+                    students: Union[Dict[str, Dict[str, Any]], List[Dict[str, Any]]],
+                    question_type: str = 'ordered', default_points: float = 1.0) -> Dict[str, Any]:
+        """Grade many students' answers against one exam.
+        
+        The answer key is compiled once (see AnswerKey), so each further
+        student costs only normalizing their answers and set lookups.
+        `students` maps student ids to student_answers dicts (a list is keyed
+        by position). Each student gets the same result as the single-student
+        method for `question_type`, which is one of AnswerKey.MODES.
+        """
+        key = AnswerKey(questions, question_type, default_points)
+        entries = students.items() if isinstance(students, dict) else enumerate(students)
+        results = [{'student_id': str(student_id), **key.grade(answers or {})} for student_id, answers in entries]
+        percentages = [r['percentage'] for r in results]
+        return {
+            'question_type': question_type,
+            'student_count': len(results),
+            'points_possible': results[0]['points_possible'] if results else 0.0,
+            'average_percentage': sum(percentages) / len(percentages) if percentages else 0,
+            'min_percentage': min(percentages, default=0),
+            'max_percentage': max(percentages, default=0),
+            'students': results
+        }
+
+
+def _accepted(correct: Any) -> FrozenSet[str]:
+    # Every normalized answer answers_match accepts for `correct`: the value itself and
+    # its true/false equivalents (single letters only ever match themselves)
+    norm = GradingService.normalize_answer(correct)
+    if not norm:
+        return frozenset()
+    accepted = {norm}
+    for values in (GradingService.TRUE_VALUES, GradingService.FALSE_VALUES):
+        if norm in values:
+            accepted.update(v for v in values if len(v) > 1 or len(norm) > 1)
+    return frozenset(accepted)
+
+
+def _matches(student: Any, accepted: FrozenSet[str]) -> bool:
+    # answers_match(student, correct) against a compiled correct value
+    return GradingService.normalize_answer(student) in accepted
+
+
+class AnswerKey:
+    """An exam's correct answers, compiled once to grade any number of students.
+    
+    Every correct value is normalized up front into the set of normalized
+    answers it accepts (letter/number and true/false equivalents included),
+    and fill-in blanks with several acceptable answers into one lookup, so
+    grading a student is normalizing their answers (memoized) and set
+    lookups. `grade` returns exactly what the GradingService method for
+    `mode` returns.
+    """
+    
+    MODES = ('multiple_choice', 'true_false', 'matching', 'ordering', 'fill_in_blank', 'ordered')
+    GRADABLE_TYPES = ('multiple_choice', 'true_false', 'matching', 'fill_in_blank')
+    
+    def __init__(self, questions: List[Dict[str, Any]], mode: str = 'ordered', default_points: float = 1.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown grading mode '{mode}' (use {', '.join(self.MODES)})")
+        self.mode = mode
+        self.question_count = len(questions)
+        compile_mode = {
+            'multiple_choice': self._compile_section, 'true_false': self._compile_section,
+            'matching': self._compile_matching, 'ordering': self._compile_ordering,
+            'fill_in_blank': self._compile_fill_in_blank, 'ordered': self._compile_ordered
+        }[mode]
+        self._items = [compile_mode(q, default_points) for q in questions]
+        self._readers = None  # Built by the first row()
+        self._grade = {
+            'multiple_choice': self._grade_section, 'true_false': self._grade_section,
+            'matching': self._grade_matching, 'ordering': self._grade_ordering,
+            'fill_in_blank': self._grade_fill_in_blank, 'ordered': self._grade_ordered
+        }[mode]
+    
+    def grade(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
+        """Grade one student's answers (the student_answers dict of the single-student API)."""
+        return self._grade(student_answers)
+    
+    def columns(self) -> List[Dict[str, Any]]:
+        """The key's gradable items in grading order, one per answer a student gives.
+        
+        An MCQ/TF question is one item; a matching question one per pair,
+        an ordering question one per position, a fill-in question one per
+        blank and a parent question one per gradable sub-question. Each item
+        has its question_index (position in the exam), question_number, item
+        (pair left id, 1-based position or blank, sub_id; None for
+        single-answer questions), points, the correct_answer and the
+        normalized answers it accepts.
+        """
+        columns = []
+        
+        def add(q_num, item, points, correct, accepted):
+            columns.append({'question_index': index, 'question_number': q_num, 'item': item, 'points': points,
+                            'correct_answer': correct, 'accepted': accepted})
+        
+        for index, entry in enumerate(self._items):
+            if self.mode in ('multiple_choice', 'true_false'):
+                q_num, correct_ans, pts, accepted = entry
+                add(q_num, None, pts, correct_ans, accepted)
+            elif self.mode == 'matching':
+                q_num, _, points_each, pairs = entry
+                for left_id, _, correct_right_id, accepted in pairs:
+                    add(q_num, left_id, points_each, correct_right_id, accepted)
+            elif self.mode == 'ordering':
+                q_num, _, _, points_each, positions = entry
+                for i, (correct_item, accepted) in enumerate(positions):
+                    add(q_num, i + 1, points_each, correct_item, accepted)
+            elif self.mode == 'fill_in_blank':
+                q_num, _, _, _, points_each, blanks = entry
+                for i, (display_correct, acceptable) in enumerate(blanks):
+                    add(q_num, i + 1, points_each, display_correct, frozenset(acceptable))
+            elif entry is None:
+                continue
+            elif entry[0] == 'parent':
+                for sq_id, _, _, sq_points, sq_correct, accepted in entry[2]:
+                    add(entry[1], sq_id, sq_points, sq_correct, accepted)
+            elif entry[0] == 'choice':
+                _, q_num, _, _, points, correct_answer, accepted = entry
+                add(q_num, None, points, correct_answer, accepted)
+            elif entry[0] == 'matching':
+                _, q_num, _, points_each, pairs = entry
+                for left_id, _, correct_right, accepted in pairs:
+                    add(q_num, left_id, points_each, correct_right, accepted)
+            else:
+                _, q_num, _, points_each, blanks = entry
+                for i, (correct_blank, accepted) in enumerate(blanks):
+                    add(q_num, i + 1, points_each, correct_blank, accepted)
+        return columns
+    
+    def row(self, student_answers: Dict[str, Any]) -> List[Any]:
+        """A student's raw answer to each of columns(), looked up as grade() looks them up."""
+        if self._readers is None:
+            self._readers = self._row_readers()
+        row = []
+        for read in self._readers:
+            row.extend(read(student_answers))
+        return row
+    
+    def _row_readers(self) -> List[Callable[[Dict[str, Any]], List[Any]]]:
+        # Functions returning a student's answers to successive columns: each run of
+        # single-answer questions is read by one list comprehension
+        readers = []
+        keys: List[Tuple[Any, Any]] = []
+        
+        def close_run():
+            if not keys:
+                return
+            run = tuple(keys)
+            if self.mode == 'ordered':
+                readers.append(lambda student_answers: [student_answers.get(q_num) or student_answers.get(q_key)
+                                                        for q_num, q_key in run])
+            else:
+                numbers = tuple(q_num for q_num, _ in run)
+                readers.append(lambda student_answers: [student_answers.get(q_num) for q_num in numbers])
+            keys.clear()
+        
+        for entry in self._items:
+            if self.mode in ('multiple_choice', 'true_false'):
+                keys.append((entry[0], None))
+            elif self.mode == 'ordered' and entry is not None and entry[0] == 'choice':
+                keys.append((entry[1], entry[2]))
+            elif entry is not None:
+                close_run()
+                readers.append(partial(self._entry_answers, entry))
+        close_run()
+        return readers
+    
+    def _entry_answers(self, entry: Tuple, student_answers: Dict[str, Any]) -> List[Any]:
+        # A student's answers to the columns of one multi-answer question
+        if self.mode == 'matching':
+            student_matches = self._student_matches(student_answers, entry[0], flat=True)
+            return [student_matches.get(left_id) or student_matches.get(left_key) for left_id, left_key, _, _ in entry[3]]
+        if self.mode in ('ordering', 'fill_in_blank'):
+            q_num, q_key, items = entry[0], entry[1], entry[-1]
+            student_ans = student_answers.get(q_num) or student_answers.get(q_key)
+            answers = self._student_order(student_ans) if self.mode == 'ordering' else self._student_blanks(student_ans)
+            return [answers[i] if i < len(answers) else None for i in range(len(items))]
+        if entry[0] == 'parent':
+            return [self._sub_answer(student_answers, entry[1], sq_id, key) for sq_id, key, *_ in entry[2]]
+        if entry[0] == 'matching':
+            student_matches = self._student_matches(student_answers, entry[1], flat=False)
+            return [student_matches.get(left_id) or student_matches.get(left_key) for left_id, left_key, _, _ in entry[4]]
+        student_ans = student_answers.get(entry[1])
+        answers = self._student_blanks(student_ans) if student_ans else []
+        return [answers[i] if i < len(answers) else None for i in range(len(entry[4]))]
+    
+    # ============ Student Answer Lookup ============
+    
+    @staticmethod
+    def _student_matches(student_answers: Dict[str, Any], q_num: str, flat: bool) -> Dict[str, Any]:
+        # A matching question's {left_id: right_id}; `flat` falls back to the whole dict ({"1": "a", "2": "b"})
+        if q_num in student_answers or not flat:
+            student_matches = student_answers.get(q_num, {})
+            return student_matches if isinstance(student_matches, dict) else {}
+        return student_answers
+    
+    @staticmethod
+    def _student_order(student_order: Any) -> List[str]:
+        # Ordering answer as a list: ["C", "A", "B"] or comma-separated "C,A,B" / "C, A, B"
+        if student_order is None:
+            return []
+        if isinstance(student_order, list):
+            return [str(x).strip() for x in student_order]
+        if isinstance(student_order, str):
+            return [x.strip() for x in student_order.split(',')]
+        return [str(student_order)]
+    
+    @staticmethod
+    def _student_blanks(student_ans: Any) -> List[Any]:
+        # Fill-in answer as a list: ["ans1", "ans2"] or "single_answer"
+        if student_ans is None:
+            return []
+        return student_ans if isinstance(student_ans, list) else [student_ans]
+    
+    @staticmethod
+    def _sub_answer(student_answers: Dict[str, Any], q_num: str, sq_id: str, key: str) -> Any:
+        # Sub-question answer: {"3": {"a": ...}}, {"3.a": ...} or {"a": ...}
+        if q_num in student_answers and isinstance(student_answers.get(q_num), dict):
+            return student_answers[q_num].get(sq_id)
+        if key in student_answers:
+            return student_answers[key]
+        if sq_id in student_answers:
+            return student_answers[sq_id]
+        return None
+    
+    # ============ MCQ and T/F ============
+    
+    def _compile_section(self, q: Dict[str, Any], points: float) -> Tuple:
+        correct_ans = q.get('correct_answer')
+        return q.get('question_number'), correct_ans, q.get('points', points), _accepted(correct_ans)
+    
+    def _grade_section(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
         results = []
-        total_points = 0.0
-        earned_points = 0.0
-        correct_positions = 0
-        total_positions = 0
+        total = 0.0
+        earned = 0.0
+        correct = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            correct_order = q.get('correct_order', [])
-            q_points = q.get('points', len(correct_order) * points_per_position)
+        for q_num, correct_ans, pts, accepted in self._items:
+            student_ans = student_answers.get(q_num)
             
-            # Get student's answer
-            student_order = student_answers.get(q_num) or student_answers.get(q_num.lower())
+            total += pts
+            is_correct = _matches(student_ans, accepted)
             
-            # Normalize to list
-            if student_order is None:
-                student_list = []
-            elif isinstance(student_order, list):
-                student_list = [str(x).strip() for x in student_order]
-            elif isinstance(student_order, str):
-                # Support comma-separated: "C,A,B" or "C, A, B"
-                student_list = [x.strip() for x in student_order.split(',')]
-            else:
-                student_list = [str(student_order)]
+            if is_correct:
+                earned += pts
+                correct += 1
             
-            position_results = []
+            results.append({
+                'question_number': q_num,
+                'student_answer': student_ans,
+                'correct_answer': correct_ans,
+                'is_correct': is_correct,
+                'points_earned': pts if is_correct else 0,
+                'points_possible': pts
+            })
+        
+        return {
+            'question_type': self.mode,
+            'total_questions': self.question_count,
+            'correct_count': correct,
+            'incorrect_count': self.question_count - correct,
+            'points_earned': earned,
+            'points_possible': total,
+            'percentage': (earned / total * 100) if total > 0 else 0,
+            'details': results
+        }
+    
+    # ============ Matching ============
+    
+    def _compile_matching(self, q: Dict[str, Any], points_per_pair: float) -> Tuple:
+        q_num = str(q.get('question_number', ''))
+        correct_matches = q.get('correct_matches', {})
+        q_points = q.get('points', len(correct_matches) * points_per_pair)
+        points_each = q_points / len(correct_matches) if correct_matches else points_per_pair
+        pairs = [(left_id, str(left_id), correct_right_id, _accepted(correct_right_id))
+                 for left_id, correct_right_id in correct_matches.items()]
+        return q_num, q_points, points_each, pairs
+    
+    def _grade_matching(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
+        results = []
+        total_points = 0.0
+        earned_points = 0.0
+        correct_pairs = 0
+        total_pairs = 0
+        
+        for q_num, q_points, points_each, pairs in self._items:
+            student_matches = self._student_matches(student_answers, q_num, flat=True)
+            
+            pair_results = []
             q_earned = 0.0
             q_correct = 0
-            points_each = q_points / len(correct_order) if correct_order else points_per_position
             
-            for i, correct_item in enumerate(correct_order):
-                student_item = student_list[i] if i < len(student_list) else None
-                is_correct = self.answers_match(student_item, correct_item)
+            for left_id, left_key, correct_right_id, accepted in pairs:
+                student_right = student_matches.get(left_id) or student_matches.get(left_key)
+                is_correct = _matches(student_right, accepted)
                 
-                total_positions += 1
+                total_pairs += 1
                 total_points += points_each
                 
                 if is_correct:
                     q_earned += points_each
                     q_correct += 1
-                    correct_positions += 1
+                    correct_pairs += 1
                 
-                position_results.append({
-                    'position': i + 1,
-                    'expected_item': correct_item,
-                    'student_item': student_item,
+                pair_results.append({
+                    'left_id': left_id,
+                    'student_match': student_right,
+                    'correct_match': correct_right_id,
                     'is_correct': is_correct
                 })
             
@@ -198,75 +511,66 @@ class GradingService:
             
             results.append({
                 'question_number': q_num,
-                'question_type': 'ordering',
-                'total_positions': len(correct_order),
-                'correct_positions': q_correct,
+                'question_type': 'matching',
+                'total_pairs': len(pairs),
+                'correct_pairs': q_correct,
                 'points_earned': q_earned,
                 'points_possible': q_points,
-                'position_details': position_results
+                'pair_details': pair_results
             })
         
         return {
-            'question_type': 'ordering',
-            'total_questions': len(questions),
-            'total_positions': total_positions,
-            'correct_positions': correct_positions,
-            'incorrect_positions': total_positions - correct_positions,
+            'question_type': 'matching',
+            'total_questions': self.question_count,
+            'total_pairs': total_pairs,
+            'correct_pairs': correct_pairs,
+            'incorrect_pairs': total_pairs - correct_pairs,
             'points_earned': earned_points,
             'points_possible': total_points,
             'percentage': (earned_points / total_points * 100) if total_points > 0 else 0,
             'details': results
         }
     
-    # ============ Labeling (Text Input) ============
+    # ============ Ordering ============
     
-    def grade_labeling(self, questions: List[Dict[str, Any]],
-                       student_answers: Dict[str, Any],
-                       points_per_label: float = 1.0) -> Dict[str, Any]:
-        # Grade labeling questions (text input - students type in blanks)
-        # student_answers format: {"1": {"1": "Left Atrium", "2": "Left Ventricle"}}
+    def _compile_ordering(self, q: Dict[str, Any], points_per_position: float) -> Tuple:
+        q_num = str(q.get('question_number', ''))
+        correct_order = q.get('correct_order', [])
+        q_points = q.get('points', len(correct_order) * points_per_position)
+        points_each = q_points / len(correct_order) if correct_order else points_per_position
+        positions = [(correct_item, _accepted(correct_item)) for correct_item in correct_order]
+        return q_num, q_num.lower(), q_points, points_each, positions
+    
+    def _grade_ordering(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
         results = []
         total_points = 0.0
         earned_points = 0.0
-        correct_labels = 0
-        total_labels = 0
+        correct_positions = 0
+        total_positions = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            labeling_items = q.get('labeling_items', [])
-            q_points = q.get('points', len(labeling_items) * points_per_label)
-            
-            # Get student's labels for this question
-            student_labels = student_answers.get(q_num) or student_answers.get(q_num.lower())
-            if not isinstance(student_labels, dict):
-                student_labels = {}
+        for q_num, q_key, q_points, points_each, positions in self._items:
+            student_list = self._student_order(student_answers.get(q_num) or student_answers.get(q_key))
             
-            label_results = []
+            position_results = []
             q_earned = 0.0
             q_correct = 0
-            points_each = q_points / len(labeling_items) if labeling_items else points_per_label
             
-            for item in labeling_items:
-                label_id = str(item.get('label_id', ''))
-                correct_label = item.get('correct_label', '')
-                pointer_desc = item.get('pointer_description', '')
-                
-                student_label = student_labels.get(label_id) or student_labels.get(label_id.lower())
-                is_correct = self.answers_match(student_label, correct_label)
+            for i, (correct_item, accepted) in enumerate(positions):
+                student_item = student_list[i] if i < len(student_list) else None
+                is_correct = _matches(student_item, accepted)
                 
-                total_labels += 1
+                total_positions += 1
                 total_points += points_each
                 
                 if is_correct:
                     q_earned += points_each
                     q_correct += 1
-                    correct_labels += 1
+                    correct_positions += 1
                 
-                label_results.append({
-                    'label_id': label_id,
-                    'pointer_description': pointer_desc,
-                    'student_label': student_label,
-                    'correct_label': correct_label,
+                position_results.append({
+                    'position': i + 1,
+                    'expected_item': correct_item,
+                    'student_item': student_item,
                     'is_correct': is_correct
                 })
             
@@ -274,21 +578,20 @@ class GradingService:
             
             results.append({
                 'question_number': q_num,
-                'question_type': 'labeling',
-                'diagram_description': q.get('diagram_description', ''),
-                'total_labels': len(labeling_items),
-                'correct_labels': q_correct,
+                'question_type': 'ordering',
+                'total_positions': len(positions),
+                'correct_positions': q_correct,
                 'points_earned': q_earned,
                 'points_possible': q_points,
-                'label_details': label_results
+                'position_details': position_results
             })
         
         return {
-            'question_type': 'labeling',
-            'total_questions': len(questions),
-            'total_labels': total_labels,
-            'correct_labels': correct_labels,
-            'incorrect_labels': total_labels - correct_labels,
+            'question_type': 'ordering',
+            'total_questions': self.question_count,
+            'total_positions': total_positions,
+            'correct_positions': correct_positions,
+            'incorrect_positions': total_positions - correct_positions,
             'points_earned': earned_points,
             'points_possible': total_points,
             'percentage': (earned_points / total_points * 100) if total_points > 0 else 0,
@@ -297,64 +600,49 @@ class GradingService:
     
     # ============ Fill in the Blank ============
     
-    def grade_fill_in_blank(self, questions: List[Dict[str, Any]],
-                             student_answers: Dict[str, Any],
-                             points_per_blank: float = 1.0) -> Dict[str, Any]:
-        # Grade fill-in-the-blank questions
-        # student_answers format: {"1": ["ans1", "ans2"]} or {"1": "single_answer"}
-        # blanks format: ["answer1", "answer2"] or 
-        #   [["acceptable1", "acceptable2"], "single_answer"] for multiple acceptable answers per blank
+    def _compile_blank(self, correct_blank: Any) -> Tuple:
+        # (display answer, {normalized answer: acceptable answer it matches first})
+        if not isinstance(correct_blank, list):
+            return correct_blank, {norm: correct_blank for norm in _accepted(correct_blank)}
+        acceptable = {}
+        for answer in correct_blank:
+            for norm in _accepted(answer):
+                acceptable.setdefault(norm, answer)
+        display_correct = " / ".join(str(a) for a in correct_blank[:3])
+        if len(correct_blank) > 3:
+            display_correct += f" (+{len(correct_blank)-3} more)"
+        return display_correct, acceptable
+    
+    def _compile_fill_in_blank(self, q: Dict[str, Any], points_per_blank: float) -> Tuple:
+        q_num = str(q.get('question_number', ''))
+        correct_blanks_list = q.get('blanks', [])
+        q_text = q.get('question_text', '')
+        q_points = q.get('points', len(correct_blanks_list) * points_per_blank)
+        points_each = q_points / len(correct_blanks_list) if correct_blanks_list else points_per_blank
+        blanks = [self._compile_blank(correct_blank) for correct_blank in correct_blanks_list]
+        display_text = q_text[:100] + '...' if len(q_text) > 100 else q_text
+        return q_num, q_num.lower(), display_text, q_points, points_each, blanks
+    
+    def _grade_fill_in_blank(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
         results = []
         total_points = 0.0
         earned_points = 0.0
         correct_blanks = 0
         total_blanks = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            correct_blanks_list = q.get('blanks', [])
-            q_text = q.get('question_text', '')
-            q_points = q.get('points', len(correct_blanks_list) * points_per_blank)
-            
-            # Get student's answers
-            student_ans = student_answers.get(q_num) or student_answers.get(q_num.lower())
-            
-            # Normalize to list
-            if student_ans is None:
-                student_ans_list = []
-            elif isinstance(student_ans, list):
-                student_ans_list = student_ans
-            else:
-                student_ans_list = [student_ans]
+        for q_num, q_key, display_text, q_points, points_each, blanks in self._items:
+            student_ans_list = self._student_blanks(student_answers.get(q_num) or student_answers.get(q_key))
             
             blank_results = []
             q_earned = 0.0
             q_correct = 0
-            points_each = q_points / len(correct_blanks_list) if correct_blanks_list else points_per_blank
             
-            for i, correct_blank in enumerate(correct_blanks_list):
+            for i, (display_correct, acceptable) in enumerate(blanks):
                 student_blank = student_ans_list[i] if i < len(student_ans_list) else None
-                
-                # Support multiple acceptable answers per blank
-                # If correct_blank is a list, any match counts as correct
-                is_correct = False
-                matched_answer = None
-                
-                if isinstance(correct_blank, list):
-                    # Multiple acceptable answers for this blank
-                    for acceptable in correct_blank:
-                        if self.answers_match(student_blank, acceptable):
-                            is_correct = True
-                            matched_answer = acceptable
-                            break
-                    display_correct = " / ".join(str(a) for a in correct_blank[:3])
-                    if len(correct_blank) > 3:
-                        display_correct += f" (+{len(correct_blank)-3} more)"
-                else:
-                    # Single correct answer
-                    is_correct = self.answers_match(student_blank, correct_blank)
-                    matched_answer = correct_blank if is_correct else None
-                    display_correct = correct_blank
+                # Any acceptable answer of the blank counts as correct
+                student_norm = GradingService.normalize_answer(student_blank)
+                is_correct = student_norm in acceptable
+                matched_answer = acceptable[student_norm] if is_correct else None
                 
                 total_blanks += 1
                 total_points += points_each
@@ -377,8 +665,8 @@ class GradingService:
             results.append({
                 'question_number': q_num,
                 'question_type': 'fill_in_blank',
-                'question_text': q_text[:100] + '...' if len(q_text) > 100 else q_text,
-                'total_blanks': len(correct_blanks_list),
+                'question_text': display_text,
+                'total_blanks': len(blanks),
                 'correct_blanks': q_correct,
                 'points_earned': q_earned,
                 'points_possible': q_points,
@@ -387,7 +675,7 @@ class GradingService:
         
         return {
             'question_type': 'fill_in_blank',
-            'total_questions': len(questions),
+            'total_questions': self.question_count,
             'total_blanks': total_blanks,
             'correct_blanks': correct_blanks,
             'incorrect_blanks': total_blanks - correct_blanks,
@@ -397,102 +685,68 @@ class GradingService:
             'details': results
         }
     
-    # ============ MCQ and T/F ============
-    
-    def grade_multiple_choice(self, questions, student_answers, points_per_question=1.0):
-        return self._grade_section(questions, student_answers, points_per_question, 'multiple_choice')
-    
-    def grade_true_false(self, questions, student_answers, points_per_question=1.0):
-        return self._grade_section(questions, student_answers, points_per_question, 'true_false')
+    # ============ Ordered Format ============
     
-    def _grade_section(self, questions, student_answers, points, q_type):
-        results = []
-        total = 0.0
-        earned = 0.0
-        correct = 0
+    def _compile_ordered(self, q: Dict[str, Any], default_points: float) -> Optional[Tuple]:
+        # (kind, ...) per question; None for questions with nothing gradable
+        q_num = str(q.get('question_number', ''))
+        q_type = q.get('question_type', '')
+        points = q.get('points', default_points) or default_points
+        sub_questions = q.get('sub_questions', [])
         
-        for q in questions:
-            q_num = q.get('question_number')
-            correct_ans = q.get('correct_answer')
-            pts = q.get('points', points)
-            student_ans = student_answers.get(q_num)
-            
-            total += pts
-            is_correct = self.answers_match(student_ans, correct_ans)
-            
-            if is_correct:
-                earned += pts
-                correct += 1
-            
-            results.append({
-                'question_number': q_num,
-                'student_answer': student_ans,
-                'correct_answer': correct_ans,
-                'is_correct': is_correct,
-                'points_earned': pts if is_correct else 0,
-                'points_possible': pts
-            })
+        if q_type == 'parent' and sub_questions:
+            subs = []
+            for sq in sub_questions:
+                sq_id = sq.get('sub_id', '')
+                sq_type = sq.get('question_type', '')
+                sq_points = sq.get('points', default_points / len(sub_questions))
+                sq_correct = sq.get('correct_answer')
+                if sq_type in self.GRADABLE_TYPES:
+                    key = GradingService._make_key(q_num, sq_id)
+                    subs.append((sq_id, key, sq_type, sq_points, sq_correct, _accepted(sq_correct)))
+            return ('parent', q_num, subs) if subs else None
         
-        return {
-            'question_type': q_type,
-            'total_questions': len(questions),
-            'correct_count': correct,
-            'incorrect_count': len(questions) - correct,
-            'points_earned': earned,
-            'points_possible': total,
-            'percentage': (earned / total * 100) if total > 0 else 0,
-            'details': results
-        }
-    
-    # ============ Ordered Format ============
+        if q_type in ('multiple_choice', 'true_false'):
+            correct_answer = q.get('correct_answer')
+            return 'choice', q_num, q_num.lower(), q_type, points, correct_answer, _accepted(correct_answer)
+        
+        if q_type == 'matching':
+            correct_matches = q.get('correct_matches', {})
+            if correct_matches:
+                pairs = [(left_id, str(left_id), correct_right, _accepted(correct_right))
+                         for left_id, correct_right in correct_matches.items()]
+                return 'matching', q_num, points, points / len(correct_matches), pairs
+        
+        elif q_type == 'fill_in_blank':
+            blanks = q.get('blanks', [])
+            if blanks:
+                return 'fill', q_num, points, points / len(blanks), [(b, _accepted(b)) for b in blanks]
+        return None
     
-    def grade_ordered_questions(self, questions: List[Dict[str, Any]], 
-                                 student_answers: Dict[str, Any],
-                                 default_points: float = 1.0) -> Dict[str, Any]:
-        # Grade ordered format - all gradable types
+    def _grade_ordered(self, student_answers: Dict[str, Any]) -> Dict[str, Any]:
         results = []
         total_points = 0.0
         earned_points = 0.0
         correct_count = 0
         total_gradable = 0
         
-        gradable_types = ['multiple_choice', 'true_false', 'matching', 'fill_in_blank']
-        
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            q_type = q.get('question_type', '')
-            points = q.get('points', default_points) or default_points
-            sub_questions = q.get('sub_questions', [])
+        for item in self._items:
+            if item is None:
+                continue
+            kind, q_num = item[0], item[1]
             
             # Parent with sub-questions
-            if q_type == 'parent' and sub_questions:
+            if kind == 'parent':
                 sub_results = []
                 parent_earned = 0.0
                 parent_possible = 0.0
                 
-                for sq in sub_questions:
-                    sq_id = sq.get('sub_id', '')
-                    sq_type = sq.get('question_type', '')
-                    sq_points = sq.get('points', default_points / len(sub_questions))
-                    sq_correct = sq.get('correct_answer')
-                    
-                    if sq_type not in gradable_types:
-                        continue
-                    
+                for sq_id, key, sq_type, sq_points, sq_correct, accepted in item[2]:
                     total_gradable += 1
                     parent_possible += sq_points
                     
-                    key = self._make_key(q_num, sq_id)
-                    student_answer = None
-                    
-                    if q_num in student_answers and isinstance(student_answers.get(q_num), dict):
-                        student_answer = student_answers[q_num].get(sq_id)
-                    elif key in student_answers:
-                        student_answer = student_answers[key]
-                    elif sq_id in student_answers:
-                        student_answer = student_answers[sq_id]
-                    
-                    is_correct = self.answers_match(student_answer, sq_correct)
+                    student_answer = self._sub_answer(student_answers, q_num, sq_id, key)
+                    is_correct = _matches(student_answer, accepted)
                     
                     if is_correct:
                         parent_earned += sq_points
@@ -508,23 +762,22 @@ class GradingService:
                         'points_possible': sq_points
                     })
                 
-                if sub_results:
-                    total_points += parent_possible
-                    earned_points += parent_earned
-                    results.append({
-                        'question_number': q_num,
-                        'question_type': 'parent',
-                        'sub_questions': sub_results,
-                        'points_earned': parent_earned,
-                        'points_possible': parent_possible
-                    })
+                total_points += parent_possible
+                earned_points += parent_earned
+                results.append({
+                    'question_number': q_num,
+                    'question_type': 'parent',
+                    'sub_questions': sub_results,
+                    'points_earned': parent_earned,
+                    'points_possible': parent_possible
+                })
             
             # MCQ or T/F
-            elif q_type in ['multiple_choice', 'true_false']:
+            elif kind == 'choice':
+                _, _, q_key, q_type, points, correct_answer, accepted = item
                 total_gradable += 1
-                correct_answer = q.get('correct_answer')
-                student_answer = student_answers.get(q_num) or student_answers.get(q_num.lower())
-                is_correct = self.answers_match(student_answer, correct_answer)
+                student_answer = student_answers.get(q_num) or student_answers.get(q_key)
+                is_correct = _matches(student_answer, accepted)
                 
                 total_points += points
                 if is_correct:
@@ -542,84 +795,71 @@ class GradingService:
                 })
             
             # Matching
-            elif q_type == 'matching':
-                correct_matches = q.get('correct_matches', {})
-                if correct_matches:
-                    student_matches = student_answers.get(q_num, {})
-                    if not isinstance(student_matches, dict):
-                        student_matches = {}
-                    
-                    points_each = points / len(correct_matches)
-                    pair_results = []
+            elif kind == 'matching':
+                _, _, points, points_each, pairs = item
+                student_matches = self._student_matches(student_answers, q_num, flat=False)
+                
+                pair_results = []
+                for left_id, left_key, correct_right, accepted in pairs:
+                    total_gradable += 1
+                    student_right = student_matches.get(left_id) or student_matches.get(left_key)
+                    is_correct = _matches(student_right, accepted)
                     
-                    for left_id, correct_right in correct_matches.items():
-                        total_gradable += 1
-                        student_right = student_matches.get(left_id) or student_matches.get(str(left_id))
-                        is_correct = self.answers_match(student_right, correct_right)
-                        
-                        total_points += points_each
-                        if is_correct:
-                            earned_points += points_each
-                            correct_count += 1
-                        
-                        pair_results.append({
-                            'left_id': left_id,
-                            'student_match': student_right,
-                            'correct_match': correct_right,
-                            'is_correct': is_correct
-                        })
+                    total_points += points_each
+                    if is_correct:
+                        earned_points += points_each
+                        correct_count += 1
                     
-                    results.append({
-                        'question_number': q_num,
-                        'question_type': 'matching',
-                        'pair_details': pair_results,
-                        'points_earned': sum(p['is_correct'] for p in pair_results) * points_each,
-                        'points_possible': points
+                    pair_results.append({
+                        'left_id': left_id,
+                        'student_match': student_right,
+                        'correct_match': correct_right,
+                        'is_correct': is_correct
                     })
+                
+                results.append({
+                    'question_number': q_num,
+                    'question_type': 'matching',
+                    'pair_details': pair_results,
+                    'points_earned': sum(p['is_correct'] for p in pair_results) * points_each,
+                    'points_possible': points
+                })
             
             # Fill in blank
-            elif q_type == 'fill_in_blank':
-                blanks = q.get('blanks', [])
-                if blanks:
-                    student_ans = student_answers.get(q_num)
-                    if isinstance(student_ans, list):
-                        student_list = student_ans
-                    elif student_ans:
-                        student_list = [student_ans]
-                    else:
-                        student_list = []
-                    
-                    points_each = points / len(blanks)
-                    blank_results = []
+            else:
+                _, _, points, points_each, blanks = item
+                student_ans = student_answers.get(q_num)
+                student_list = self._student_blanks(student_ans) if student_ans else []
+                
+                blank_results = []
+                for i, (correct_blank, accepted) in enumerate(blanks):
+                    total_gradable += 1
+                    student_blank = student_list[i] if i < len(student_list) else None
+                    is_correct = _matches(student_blank, accepted)
                     
-                    for i, correct_blank in enumerate(blanks):
-                        total_gradable += 1
-                        student_blank = student_list[i] if i < len(student_list) else None
-                        is_correct = self.answers_match(student_blank, correct_blank)
-                        
-                        total_points += points_each
-                        if is_correct:
-                            earned_points += points_each
-                            correct_count += 1
-                        
-                        blank_results.append({
-                            'blank_number': i + 1,
-                            'student_answer': student_blank,
-                            'correct_answer': correct_blank,
-                            'is_correct': is_correct
-                        })
+                    total_points += points_each
+                    if is_correct:
+                        earned_points += points_each
+                        correct_count += 1
                     
-                    results.append({
-                        'question_number': q_num,
-                        'question_type': 'fill_in_blank',
-                        'blank_details': blank_results,
-                        'points_earned': sum(b['is_correct'] for b in blank_results) * points_each,
-                        'points_possible': points
+                    blank_results.append({
+                        'blank_number': i + 1,
+                        'student_answer': student_blank,
+                        'correct_answer': correct_blank,
+                        'is_correct': is_correct
                     })
+                
+                results.append({
+                    'question_number': q_num,
+                    'question_type': 'fill_in_blank',
+                    'blank_details': blank_results,
+                    'points_earned': sum(b['is_correct'] for b in blank_results) * points_each,
+                    'points_possible': points
+                })
         
         return {
             'format': 'ordered',
-            'total_questions': len(questions),
+            'total_questions': self.question_count,
             'total_gradable': total_gradable,
             'correct_count': correct_count,
             'incorrect_count': total_gradable - correct_count,
@@ -0,0 +1,117 @@
+# Sync and async drivers shared by the multi-pass AI graders
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Generator, List
+
+from app.config import Config
+from app.services.candidate_sampling import (
+    call_json, call_json_async, sample_passes, sample_passes_async
+)
+from app.services.consensus import VoteCollector, run_until_consensus, run_until_consensus_async
+from app.services.gemini_client import get_client
+from app.services.pass_executor import async_call_slot, call_slot, map_questions, map_questions_async
+
+
+class Consensus:
+    """Step: run grading passes on `contents` until the vote is settled."""
+    
+    def __init__(self, contents: List[Any], collect_votes: VoteCollector,
+                 passes: int = Config.OPEN_ENDED_GRADING_PASSES):
+        self.contents = contents
+        self.collect_votes = collect_votes
+        self.passes = passes
+
+
+class SingleCall:
+    """Step: one Gemini request on `contents`, parsed with the service hooks."""
+    
+    def __init__(self, contents: List[Any]):
+        self.contents = contents
+
+
+GradingSteps = Generator[Any, Any, Dict[str, Any]]
+
+
+def run_steps(service: Any, steps: GradingSteps) -> Dict[str, Any]:
+    # Drive a grading generator with blocking calls on the thread pools
+    try:
+        step = next(steps)
+        while True:
+            if isinstance(step, Consensus):
+                outcome = run_until_consensus(
+                    lambda start, n: sample_passes(service, step.contents, n, start),
+                    step.collect_votes, step.passes
+                )
+            else:
+                with call_slot():
+                    outcome = call_json(service, step.contents)
+            step = steps.send(outcome)
+    except StopIteration as done:
+        return done.value
+
+
+async def run_steps_async(service: Any, steps: GradingSteps) -> Dict[str, Any]:
+    # Drive a grading generator on the running event loop (client.aio)
+    try:
+        step = next(steps)
+        while True:
+            if isinstance(step, Consensus):
+                outcome = await run_until_consensus_async(
+                    lambda start, n: sample_passes_async(service, step.contents, n, start),
+                    step.collect_votes, step.passes
+                )
+            else:
+                async with async_call_slot():
+                    outcome = await call_json_async(service, step.contents)
+            step = steps.send(outcome)
+    except StopIteration as done:
+        return done.value
+
+
+class MultiPassGrader(ABC):
+    """Base class for the AI graders.
+    
+    Subclasses write grading once, as `_grade_steps(question, answer)`: a
+    generator that yields Consensus/SingleCall steps, receives their results
+    and returns the question result. The same generator then runs on the
+    blocking client (grade_question) or the async client (grade_question_async).
+    Subclasses also provide `_answer_for(question, student_answers)` and
+    `_summarize(questions, results)` for the batch methods.
+    """
+    
+    CACHE_NAMESPACE = ''
+    
+    def __init__(self):
+        self.client = get_client()
+    
+    @abstractmethod
+    def _grade_steps(self, question: Dict[str, Any], student_answer: Any) -> GradingSteps:
+        ...
+    
+    def _answer_for(self, question: Dict[str, Any], student_answers: Dict[str, Any]) -> Any:
+        return student_answers.get(str(question.get('question_number', '')), '')
+    
+    @abstractmethod
+    def _summarize(self, questions: List[Dict[str, Any]],
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ...
+    
+    def grade_question(self, question: Dict[str, Any], student_answer: Any) -> Dict[str, Any]:
+        return run_steps(self, self._grade_steps(question, student_answer))
+    
+    async def grade_question_async(self, question: Dict[str, Any], student_answer: Any) -> Dict[str, Any]:
+        return await run_steps_async(self, self._grade_steps(question, student_answer))
+    
+    def grade_questions(self, questions: List[Dict[str, Any]],
+                        student_answers: Dict[str, Any]) -> Dict[str, Any]:
+        # Questions are graded in parallel; results keep the input order
+        results = map_questions(
+            lambda q: self.grade_question(q, self._answer_for(q, student_answers)), questions
+        )
+        return self._summarize(questions, results)
+    
+    async def grade_questions_async(self, questions: List[Dict[str, Any]],
+                                    student_answers: Dict[str, Any]) -> Dict[str, Any]:
+        results = await map_questions_async(
+            lambda q: self.grade_question_async(q, self._answer_for(q, student_answers)), questions
+        )
+        return self._summarize(questions, results)
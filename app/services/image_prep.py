@@ -0,0 +1,174 @@
+# Image preparation for OCR: tile-aligned resolution, grayscale, compact encoding
+import io
+import math
+from typing import Any, Dict, List, Tuple
+
+import fitz
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+from app.config import Config
+from app.services.page_preflight import upright
+
+
+GEMINI_TILE = 768          # Gemini bills images in 768x768 tiles...
+GEMINI_TILE_TOKENS = 258   # ...of 258 tokens each (one tile if both sides <= 384)
+ANALYSIS_SIDE = 512        # Long side of the thumbnail a page is analyzed on
+CLEAN_RENDER_SHARE = 0.9   # Pure white/black pixel share of a born-digital page (scans: ~0.2)
+
+
+def image_tokens(width: float, height: float) -> int:
+    """Gemini's input token count for one image of this size."""
+    if width <= GEMINI_TILE // 2 and height <= GEMINI_TILE // 2:
+        return GEMINI_TILE_TOKENS
+    return math.ceil(width / GEMINI_TILE) * math.ceil(height / GEMINI_TILE) * GEMINI_TILE_TOKENS
+
+
+def analyze_page(thumbnail: Image.Image) -> Dict[str, float]:
+    """Text density and coloured-ink share of a page, from an RGB thumbnail.
+    
+    `edges` is the share of edge pixels, which grows with the amount and
+    fineness of the writing; `color` is the share of saturated, visible
+    pixels (e.g. red pen), which decides whether grayscale is safe.
+    """
+    total = max(1, thumbnail.width * thumbnail.height)
+    edges = thumbnail.convert('L').filter(ImageFilter.FIND_EDGES).histogram()
+    
+    saturation, _, value = thumbnail.convert('HSV').split()
+    colored = ImageChops.multiply(saturation.point(lambda s: 255 if s > 80 else 0),
+                                  value.point(lambda v: 255 if v > 60 else 0))
+    return {
+        'edges': sum(edges[48:]) / total,
+        'color': colored.histogram()[255] / total
+    }
+
+
+def target_size(width: float, height: float, analysis: Dict[str, float],
+                upscale: bool = False) -> Tuple[int, int]:
+    """Size for a page: whole tiles along the long side, more for dense pages.
+    
+    A short side that only just spills into another row of tiles is trimmed
+    back, since that last row would cost a full 258 tokens for a few pixels.
+    """
+    dense = analysis['edges'] >= Config.OCR_IMAGE_DENSE_EDGES
+    tiles = Config.OCR_IMAGE_DENSE_TILES if dense else Config.OCR_IMAGE_TILES
+    scale = tiles * GEMINI_TILE / max(width, height)
+    if not upscale:
+        scale = min(1.0, scale)
+    
+    short = min(width, height) * scale
+    full_tiles = math.floor(short / GEMINI_TILE)
+    if full_tiles and short / GEMINI_TILE - full_tiles < 0.15:
+        scale *= full_tiles * GEMINI_TILE / short
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def keep_color(analysis: Dict[str, float]) -> bool:
+    return not Config.OCR_IMAGE_GRAYSCALE or analysis['color'] >= Config.OCR_IMAGE_COLOR_SHARE
+
+
+def _is_clean_render(image: Image.Image) -> bool:
+    # Born-digital pages are almost only pure paper and pure ink; they compress
+    # better losslessly, where JPEG would add ringing around every glyph
+    histogram = (image if image.mode == 'L' else image.convert('L')).histogram()
+    extremes = sum(histogram[:16]) + sum(histogram[240:])
+    return extremes >= CLEAN_RENDER_SHARE * image.width * image.height
+
+
+def encode_image(image: Image.Image) -> Dict[str, Any]:
+    # Inline request part: PNG for clean renders, else OCR_IMAGE_FORMAT (JPEG or WEBP)
+    buffer = io.BytesIO()
+    if _is_clean_render(image):
+        image.save(buffer, format='PNG', compress_level=1)
+        mime_type = 'image/png'
+    elif Config.OCR_IMAGE_FORMAT.upper() == 'WEBP':
+        image.save(buffer, format='WEBP', quality=Config.OCR_IMAGE_QUALITY, method=4)
+        mime_type = 'image/webp'
+    else:
+        image.save(buffer, format='JPEG', quality=Config.OCR_IMAGE_QUALITY, optimize=True)
+        mime_type = 'image/jpeg'
+    return {'inline_data': {'mime_type': mime_type, 'data': buffer.getvalue()}}
+
+
+def _prepared(image: Image.Image, baseline: Tuple[float, float],
+              baseline_bytes: int = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    part = encode_image(image)
+    stats = {
+        'width': image.width,
+        'height': image.height,
+        'mode': image.mode,
+        'format': part['inline_data']['mime_type'],
+        'bytes': len(part['inline_data']['data']),
+        'tokens': image_tokens(*image.size),
+        'baseline_tokens': image_tokens(*baseline),
+        'baseline_bytes': baseline_bytes
+    }
+    return part, stats
+
+
+def open_image(image_data: bytes) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Uploaded page as an upright RGB image, and its size as uploaded."""
+    image = Image.open(io.BytesIO(image_data))
+    baseline = image.size
+    # Let the JPEG decoder skip resolution no target can use (photos are often 12 MP)
+    limit = Config.OCR_IMAGE_DENSE_TILES * GEMINI_TILE / max(image.size)
+    if limit < 1:
+        image.draft('RGB', (math.ceil(image.width * limit), math.ceil(image.height * limit)))
+    return ImageOps.exif_transpose(image).convert('RGB'), baseline
+
+
+def prepare_image(image: Image.Image, baseline: Tuple[int, int],
+                  input_bytes: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Request part and stats for an uploaded page image (photo or scan), from open_image."""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE), Image.BILINEAR)
+    analysis = analyze_page(thumbnail)
+    
+    size = target_size(image.width, image.height, analysis)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    if not keep_color(analysis):
+        image = image.convert('L')
+    return _prepared(image, baseline, input_bytes)
+
+
+def prepare_pdf_page(page: fitz.Page, rotation: int = 0) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Request part and stats for a PDF page, rendered straight at its target size.
+    
+    `rotation` (clockwise degrees, from the pre-flight check) turns the
+    rendered page upright; tile sizing does not depend on orientation.
+    """
+    rect = page.rect
+    thumb_zoom = ANALYSIS_SIDE / max(rect.width, rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(thumb_zoom, thumb_zoom), colorspace=fitz.csRGB, alpha=False)
+    analysis = analyze_page(Image.frombytes('RGB', (pix.width, pix.height), pix.samples_mv, 'raw', 'RGB', pix.stride))
+    
+    width, height = target_size(rect.width, rect.height, analysis, upscale=True)
+    color = keep_color(analysis)
+    # MuPDF renders grayscale directly, which is also cheaper than converting
+    pix = page.get_pixmap(matrix=fitz.Matrix(width / rect.width, height / rect.height),
+                          colorspace=fitz.csRGB if color else fitz.csGRAY, alpha=False)
+    mode = 'RGB' if color else 'L'
+    image = Image.frombytes(mode, (pix.width, pix.height), pix.samples_mv, 'raw', mode, pix.stride)
+    return _prepared(upright(image, rotation), (rect.width * Config.OCR_PDF_ZOOM, rect.height * Config.OCR_PDF_ZOOM))
+
+
+def prep_summary(page_stats: List[Dict[str, Any]], input_bytes: int) -> Dict[str, Any]:
+    """Per-request totals against the unprepared pages.
+    
+    Tokens are compared with the pages as they were sent before (uploaded
+    size, or PDFs at OCR_PDF_ZOOM). Bytes are compared with the upload for
+    images; PDFs were rendered, not uploaded, so bytes_saved is None there.
+    """
+    sent_bytes = sum(p['bytes'] for p in page_stats)
+    sent_tokens = sum(p['tokens'] for p in page_stats)
+    baseline_tokens = sum(p['baseline_tokens'] for p in page_stats)
+    baselines = [p['baseline_bytes'] for p in page_stats]
+    return {
+        'pages': len(page_stats),
+        'input_bytes': input_bytes,
+        'sent_bytes': sent_bytes,
+        'bytes_saved': sum(baselines) - sent_bytes if None not in baselines else None,
+        'baseline_tokens': baseline_tokens,
+        'sent_tokens': sent_tokens,
+        'tokens_saved': baseline_tokens - sent_tokens
+    }
@@ -0,0 +1,366 @@
+# Item analysis over graded papers: difficulty, discrimination, distractors and criterion statuses per question
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.services.grading import GradingService
+
+
+EASY_DIFFICULTY = 0.9        # Mean score share above which a question is flagged too easy
+HARD_DIFFICULTY = 0.2        # ... and below which too hard
+LOW_DISCRIMINATION = 0.2     # Point-biserial below which a question barely separates strong and weak students
+MIN_DISTRACTOR_SHARE = 0.05  # Wrong MCQ options chosen by fewer students do not work as distractors
+
+# Per-criterion result lists of the AI graders: (details field, field naming the criterion)
+CRITERION_LISTS = (('item_results', 'item'), ('step_results', 'step'), ('label_details', 'label_id'))
+
+
+def _observation(detail: Dict[str, Any], question_type: str) -> Optional[Dict[str, Any]]:
+    # What item analysis keeps of one question's grading detail (None when it was not scored)
+    earned, possible = detail.get('points_earned'), detail.get('points_possible')
+    if not isinstance(earned, (int, float)) or not isinstance(possible, (int, float)):
+        return None
+    observation = {'number': str(detail.get('question_number', '')),
+                   'type': detail.get('question_type') or question_type,
+                   'earned': float(earned), 'possible': float(possible)}
+    
+    if 'is_correct' in detail and 'correct_answer' in detail:
+        observation['answer'] = GradingService.normalize_answer(detail.get('student_answer'))
+        observation['correct'] = GradingService.normalize_answer(detail['correct_answer'])
+    
+    criteria = {name: result.get('status') for name, result in (detail.get('criteria_results') or {}).items()
+                if isinstance(result, dict)}
+    for field, name_field in CRITERION_LISTS:
+        for result in detail.get(field) or []:
+            if isinstance(result, dict) and result.get(name_field) is not None:
+                criteria[str(result[name_field])] = result.get('status')
+    criteria = {name: str(status) for name, status in criteria.items() if status}
+    if criteria:
+        observation['criteria'] = criteria
+    return observation
+
+
+def paper_observations(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per question key, the scored observation of one student's grading results.
+    
+    `results` are the `data` of any grading endpoint (GradingService or the
+    AI graders); parent questions of the ordered format count per
+    sub-question ("3.a").
+    """
+    observations = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        result = result.get('data', result)
+        question_type = result.get('question_type', '')
+        for detail in result.get('details') or []:
+            if not isinstance(detail, dict):
+                continue
+            q_num = str(detail.get('question_number', ''))
+            if detail.get('sub_questions'):
+                for sub in detail['sub_questions']:
+                    observation = _observation(dict(sub, question_number=q_num), sub.get('question_type', ''))
+                    if observation is not None:
+                        observations[GradingService._make_key(q_num, str(sub.get('sub_id', '')))] = observation
+                continue
+            observation = _observation(detail, question_type)
+            if observation is not None:
+                observations[q_num.strip().lower()] = observation
+    return observations
+
+
+def _grown(array: np.ndarray, rows: int, cols: int, fill: Any) -> np.ndarray:
+    # `array` with room for at least rows x cols (doubling), new cells set to `fill`
+    if rows <= array.shape[0] and cols <= array.shape[1]:
+        return array
+    shape = (max(rows, 2 * array.shape[0]) if rows > array.shape[0] else array.shape[0],
+             max(cols, 2 * array.shape[1]) if cols > array.shape[1] else array.shape[1])
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[:array.shape[0], :array.shape[1]] = array
+    return grown
+
+
+def _masked_correlation(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Per-column Pearson correlation over the rows where mask is set (NaN without variance)
+    count = mask.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(mask, x, 0).sum(axis=0) / count
+        mean_y = np.where(mask, y, 0).sum(axis=0) / count
+        dx = np.where(mask, x - mean_x, 0)
+        dy = np.where(mask, y - mean_y, 0)
+        correlation = (dx * dy).sum(axis=0) / np.sqrt((dx * dx).sum(axis=0) * (dy * dy).sum(axis=0))
+    correlation[count < 3] = np.nan
+    return correlation
+
+
+def _number(value: float, digits: int = 4) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+class Cohort:
+    """One cohort's graded papers as growing students x questions arrays.
+    
+    A paper update rewrites the student's row in place, so analysis() is a
+    handful of vectorized passes over the current arrays, however the
+    papers arrived.
+    """
+    
+    def __init__(self):
+        self.students: Dict[str, int] = {}
+        self.questions: Dict[str, int] = {}
+        self.question_info: List[Dict[str, Any]] = []
+        self.criteria: Dict[Tuple[str, str], int] = {}
+        self.answers: List[str] = ['']  # Answer code -> normalized answer ('' = omitted)
+        self.statuses: List[str] = ['']  # Status code -> criterion status ('' = not graded)
+        self._answer_codes = {'': 0}
+        self._status_codes = {'': 0}
+        self.earned = np.full((0, 0), np.nan)
+        self.possible = np.full((0, 0), np.nan)
+        self.choices = np.full((0, 0), -1, dtype=np.int32)  # -1: not an MCQ/TF answer
+        self.correct_choice = np.zeros(0, dtype=np.int32)   # Code of the keyed answer per question
+        self.criterion_status = np.zeros((0, 0), dtype=np.int16)
+    
+    def _code(self, codes: Dict[str, int], names: List[str], value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+    
+    def set_paper(self, student_id: str, observations: Dict[str, Dict[str, Any]]) -> None:
+        """Set (or replace) a student's row from paper_observations()."""
+        row = self.students.setdefault(student_id, len(self.students))
+        for key, observation in observations.items():
+            if key not in self.questions:
+                self.questions[key] = len(self.questions)
+                self.question_info.append({'question': key, 'question_number': observation['number'],
+                                           'question_type': observation['type']})
+            for name in observation.get('criteria', {}):
+                self.criteria.setdefault((key, name), len(self.criteria))
+        
+        rows, cols = len(self.students), len(self.questions)
+        self.earned = _grown(self.earned, rows, cols, np.nan)
+        self.possible = _grown(self.possible, rows, cols, np.nan)
+        self.choices = _grown(self.choices, rows, cols, -1)
+        if len(self.correct_choice) < self.earned.shape[1]:
+            self.correct_choice = np.concatenate(
+                [self.correct_choice, np.zeros(self.earned.shape[1] - len(self.correct_choice), dtype=np.int32)])
+        self.criterion_status = _grown(self.criterion_status, rows, len(self.criteria), 0)
+        
+        self.earned[row] = np.nan
+        self.possible[row] = np.nan
+        self.choices[row] = -1
+        self.criterion_status[row] = 0
+        for key, observation in observations.items():
+            col = self.questions[key]
+            self.earned[row, col] = observation['earned']
+            self.possible[row, col] = observation['possible']
+            if 'answer' in observation:
+                self.choices[row, col] = self._code(self._answer_codes, self.answers, observation['answer'])
+                self.correct_choice[col] = self._code(self._answer_codes, self.answers, observation['correct'])
+            for name, status in observation.get('criteria', {}).items():
+                self.criterion_status[row, self.criteria[(key, name)]] = self._code(self._status_codes, self.statuses, status)
+    
+    def analysis(self) -> Dict[str, Any]:
+        """Difficulty, discrimination, distractors and criterion statuses per question."""
+        n, q = len(self.students), len(self.questions)
+        earned, possible = self.earned[:n, :q], self.possible[:n, :q]
+        scored = ~np.isnan(earned) & (np.nan_to_num(possible) > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(scored, earned / np.where(scored, possible, 1), np.nan)
+            attempts = scored.sum(axis=0)
+            difficulty = np.where(attempts > 0, np.nansum(share, axis=0) / attempts, np.nan)
+            
+            # Point-biserial discrimination: item score against the rest of the paper (item excluded)
+            earned_0 = np.where(scored, earned, 0.0)
+            possible_0 = np.where(scored, possible, 0.0)
+            total_earned, total_possible = earned_0.sum(axis=1), possible_0.sum(axis=1)
+            rest_possible = total_possible[:, None] - possible_0
+            rest = (total_earned[:, None] - earned_0) / rest_possible
+            discrimination = _masked_correlation(share, rest, scored & (rest_possible > 0))
+            percentage = np.where(total_possible > 0, total_earned / total_possible * 100, np.nan)
+        
+        distractors = self._distractors(n, q, percentage)
+        criteria = self._criterion_distributions(n)
+        
+        questions = []
+        for col, info in enumerate(self.question_info):
+            flags = []
+            if attempts[col] and difficulty[col] >= EASY_DIFFICULTY:
+                flags.append('too_easy')
+            elif attempts[col] and difficulty[col] <= HARD_DIFFICULTY:
+                flags.append('too_hard')
+            if not np.isnan(discrimination[col]):
+                if discrimination[col] < 0:
+                    flags.append('negative_discrimination')
+                elif discrimination[col] < LOW_DISCRIMINATION:
+                    flags.append('low_discrimination')
+            if any(d['non_functioning'] for d in distractors.get(col, [])):
+                flags.append('non_functioning_distractors')
+            
+            question = dict(info, attempts=int(attempts[col]),
+                            points_possible=_number(np.nanmax(possible[:, col])) if attempts[col] else None,
+                            difficulty=_number(difficulty[col]),
+                            discrimination=_number(discrimination[col]), flags=flags)
+            if col in distractors:
+                question['options'] = distractors[col]
+            if col in criteria:
+                question['criteria'] = criteria[col]
+            questions.append(question)
+        
+        graded = ~np.isnan(percentage)
+        return {
+            'student_count': n,
+            'question_count': q,
+            'average_percentage': _number(percentage[graded].mean(), 2) if graded.any() else None,
+            'questions': questions
+        }
+    
+    def _distractors(self, n: int, q: int, percentage: np.ndarray) -> Dict[int, List[Dict[str, Any]]]:
+        # Per MCQ/TF question: how many students chose each answer and their mean paper percentage
+        choices = self.choices[:n, :q]
+        chosen = choices >= 0
+        if not chosen.any():
+            return {}
+        vocabulary = len(self.answers)
+        cols = np.broadcast_to(np.arange(q), choices.shape)[chosen]
+        index = cols * vocabulary + choices[chosen]
+        counts = np.bincount(index, minlength=q * vocabulary).reshape(q, vocabulary)
+        weights = np.nan_to_num(np.broadcast_to(percentage[:, None], choices.shape)[chosen])
+        percentage_sums = np.bincount(index, weights=weights, minlength=q * vocabulary).reshape(q, vocabulary)
+        
+        distractors = {}
+        answered = counts.sum(axis=1)
+        for col in np.flatnonzero(answered):
+            options = []
+            for code in np.flatnonzero(counts[col]):
+                count = int(counts[col, code])
+                is_key = bool(code and code == self.correct_choice[col])
+                options.append({
+                    'answer': self.answers[code] or None,
+                    'count': count,
+                    'share': round(count / int(answered[col]), 4),
+                    'is_correct': is_key,
+                    'mean_percentage': round(float(percentage_sums[col, code] / count), 2),
+                    'non_functioning': bool(code and not is_key and count / int(answered[col]) < MIN_DISTRACTOR_SHARE)
+                })
+            distractors[int(col)] = sorted(options, key=lambda option: -option['count'])
+        return distractors
+    
+    def _criterion_distributions(self, n: int) -> Dict[int, List[Dict[str, Any]]]:
+        # Per AI-graded question: the count of each status per criterion
+        k = len(self.criteria)
+        if not k:
+            return {}
+        statuses = self.criterion_status[:n, :k].astype(np.int64)
+        index = np.arange(k) * len(self.statuses) + statuses
+        counts = np.bincount(index.ravel(), minlength=k * len(self.statuses)).reshape(k, len(self.statuses))
+        
+        distributions: Dict[int, List[Dict[str, Any]]] = {}
+        for (key, name), col in self.criteria.items():
+            graded = {self.statuses[code]: int(counts[col, code]) for code in np.flatnonzero(counts[col]) if code}
+            if graded:
+                distributions.setdefault(self.questions[key], []).append({'criterion': name, 'statuses': graded})
+        return distributions
+
+
+class ItemAnalysisStore:
+    """Graded papers per cohort, kept in SQLite, with each cohort's arrays cached in memory.
+    
+    Papers added through this worker update its cached arrays in place;
+    papers added by another worker (SQLite data_version) drop the cache,
+    and a cohort is reloaded on its next use.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cohorts: Dict[str, Cohort] = {}
+        self._version = None
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS papers ('
+            ' cohort TEXT NOT NULL, student_id TEXT NOT NULL, observations TEXT NOT NULL,'
+            ' updated_at REAL NOT NULL, PRIMARY KEY (cohort, student_id))'
+        )
+        self._db.commit()
+    
+    def _cohort(self, cohort_id: str) -> Cohort:
+        # The cohort's cached arrays, reloaded when another worker changed the database (caller holds the lock)
+        version = self._db.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._version:
+            self._cohorts.clear()
+            self._version = version
+        cohort = self._cohorts.get(cohort_id)
+        if cohort is None:
+            cohort = self._cohorts[cohort_id] = Cohort()
+            rows = self._db.execute('SELECT student_id, observations FROM papers WHERE cohort = ? ORDER BY rowid',
+                                    (cohort_id,))
+            for student_id, observations in rows:
+                cohort.set_paper(student_id, json.loads(observations))
+        return cohort
+    
+    def add_papers(self, cohort_id: str, papers: Iterator[Tuple[str, List[Dict[str, Any]]]]) -> int:
+        """Add (student_id, grading results) papers; a student's later results add to or replace earlier ones.
+        
+        Returns the number of papers stored.
+        """
+        added = 0
+        now = time.time()
+        with self._lock:
+            cohort = self._cohort(cohort_id)
+            for student_id, results in papers:
+                observations = paper_observations(results)
+                row = self._db.execute('SELECT observations FROM papers WHERE cohort = ? AND student_id = ?',
+                                       (cohort_id, student_id)).fetchone()
+                if row is not None:
+                    observations = dict(json.loads(row[0]), **observations)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO papers (cohort, student_id, observations, updated_at) VALUES (?, ?, ?, ?)',
+                    (cohort_id, student_id, json.dumps(observations, ensure_ascii=False), now)
+                )
+                cohort.set_paper(student_id, observations)
+                added += 1
+            self._db.commit()
+        return added
+    
+    def analysis(self, cohort_id: str) -> Optional[Dict[str, Any]]:
+        """The cohort's item analysis, or None for an unknown cohort."""
+        with self._lock:
+            cohort = self._cohort(cohort_id)
+            if not cohort.students:
+                self._cohorts.pop(cohort_id, None)
+                return None
+            return dict(cohort_id=cohort_id, **cohort.analysis())
+    
+    def delete(self, cohort_id: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM papers WHERE cohort = ?', (cohort_id,)).rowcount
+            self._db.commit()
+            self._cohorts.pop(cohort_id, None)
+        return deleted > 0
+
+
+_lock = threading.Lock()
+_store: Optional[ItemAnalysisStore] = None
+
+
+def get_item_analysis_store() -> ItemAnalysisStore:
+    """Return the shared item-analysis store."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = ItemAnalysisStore(Config.ITEM_ANALYSIS_PATH)
+    return _store
@@ -1,22 +1,17 @@
 # Labeling grading service using AI multi-pass for consistency
 import json
 from typing import Dict, Any, List
-from collections import Counter
-from google import genai
 
-from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader
 
 
-class LabelingGradingService:
+class LabelingGradingService(MultiPassGrader):
     # Grade labeling questions (text input) using AI multi-pass grading
     # Returns: present, partial, absent status for each label
     
     GRADING_PASSES = 3  # Number of AI passes for consistency
-    
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+    CACHE_NAMESPACE = 'labeling'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     def _build_grading_prompt(self, labeling_items: List[Dict[str, Any]], 
                                student_answers: Dict[str, str]) -> str:
@@ -61,38 +56,29 @@ Return ONLY valid JSON:
 Include an entry for EVERY label."""
         return prompt
     
-    def _call_gemini(self, prompt: str) -> Dict[str, Any]:
-        """Call Gemini and parse JSON response"""
-        try:
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[prompt],
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            return {"error": str(e), "labels": []}
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        return json.loads(text)
     
-    def _calculate_mode_or_median(self, statuses: List[str]) -> tuple:
-        """Calculate mode, or median if all different. Returns (status, flag_for_review)"""
-        STATUS_ORDER = {'absent': 0, 'partial': 1, 'present': 2}
-        
-        counts = Counter(statuses)
-        most_common = counts.most_common()
-        
-        # If there's a clear mode (count > 1), use it
-        if most_common[0][1] > 1:
-            return most_common[0][0], False
-        
-        # All 3 different - use median and flag for review
-        sorted_statuses = sorted(statuses, key=lambda s: STATUS_ORDER.get(s, 1))
-        median_status = sorted_statuses[len(sorted_statuses) // 2]
-        return median_status, True
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        return {"error": str(e), "labels": []}
     
-    def grade_question(self, question: Dict[str, Any], 
-                       student_answers: Dict[str, str]) -> Dict[str, Any]:
+    def _collect_votes(self, pass_results: List[Dict[str, Any]], 
+                       labeling_items: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Status of each label in every pass that returned it"""
+        votes = {}
+        for item in labeling_items:
+            label_id = str(item.get('label_id', ''))
+            statuses = []
+            for result in pass_results:
+                for pl in result.get('labels', []):
+                    if str(pl.get('label_id', '')) == label_id:
+                        statuses.append(pl.get('status', 'absent'))
+                        break
+            votes[label_id] = statuses
+        return votes
+    
+    def _grade_steps(self, question: Dict[str, Any], 
+                     student_answers: Dict[str, str]) -> GradingSteps:
         """Grade a single labeling question with multi-pass AI grading"""
         
         labeling_items = question.get('labeling_items', [])
@@ -106,14 +92,12 @@ Include an entry for EVERY label."""
                 'status': 'error'
             }
         
-        # Run grading multiple passes
-        all_passes = []
+        # Run grading passes concurrently
         prompt = self._build_grading_prompt(labeling_items, student_answers)
-        
-        for _ in range(self.GRADING_PASSES):
-            result = self._call_gemini(prompt)
-            if 'labels' in result:
-                all_passes.append(result['labels'])
+        pass_results = yield Consensus(
+            [prompt], lambda results: self._collect_votes(results, labeling_items), self.GRADING_PASSES
+        )
+        all_passes = [result['labels'] for result in pass_results if 'labels' in result]
         
         if not all_passes:
             return {
@@ -152,7 +136,7 @@ Include an entry for EVERY label."""
                 reasons = ['No grading result']
             
             # Get final status
-            final_status, flag_for_review = self._calculate_mode_or_median(statuses)
+            final_status, flag_for_review = resolve_vote(statuses)
             
             # Calculate points
             if final_status == 'present':
@@ -189,15 +173,20 @@ Include an entry for EVERY label."""
             'flagged_for_review': flagged_count,
             'points_earned': round(earned_points, 2),
             'points_possible': q_points,
-            'grading_passes': self.GRADING_PASSES,
+            'grading_passes': len(pass_results),
             'label_details': label_results
         }
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_answers: Dict[str, Any]) -> Dict[str, Any]:
-        """Grade multiple labeling questions"""
+    def _answer_for(self, question: Dict[str, Any], 
+                    student_answers: Dict[str, Any]) -> Dict[str, str]:
+        # Student answers can be nested {q_num: {label_id: text}} or flat {label_id: text}
+        q_answers = student_answers.get(str(question.get('question_number', '')), {})
+        return q_answers if isinstance(q_answers, dict) else {}
+    
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Summarize the graded labeling questions"""
         
-        results = []
         total_earned = 0.0
         total_possible = 0.0
         total_labels = 0
@@ -206,16 +195,7 @@ Include an entry for EVERY label."""
         absent_count = 0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            # Student answers can be nested {q_num: {label_id: text}} or flat {label_id: text}
-            q_answers = student_answers.get(q_num, {})
-            if not isinstance(q_answers, dict):
-                q_answers = {}
-            
-            result = self.grade_question(q, q_answers)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -237,5 +217,6 @@ Include an entry for EVERY label."""
             'points_possible': round(total_possible, 2),
             'percentage': round((total_earned / total_possible * 100) if total_possible > 0 else 0, 2),
             'grading_passes_per_question': self.GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'details': results
         }
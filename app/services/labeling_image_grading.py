@@ -3,21 +3,17 @@ import json
 import base64
 from typing import Dict, Any, List
 from collections import Counter
-from google import genai
 
-from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader
 
 
-class LabelingImageGradingService:
+class LabelingImageGradingService(MultiPassGrader):
     # Grade labeling questions where students write on the image
     # Uses AI Vision OCR + multi-pass grading for consistency
     
     GRADING_PASSES = 3  # Number of AI passes for consistency
-    
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+    CACHE_NAMESPACE = 'labeling_image'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     def _build_ocr_and_grade_prompt(self, labeling_items: List[Dict[str, Any]]) -> str:
         """Build prompt to OCR handwritten labels AND grade them in one call"""
@@ -57,58 +53,55 @@ Return ONLY valid JSON:
 Include an entry for EVERY label number specified above."""
         return prompt
     
-    def _call_gemini_vision(self, image_data: str, prompt: str) -> Dict[str, Any]:
-        """Call Gemini Vision with image and prompt"""
-        try:
-            # Handle base64 image data
-            if image_data.startswith('data:'):
-                parts = image_data.split(',', 1)
-                if len(parts) == 2:
-                    image_bytes = base64.b64decode(parts[1])
-                else:
-                    return {"error": "Invalid data URL", "labels": []}
+    def _build_vision_contents(self, image_data: str, prompt: str) -> List[Dict[str, Any]]:
+        """Build prompt + inline image contents from base64 / data URL image data"""
+        # Handle base64 image data
+        if image_data.startswith('data:'):
+            parts = image_data.split(',', 1)
+            if len(parts) == 2:
+                image_bytes = base64.b64decode(parts[1])
             else:
-                image_bytes = base64.b64decode(image_data)
-            
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[
+                raise ValueError("Invalid data URL")
+        else:
+            image_bytes = base64.b64decode(image_data)
+        
+        return [
+            {
+                "parts": [
+                    {"text": prompt},
                     {
-                        "parts": [
-                            {"text": prompt},
-                            {
-                                "inline_data": {
-                                    "mime_type": "image/jpeg",
-                                    "data": base64.b64encode(image_bytes).decode()
-                                }
-                            }
-                        ]
+                        "inline_data": {
+                            "mime_type": "image/jpeg",
+                            "data": base64.b64encode(image_bytes).decode()
+                        }
                     }
-                ],
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            return {"error": str(e), "labels": []}
+                ]
+            }
+        ]
     
-    def _calculate_mode_or_median(self, statuses: List[str]) -> tuple:
-        """Calculate mode, or median if all different. Returns (status, flag_for_review)"""
-        STATUS_ORDER = {'absent': 0, 'partial': 1, 'present': 2}
-        
-        counts = Counter(statuses)
-        most_common = counts.most_common()
-        
-        if most_common[0][1] > 1:
-            return most_common[0][0], False
-        
-        sorted_statuses = sorted(statuses, key=lambda s: STATUS_ORDER.get(s, 1))
-        median_status = sorted_statuses[len(sorted_statuses) // 2]
-        return median_status, True
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        return json.loads(text)
+    
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        return {"error": str(e), "labels": []}
+    
+    def _collect_votes(self, pass_results: List[Dict[str, Any]], 
+                       labeling_items: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Status of each label in every pass that returned it"""
+        votes = {}
+        for item in labeling_items:
+            label_id = str(item.get('label_id', ''))
+            statuses = []
+            for result in pass_results:
+                for pl in result.get('labels', []):
+                    if str(pl.get('label_id', '')) == label_id:
+                        statuses.append(pl.get('status', 'absent'))
+                        break
+            votes[label_id] = statuses
+        return votes
     
-    def grade_question(self, question: Dict[str, Any], 
-                       answer_image: str) -> Dict[str, Any]:
+    def _grade_steps(self, question: Dict[str, Any], 
+                     answer_image: str) -> GradingSteps:
         """Grade a single labeling question from image with multi-pass"""
         
         labeling_items = question.get('labeling_items', [])
@@ -150,14 +143,20 @@ Include an entry for EVERY label number specified above."""
                 'label_details': label_results
             }
         
-        # Run grading multiple passes (OCR + grade in one call)
-        all_passes = []
+        # Run grading passes concurrently (OCR + grade in one call)
         prompt = self._build_ocr_and_grade_prompt(labeling_items)
-        
-        for _ in range(self.GRADING_PASSES):
-            result = self._call_gemini_vision(answer_image, prompt)
-            if 'labels' in result:
-                all_passes.append(result['labels'])
+        try:
+            contents = self._build_vision_contents(answer_image, prompt)
+        except Exception as e:
+            return {
+                'question_number': q_num,
+                'error': f'Invalid answer image: {e}',
+                'status': 'ocr_error'
+            }
+        pass_results = yield Consensus(
+            contents, lambda results: self._collect_votes(results, labeling_items), self.GRADING_PASSES
+        )
+        all_passes = [result['labels'] for result in pass_results if 'labels' in result]
         
         if not all_passes:
             return {
@@ -199,7 +198,7 @@ Include an entry for EVERY label number specified above."""
                 reasons = ['No grading result']
             
             # Get final status
-            final_status, flag_for_review = self._calculate_mode_or_median(statuses)
+            final_status, flag_for_review = resolve_vote(statuses)
             
             # Use most common student text
             text_counts = Counter(student_texts)
@@ -241,15 +240,14 @@ Include an entry for EVERY label number specified above."""
             'flagged_for_review': flagged_count,
             'points_earned': round(earned_points, 2),
             'points_possible': q_points,
-            'grading_passes': self.GRADING_PASSES,
+            'grading_passes': len(pass_results),
             'label_details': label_results
         }
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_images: Dict[str, str]) -> Dict[str, Any]:
-        """Grade multiple labeling questions from images"""
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Summarize the graded labeling questions from images"""
         
-        results = []
         total_earned = 0.0
         total_possible = 0.0
         total_labels = 0
@@ -258,13 +256,7 @@ Include an entry for EVERY label number specified above."""
         absent_count = 0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            answer_image = student_images.get(q_num, '')
-            
-            result = self.grade_question(q, answer_image)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -286,5 +278,6 @@ Include an entry for EVERY label number specified above."""
             'points_possible': round(total_possible, 2),
             'percentage': round((total_earned / total_possible * 100) if total_possible > 0 else 0, 2),
             'grading_passes_per_question': self.GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'details': results
         }
@@ -0,0 +1,500 @@
+# Pluggable LLM backends: live Gemini, record, replay and synthetic
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from app.config import Config
+from app.services.gemini_scheduler import estimate_tokens
+from app.services.response_cache import make_key
+
+
+# Backends that talk to the real API (and need GEMINI_API_KEY)
+NETWORK_BACKENDS = ('gemini', 'record')
+
+
+class BackendError(Exception):
+    """An upstream-style API error with an HTTP status `code`."""
+    
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+# ============ Response Objects (genai response shape) ============
+
+class _Part:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Content:
+    def __init__(self, text: str):
+        self.parts = [_Part(text)]
+
+
+class _Candidate:
+    def __init__(self, text: str):
+        self.content = _Content(text)
+
+
+class _Usage:
+    def __init__(self, total_token_count: Optional[int]):
+        self.total_token_count = total_token_count
+
+
+class LLMResponse:
+    # Same attributes the services read from a genai GenerateContentResponse
+    
+    def __init__(self, texts: List[str], total_tokens: Optional[int] = None):
+        self.candidates = [_Candidate(t) for t in texts]
+        self.usage_metadata = _Usage(total_tokens)
+    
+    @property
+    def text(self) -> str:
+        return self.candidates[0].content.parts[0].text if self.candidates else ''
+
+
+def response_texts(response: Any) -> List[str]:
+    texts = []
+    for candidate in getattr(response, 'candidates', None) or []:
+        parts = getattr(getattr(candidate, 'content', None), 'parts', None) or []
+        texts.append(''.join(getattr(p, 'text', None) or '' for p in parts))
+    if not texts and getattr(response, 'text', None):
+        texts.append(response.text)
+    return texts
+
+
+def response_tokens(response: Any) -> Optional[int]:
+    return getattr(getattr(response, 'usage_metadata', None), 'total_token_count', None)
+
+
+# ============ Backend Interface ============
+
+class _Models:
+    def __init__(self, backend: 'LLMBackend'):
+        self._backend = backend
+    
+    def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        return self._backend.generate(model, contents, config or {})
+    
+    def generate_content_stream(self, *, model: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        return self._backend.generate_stream(model, contents, config or {})
+    
+    def __getattr__(self, name: str) -> Any:
+        # e.g. models.get for the warm-up ping, when the backend has a real client
+        return getattr(self._backend.passthrough_models(), name)
+
+
+class _AsyncModels(_Models):
+    async def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        return await self._backend.generate_async(model, contents, config or {})
+    
+    async def generate_content_stream(self, *, model: str, contents: Any, config: Any = None) -> AsyncIterator[Any]:
+        # Awaited for an async iterator, like the SDK's client.aio
+        return self._backend.generate_stream_async(model, contents, config or {})
+
+
+class _Aio:
+    def __init__(self, backend: 'LLMBackend'):
+        self.models = _AsyncModels(backend)
+
+
+class LLMBackend(ABC):
+    """Source of generate_content responses, with the genai.Client surface.
+    
+    Subclasses implement `generate(model, contents, config)` and, when they
+    can do better than a worker thread, `generate_async`, `generate_stream`
+    and `generate_stream_async`. Services keep calling
+    `client.models.generate_content(...)`, `client.models.generate_content_stream(...)`
+    and their `client.aio.models` versions, so any backend can stand in.
+    """
+    
+    name = 'base'
+    
+    def __init__(self):
+        self.models = _Models(self)
+        self.aio = _Aio(self)
+    
+    @abstractmethod
+    def generate(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        ...
+    
+    async def generate_async(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        return await asyncio.to_thread(self.generate, model, contents, config)
+    
+    def generate_stream(self, model: str, contents: Any, config: Dict[str, Any]) -> Iterator[Any]:
+        # Response chunks in order; without native streaming the whole response is one chunk
+        yield self.generate(model, contents, config)
+    
+    async def generate_stream_async(self, model: str, contents: Any, config: Dict[str, Any]) -> AsyncIterator[Any]:
+        # generate_stream for the event loop
+        yield await self.generate_async(model, contents, config)
+    
+    def passthrough_models(self) -> Any:
+        raise AttributeError(f"'{self.name}' backend has no client models API")
+
+
+class GeminiBackend(LLMBackend):
+    """The live Gemini API through a pooled genai.Client."""
+    
+    name = 'gemini'
+    
+    def __init__(self, client: Any):
+        super().__init__()
+        self.client = client
+    
+    def generate(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+    
+    async def generate_async(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+    
+    def generate_stream(self, model: str, contents: Any, config: Dict[str, Any]) -> Iterator[Any]:
+        return self.client.models.generate_content_stream(model=model, contents=contents, config=config)
+    
+    async def generate_stream_async(self, model: str, contents: Any, config: Dict[str, Any]) -> AsyncIterator[Any]:
+        async for chunk in await self.client.aio.models.generate_content_stream(model=model, contents=contents,
+                                                                                 config=config):
+            yield chunk
+    
+    def passthrough_models(self) -> Any:
+        return self.client.models
+
+
+# ============ Record / Replay ============
+
+def _request_key(model: str, contents: Any, config: Dict[str, Any]) -> str:
+    return make_key('llm', model, contents, config)
+
+
+def _prompt_preview(contents: Any) -> str:
+    items = contents if isinstance(contents, (list, tuple)) else [contents]
+    for item in items:
+        text = item if isinstance(item, str) else item.get('text') if isinstance(item, dict) else None
+        if text:
+            return text[:200]
+    return ''
+
+
+class RecordingBackend(LLMBackend):
+    """Passes requests to another backend and appends each exchange to a JSONL file.
+    
+    Every line holds the request key, a prompt preview, the candidate texts,
+    token usage, latency and any error, which is what ReplayBackend serves.
+    """
+    
+    name = 'record'
+    
+    def __init__(self, inner: LLMBackend, path: str):
+        super().__init__()
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def _write(self, model: str, contents: Any, config: Dict[str, Any], started: float,
+               response: Any = None, error: Exception = None) -> None:
+        code = getattr(error, 'code', None)
+        entry = {
+            'key': _request_key(model, contents, config),
+            'model': model,
+            'prompt': _prompt_preview(contents),
+            'texts': response_texts(response) if response is not None else [],
+            'total_tokens': response_tokens(response) if response is not None else None,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'error': str(error) if error is not None else None,
+            'code': code if isinstance(code, int) else None
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    
+    def generate(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        started = time.monotonic()
+        try:
+            response = self.inner.generate(model, contents, config)
+        except Exception as e:
+            self._write(model, contents, config, started, error=e)
+            raise
+        self._write(model, contents, config, started, response)
+        return response
+    
+    async def generate_async(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        started = time.monotonic()
+        try:
+            response = await self.inner.generate_async(model, contents, config)
+        except Exception as e:
+            self._write(model, contents, config, started, error=e)
+            raise
+        self._write(model, contents, config, started, response)
+        return response
+    
+    def generate_stream(self, model: str, contents: Any, config: Dict[str, Any]) -> Iterator[Any]:
+        # Recorded as one exchange once the stream is complete, so replay serves it whole
+        started = time.monotonic()
+        texts: List[str] = []
+        tokens = None
+        try:
+            for chunk in self.inner.generate_stream(model, contents, config):
+                texts.append(''.join(response_texts(chunk)[:1]))
+                tokens = response_tokens(chunk) or tokens
+                yield chunk
+        except Exception as e:
+            self._write(model, contents, config, started, error=e)
+            raise
+        self._write(model, contents, config, started, LLMResponse([''.join(texts)], tokens))
+    
+    async def generate_stream_async(self, model: str, contents: Any, config: Dict[str, Any]) -> AsyncIterator[Any]:
+        started = time.monotonic()
+        texts: List[str] = []
+        tokens = None
+        try:
+            async for chunk in self.inner.generate_stream_async(model, contents, config):
+                texts.append(''.join(response_texts(chunk)[:1]))
+                tokens = response_tokens(chunk) or tokens
+                yield chunk
+        except Exception as e:
+            self._write(model, contents, config, started, error=e)
+            raise
+        self._write(model, contents, config, started, LLMResponse([''.join(texts)], tokens))
+    
+    def passthrough_models(self) -> Any:
+        return self.inner.passthrough_models()
+
+
+class ReplayBackend(LLMBackend):
+    """Serves responses recorded by RecordingBackend, without network.
+    
+    Repeated identical requests (e.g. grading passes) get the recorded
+    responses in order, cycling when a run makes more calls than were
+    recorded. Unknown requests raise LookupError. With `replay_latency` the
+    recorded latency is reproduced, so timings are comparable to the live run.
+    """
+    
+    name = 'replay'
+    
+    def __init__(self, path: str, replay_latency: bool = False):
+        super().__init__()
+        self.replay_latency = replay_latency
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry['key'], []).append(entry)
+    
+    def _next(self, model: str, contents: Any, config: Dict[str, Any]) -> Dict[str, Any]:
+        key = _request_key(model, contents, config)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise LookupError(f"No recorded response for request {key[:12]} ({_prompt_preview(contents)[:60]!r})")
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+        return entries[index % len(entries)]
+    
+    def _respond(self, entry: Dict[str, Any]) -> LLMResponse:
+        if entry.get('error'):
+            if entry.get('code'):
+                raise BackendError(entry['code'], entry['error'].split(' ', 1)[-1])
+            raise RuntimeError(entry['error'])
+        return LLMResponse(entry['texts'], entry.get('total_tokens'))
+    
+    def generate(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        entry = self._next(model, contents, config)
+        if self.replay_latency:
+            time.sleep(entry.get('latency_ms', 0) / 1000)
+        return self._respond(entry)
+    
+    async def generate_async(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        entry = self._next(model, contents, config)
+        if self.replay_latency:
+            await asyncio.sleep(entry.get('latency_ms', 0) / 1000)
+        return self._respond(entry)
+
+
+# ============ Synthetic ============
+
+def _schema_stub(schema: Dict[str, Any], defs: Dict[str, Any]) -> Any:
+    # Smallest value that validates against a JSON schema (required fields only)
+    if '$ref' in schema:
+        return _schema_stub(defs.get(schema['$ref'].split('/')[-1], {}), defs)
+    for union in ('anyOf', 'oneOf', 'allOf'):
+        if union in schema:
+            options = schema[union]
+            chosen = next((o for o in options if o.get('type') == 'null'), options[0])
+            return _schema_stub(chosen, defs)
+    if 'default' in schema:
+        return schema['default']
+    if 'enum' in schema:
+        return schema['enum'][0]
+    kind = schema.get('type', 'object')
+    if kind == 'object':
+        props = schema.get('properties', {})
+        return {name: _schema_stub(props.get(name, {}), defs) for name in schema.get('required', [])}
+    return {'array': [], 'string': '', 'integer': 0, 'number': 0, 'boolean': False, 'null': None}.get(kind)
+
+
+def default_responder(contents: Any, config: Dict[str, Any], index: int) -> str:
+    """Schema-valid minimal JSON when the request carries a schema, else '{}'."""
+    schema = config.get('response_json_schema') if isinstance(config, dict) else None
+    if schema:
+        return json.dumps(_schema_stub(schema, schema.get('$defs', {})))
+    return '{}'
+
+
+def _parse_error_mix(spec: str) -> List[tuple]:
+    # "429:0.6,503:0.3,timeout:0.1" -> [(kind, weight), ...]
+    mix = []
+    for item in (spec or '').split(','):
+        if ':' in item:
+            kind, weight = item.split(':', 1)
+            mix.append((kind.strip(), float(weight)))
+    return mix or [('503', 1.0)]
+
+
+class SyntheticBackend(LLMBackend):
+    """Local stand-in for Gemini with configurable latency and failures.
+    
+    Latency is log-normal around `latency_ms` (median) with spread
+    `latency_sigma`, so it has a realistic tail. A fraction `error_rate` of
+    calls fail, drawn from `error_mix` ('429', '503', 'timeout', ...).
+    `responder(contents, config, index)` returns the JSON text of one
+    candidate. `supports_candidates=False` rejects candidate_count like some
+    models, and `rpm_limit` answers 429 past that many calls in a rolling
+    minute, like an API key quota. Counts requests, candidates, injected
+    errors and quota errors.
+    """
+    
+    name = 'synthetic'
+    STREAM_CHUNK = 200  # Characters per streamed chunk
+    
+    def __init__(self, responder: Callable[[Any, dict, int], str] = None,
+                 latency_ms: float = 0.0, latency_sigma: float = 0.0,
+                 error_rate: float = 0.0, error_mix: str = '',
+                 supports_candidates: bool = True, rpm_limit: int = 0,
+                 seed: Optional[int] = None):
+        super().__init__()
+        self.responder = responder or default_responder
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_mix = _parse_error_mix(error_mix)
+        self.supports_candidates = supports_candidates
+        self.rpm_limit = rpm_limit
+        self.requests = 0
+        self.candidates_returned = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self._recent = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls) -> 'SyntheticBackend':
+        return cls(latency_ms=Config.LLM_SYNTHETIC_LATENCY_MS,
+                   latency_sigma=Config.LLM_SYNTHETIC_LATENCY_SIGMA,
+                   error_rate=Config.LLM_SYNTHETIC_ERROR_RATE,
+                   error_mix=Config.LLM_SYNTHETIC_ERROR_MIX,
+                   rpm_limit=Config.LLM_SYNTHETIC_RPM_LIMIT,
+                   seed=Config.LLM_SYNTHETIC_SEED)
+    
+    def _start(self, config: Dict[str, Any]) -> tuple:
+        # Admit one call: returns (candidate count, latency seconds, error or None)
+        count = int(config.get('candidate_count') or 1)
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if self.rpm_limit and len(self._recent) >= self.rpm_limit:
+                self.quota_errors += 1
+                raise BackendError(429, "RESOURCE_EXHAUSTED: quota exceeded for requests per minute")
+            self._recent.append(now)
+            
+            delay = 0.0
+            if self.latency_ms:
+                delay = self.latency_ms / 1000 * math.exp(self._random.gauss(0, self.latency_sigma))
+            error = None
+            if self.error_rate and self._random.random() < self.error_rate:
+                kinds, weights = zip(*self.error_mix)
+                error = self._random.choices(kinds, weights)[0]
+                self.errors += 1
+        if count > 1 and not self.supports_candidates:
+            raise BackendError(400, "INVALID_ARGUMENT: candidate_count is not supported for this model")
+        return count, delay, error
+    
+    def _finish(self, contents: Any, config: Dict[str, Any], count: int, error: Optional[str]) -> LLMResponse:
+        if error == 'timeout':
+            raise TimeoutError("synthetic upstream timed out")
+        if error:
+            raise BackendError(int(error) if error.isdigit() else 503, "UNAVAILABLE: synthetic failure")
+        texts = [self.responder(contents, config, i) for i in range(count)]
+        with self._lock:
+            self.candidates_returned += len(texts)
+        return LLMResponse(texts, estimate_tokens(contents) + sum(len(t) // 4 for t in texts))
+    
+    def generate(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        count, delay, error = self._start(config)
+        if delay:
+            time.sleep(delay)
+        return self._finish(contents, config, count, error)
+    
+    async def generate_async(self, model: str, contents: Any, config: Dict[str, Any]) -> Any:
+        count, delay, error = self._start(config)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._finish(contents, config, count, error)
+    
+    def _chunks(self, response: LLMResponse) -> List[LLMResponse]:
+        # The response in STREAM_CHUNK-character chunks; usage comes with the last
+        text = response.text
+        count = max(1, math.ceil(len(text) / self.STREAM_CHUNK))
+        return [LLMResponse([text[index * self.STREAM_CHUNK:(index + 1) * self.STREAM_CHUNK]],
+                            response_tokens(response) if index == count - 1 else None)
+                for index in range(count)]
+    
+    def generate_stream(self, model: str, contents: Any, config: Dict[str, Any]) -> Iterator[Any]:
+        # Latency spread across the chunks
+        count, delay, error = self._start(config)
+        chunks = self._chunks(self._finish(contents, config, count, error))
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay / len(chunks))
+            yield chunk
+    
+    async def generate_stream_async(self, model: str, contents: Any, config: Dict[str, Any]) -> AsyncIterator[Any]:
+        count, delay, error = self._start(config)
+        chunks = self._chunks(self._finish(contents, config, count, error))
+        for chunk in chunks:
+            if delay:
+                await asyncio.sleep(delay / len(chunks))
+            yield chunk
+
+
+def build_backend(name: str, gemini_client: Callable[[], Any]) -> LLMBackend:
+    """Backend for GEMINI_BACKEND; `gemini_client()` builds the live genai.Client."""
+    if name in ('synthetic', 'fake'):
+        return SyntheticBackend.from_config()
+    if name == 'replay':
+        return ReplayBackend(Config.LLM_RECORDINGS_PATH, Config.LLM_REPLAY_LATENCY)
+    if name not in NETWORK_BACKENDS:
+        raise ValueError(f"Unknown GEMINI_BACKEND '{name}'")
+    
+    backend = GeminiBackend(gemini_client())
+    if name == 'record':
+        return RecordingBackend(backend, Config.LLM_RECORDINGS_PATH)
+    return backend
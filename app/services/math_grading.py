@@ -1,19 +1,16 @@
 # Math equation grading service using PEMDAS step breakdown
 import json
 from typing import Dict, Any, List
-from collections import Counter
-from google import genai
 
 from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader, SingleCall
 
 
-class MathGradingService:
+class MathGradingService(MultiPassGrader):
     # Grade math equations using PEMDAS step breakdown and multi-pass grading
     
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+    CACHE_NAMESPACE = 'math'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     def _to_latex(self, expression: str) -> str:
         # Convert plain math expression to LaTeX format
@@ -117,42 +114,42 @@ Return ONLY valid JSON:
 Include an entry for EVERY expected step."""
         return prompt
     
-    def _call_gemini(self, prompt: str) -> Dict[str, Any]:
-        # Call Gemini and parse JSON response
-        try:
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[prompt],
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            return {"error": str(e), "steps": []}
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        return json.loads(text)
     
-    def _get_expected_steps(self, problem: str, correct_answer: str) -> List[Dict]:
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        return {"error": str(e), "steps": []}
+    
+    def _get_expected_steps(self, problem: str, correct_answer: str) -> GradingSteps:
         # Get PEMDAS steps from AI
         prompt = self._build_steps_prompt(problem, correct_answer)
-        result = self._call_gemini(prompt)
+        result = yield SingleCall([prompt])
         return result.get('steps', [])
     
-    def _calculate_mode_or_median(self, statuses: List[str]) -> str:
-        # Get mode (most frequent), or median if all different
-        counts = Counter(statuses)
-        
-        # Mode: find status appearing 2+ times
-        for status, count in counts.items():
-            if count >= 2:
-                return status
-        
-        # Median: order is absent < partial < present
-        order = {'absent': 0, 'partial': 1, 'present': 2}
-        sorted_statuses = sorted(statuses, key=lambda x: order.get(x, 1))
-        return sorted_statuses[len(sorted_statuses) // 2]
+    def _collect_votes(self, pass_results: List[Dict[str, Any]], 
+                       step_count: int) -> Dict[Any, List[str]]:
+        # Status of each step in every pass (missing/invalid -> partial),
+        # plus the final-answer vote so early stopping waits for it too
+        votes = {}
+        for i in range(step_count):
+            statuses = []
+            for pr in pass_results:
+                steps = pr.get('steps', [])
+                if i < len(steps):
+                    status = steps[i].get('status', 'partial')
+                    if status not in ['present', 'partial', 'absent']:
+                        status = 'partial'
+                    statuses.append(status)
+                else:
+                    statuses.append('partial')
+            votes[i] = statuses
+        votes['final_answer_correct'] = [
+            'true' if pr.get('final_answer_correct', False) else 'false' for pr in pass_results
+        ]
+        return votes
     
-    def grade_question(self, question: Dict[str, Any], 
-                       student_work: str) -> Dict[str, Any]:
+    def _grade_steps(self, question: Dict[str, Any], 
+                     student_work: str) -> GradingSteps:
         # Grade a single math question
         problem = question.get('math_content', question.get('question_text', ''))
         correct_answer = str(question.get('correct_answer', ''))
@@ -190,7 +187,7 @@ Include an entry for EVERY expected step."""
             }
         
         # Get expected PEMDAS steps
-        expected_steps = self._get_expected_steps(problem, correct_answer)
+        expected_steps = yield from self._get_expected_steps(problem, correct_answer)
         
         if not expected_steps:
             return {
@@ -199,47 +196,29 @@ Include an entry for EVERY expected step."""
                 'status': 'error'
             }
         
-        # Run 3 grading passes
+        # Run grading passes concurrently
         grading_prompt = self._build_grading_prompt(
             problem, correct_answer, expected_steps, student_work
         )
-        pass_results = []
-        
-        for _ in range(Config.OPEN_ENDED_GRADING_PASSES):
-            result = self._call_gemini(grading_prompt)
-            pass_results.append(result)
+        collect_votes = lambda results: self._collect_votes(results, len(expected_steps))
+        pass_results = yield Consensus([grading_prompt], collect_votes, Config.OPEN_ENDED_GRADING_PASSES)
+        votes = collect_votes(pass_results)
         
         # Calculate mode/median for each step and track variance
         final_statuses = []
         high_variance_steps = []
-        final_answer_correct = False
         
         for i in range(len(expected_steps)):
-            statuses = []
-            for pr in pass_results:
-                steps = pr.get('steps', [])
-                if i < len(steps):
-                    status = steps[i].get('status', 'partial')
-                    if status not in ['present', 'partial', 'absent']:
-                        status = 'partial'
-                    statuses.append(status)
-                else:
-                    statuses.append('partial')
+            final_status, flagged = resolve_vote(votes[i])
             
-            # Flag if all 3 passes differ
-            if len(set(statuses)) == len(statuses) and len(statuses) >= 3:
+            # Flag if all passes differ
+            if flagged:
                 high_variance_steps.append(i)
             
-            final_statuses.append(self._calculate_mode_or_median(statuses))
+            final_statuses.append(final_status)
         
-        # Check final answer from ALL passes and use majority vote
-        final_answer_votes = []
-        for pr in pass_results:
-            final_answer_votes.append(pr.get('final_answer_correct', False))
-        
-        # Majority vote for final answer correctness
-        true_count = sum(1 for v in final_answer_votes if v)
-        final_answer_correct = true_count >= 2  # At least 2 out of 3 say correct
+        # Majority vote for final answer correctness across passes
+        final_answer_correct = resolve_vote(votes['final_answer_correct'])[0] == 'true'
         
         # CONSISTENCY FIX: If final answer is correct, ensure last step gets full credit
         # This prevents AI inconsistency from affecting the final score
@@ -318,7 +297,7 @@ Include an entry for EVERY expected step."""
             'final_answer_correct': final_answer_correct,
             'total_steps': len(expected_steps),
             'step_results': step_results,
-            'grading_passes': Config.OPEN_ENDED_GRADING_PASSES,
+            'grading_passes': len(pass_results),
             'flag_for_review': len(high_variance_steps) > 0,
             'high_variance_steps': high_variance_steps,
             'points_earned': round(total_earned, 2),
@@ -329,21 +308,14 @@ Include an entry for EVERY expected step."""
             'annotation_feedback': annotation_feedback  # Short for image annotation
         }
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_answers: Dict[str, str]) -> Dict[str, Any]:
-        # Grade multiple math questions
-        results = []
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Summarize the graded math questions
         total_earned = 0.0
         total_possible = 0.0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            student_work = student_answers.get(q_num, '')
-            
-            result = self.grade_question(q, student_work)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -354,6 +326,7 @@ Include an entry for EVERY expected step."""
             'question_type': 'math_equation',
             'total_questions': len(questions),
             'grading_passes_per_question': Config.OPEN_ENDED_GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'flagged_for_review': flagged_count,
             'points_earned': round(total_earned, 2),
             'points_possible': round(total_possible, 2),
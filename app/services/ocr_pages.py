@@ -0,0 +1,145 @@
+# Page-group splitting and merging for page-parallel PDF OCR
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Added to the OCR prompt when a request holds only some pages of the exam
+PAGE_NOTE = """
+
+PAGE CONTEXT: These images are pages {first}-{last} of a {total}-page exam; the other pages are sent separately.
+- Extract only what appears on these pages, numbering `order` from 1 within them.
+- If the first item continues a question started on an earlier page, repeat that question's number if it is visible, otherwise leave question_number empty.
+- Fill metadata only from what is visible on these pages."""
+
+
+def page_groups(page_count: int, group_size: int) -> List[range]:
+    # [0, 1], [2, 3], ... (0-based page indexes)
+    size = max(1, group_size)
+    return [range(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def page_runs(pages: List[int], group_size: int = 0) -> List[range]:
+    # Consecutive runs of page indexes, split into groups of group_size (0: whole runs)
+    runs: List[range] = []
+    for page in pages:
+        if runs and runs[-1].stop == page and (not group_size or len(runs[-1]) < group_size):
+            runs[-1] = range(runs[-1].start, page + 1)
+        else:
+            runs.append(range(page, page + 1))
+    return runs
+
+
+def page_note(pages: range, total: int) -> str:
+    return PAGE_NOTE.format(first=pages.start + 1, last=pages.stop, total=total)
+
+
+def question_key(question: Dict[str, Any]) -> str:
+    # "Q3.", "3)", " 3 " -> "3"
+    number = str(question.get('question_number') or '').strip().lower()
+    number = re.sub(r'^(q(uestion)?|س)\s*', '', number)
+    return re.sub(r'[\s.):\-]+$', '', number)
+
+
+def _merge_value(first: Any, second: Any) -> Any:
+    if first in (None, '', [], {}):
+        return second
+    if second in (None, '', [], {}) or second == first:
+        return first
+    if isinstance(first, list) and isinstance(second, list):
+        return first + [item for item in second if item not in first]
+    if isinstance(first, dict) and isinstance(second, dict):
+        return {**first, **second}
+    if isinstance(first, str) and isinstance(second, str):
+        return f"{first}\n{second}"
+    return first
+
+
+def _continue_question(question: Dict[str, Any], continuation: Dict[str, Any]) -> None:
+    # Fold the part of a question found on the next page into the question
+    for field, value in continuation.items():
+        if field not in ('order', 'question_number', 'question_type'):
+            question[field] = _merge_value(question.get(field), value)
+
+
+def _is_continuation(question: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+    # Only the first question of a page group can continue the previous group's last one
+    if previous is None:
+        return False
+    number = question_key(question)
+    return not number or number == question_key(previous)
+
+
+def _merge_metadata(metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # First page that states a field wins (cover pages carry title, points, ...)
+    merged: Dict[str, Any] = {}
+    for metadata in metadatas:
+        for field, value in metadata.items():
+            if field == 'sections' and value:
+                merged['sections'] = _merge_value(merged.get('sections'), value)
+            elif merged.get(field) is None:
+                merged[field] = value
+    return merged
+
+
+def merge_page_results(outcomes: List[Tuple[range, Optional[Dict[str, Any]], Optional[Exception], float]]
+                       ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Merge per-group OCR results (in document order) into one OCRResponse dict.
+    
+    `outcomes` holds (pages, result or None, error or None, seconds) per page
+    group. Questions are renumbered in document order, and a question split by
+    a page break (the next group starts with the same number, or none) is
+    joined back into one. Failed groups are skipped and count as zero
+    confidence; if every group failed, the first error is raised.
+    Returns the merged result and the per-group page report.
+    """
+    questions: List[Dict[str, Any]] = []
+    texts: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    report: List[Dict[str, Any]] = []
+    weighted_confidence = 0.0
+    page_total = 0
+    joinable = False  # no continuation across a failed group
+    
+    for pages, result, error, seconds in outcomes:
+        page_total += len(pages)
+        entry = {
+            'pages': [p + 1 for p in pages],
+            'confidence_score': None,
+            'question_count': 0,
+            'elapsed_ms': round(seconds * 1000, 1),
+            'error': str(error) if error is not None else None,
+            'source': (result or {}).get('source', 'vision')
+        }
+        report.append(entry)
+        if result is None:
+            joinable = False
+            continue
+        
+        data = result['structured_data']
+        group_questions = sorted(data.get('questions') or [], key=lambda q: q.get('order') or 0)
+        for index, question in enumerate(group_questions):
+            previous = questions[-1] if joinable and index == 0 else None
+            if _is_continuation(question, previous):
+                _continue_question(previous, question)
+            else:
+                questions.append(dict(question))
+        
+        joinable = bool(questions)
+        entry['confidence_score'] = result['confidence_score']
+        entry['question_count'] = len(group_questions)
+        weighted_confidence += result['confidence_score'] * len(pages)
+        texts.append(result.get('extracted_text') or '')
+        metadatas.append(data.get('metadata') or {})
+    
+    if not metadatas:
+        raise next(error for _, _, error, _ in outcomes if error is not None)
+    
+    for order, question in enumerate(questions, 1):
+        question['order'] = order
+    
+    merged = {
+        'extracted_text': '\n\n'.join(t for t in texts if t),
+        'structured_data': {'questions': questions, 'metadata': _merge_metadata(metadatas)},
+        'confidence_score': round(weighted_confidence / max(1, page_total), 4)
+    }
+    return merged, report
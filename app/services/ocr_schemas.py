@@ -0,0 +1,121 @@
+# Structured-output schemas for OCR requests, built once and trimmed to the expected question types
+import copy
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple, get_args
+
+from app.config import Config
+from app.models.schemas import QUESTION_TYPES, AnswerSheet, OCRResponse, StructuredOCRResponse
+from app.services.ocr_stream import streaming_schema
+
+
+# Question fields every type keeps: identity, text, answers and points
+COMMON_FIELDS = ('order', 'question_number', 'question_type', 'question_text', 'correct_answer',
+                 'student_answer', 'student_markings', 'points', 'instructions')
+
+# Type-specific Question fields (what the OCR prompts and the graders use per type)
+TYPE_FIELDS = {
+    'multiple_choice': ('options',),
+    'true_false': (),
+    'matching': ('left_column', 'right_column', 'correct_matches'),
+    'fill_in_blank': ('blanks',),
+    'ordering': ('ordering_items', 'correct_order'),
+    'short_answer': ('expected_answer_count', 'acceptable_answers', 'model_answer'),
+    'open_ended': ('answer_length', 'expected_keywords', 'model_answer', 'answer_markdown'),
+    'compare_contrast': ('compare_items', 'comparison_aspects', 'grading_table', 'expected_keywords', 'model_answer'),
+    'definition': ('term_to_define', 'expected_keywords', 'model_answer'),
+    'labeling': ('labeling_items', 'diagram_description'),
+    'labeling_image': ('labeling_items', 'diagram_description'),
+    'math_equation': ('math_content',),
+    'table': ('table_headers', 'table_rows', 'grading_table'),
+}
+
+ALL_TYPES = get_args(QUESTION_TYPES)
+
+# What extracted_text holds (see OCR_EXTRACTED_TEXT)
+TEXT_MODES = ('full', 'summary', 'none')
+SUMMARY_DESCRIPTION = 'One or two sentences describing the document (subject, sections); not a transcription'
+
+
+def parse_question_types(value: Any) -> Optional[Tuple[str, ...]]:
+    """Canonical question-type tuple from a list or comma-separated string (None for all types).
+    
+    Raises ValueError for unknown types. Types come back in QUESTION_TYPES
+    order, so equal sets share one cached schema.
+    """
+    if value is None:
+        return None
+    names = value.split(',') if isinstance(value, str) else value
+    wanted = {str(name).strip().lower() for name in names if str(name).strip()}
+    unknown = wanted.difference(ALL_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown question types: {', '.join(sorted(unknown))}")
+    if not wanted or wanted == set(ALL_TYPES):
+        return None
+    return tuple(t for t in ALL_TYPES if t in wanted)
+
+
+def parse_text_mode(value: Optional[str]) -> str:
+    """extracted_text mode of a request: one of TEXT_MODES, OCR_EXTRACTED_TEXT when not given."""
+    mode = (value or Config.OCR_EXTRACTED_TEXT).strip().lower()
+    if mode not in TEXT_MODES:
+        raise ValueError(f"Invalid extracted_text '{mode}' (use {', '.join(TEXT_MODES)})")
+    return mode
+
+
+def _text_schema(text: str) -> Dict[str, Any]:
+    if text == 'none':
+        return StructuredOCRResponse.model_json_schema()
+    schema = OCRResponse.model_json_schema()
+    if text == 'summary':
+        schema['properties']['extracted_text'] = dict(schema['properties']['extracted_text'],
+                                                      description=SUMMARY_DESCRIPTION)
+    return schema
+
+
+def _drop_unused_defs(schema: Dict[str, Any]) -> None:
+    # Remove $defs no longer referenced once fields are trimmed (e.g. LabelingItem)
+    defs = schema.get('$defs', {})
+    changed = True
+    while changed:
+        changed = False
+        for name in list(defs):
+            rest = json.dumps([schema['properties'], [d for other, d in defs.items() if other != name]])
+            if f'"#/$defs/{name}"' not in rest:
+                del defs[name]
+                changed = True
+
+
+def _trimmed(schema: Dict[str, Any], question_types: Iterable[str]) -> Dict[str, Any]:
+    schema = copy.deepcopy(schema)
+    question = schema['$defs']['Question']
+    keep = set(COMMON_FIELDS).union(*(TYPE_FIELDS[t] for t in question_types))
+    question['properties'] = {name: spec for name, spec in question['properties'].items() if name in keep}
+    question['properties']['question_type']['enum'] = list(question_types)
+    question['required'] = [name for name in question.get('required', []) if name in keep]
+    _drop_unused_defs(schema)
+    return schema
+
+
+@lru_cache(maxsize=64)
+def ocr_schema(question_types: Optional[Tuple[str, ...]] = None, stream: bool = False,
+               text: str = 'full') -> Dict[str, Any]:
+    """OCRResponse JSON schema, built once per (question types, stream, text mode) and shared.
+    
+    With `question_types` (from parse_question_types) the Question schema
+    keeps only the common fields and those of these types, so the model
+    has far fewer optional fields to fill with nulls. `text` 'summary' asks
+    for a short extracted_text, 'none' leaves it out of the schema.
+    Callers must not modify the returned dict.
+    """
+    if question_types:
+        schema = _trimmed(ocr_schema(text=text), question_types)
+    else:
+        schema = _text_schema(text)
+    return streaming_schema(schema) if stream else schema
+
+
+@lru_cache(maxsize=1)
+def answer_sheet_schema() -> Dict[str, Any]:
+    """AnswerSheet JSON schema (answer-only mode), built once and shared."""
+    return AnswerSheet.model_json_schema()
@@ -0,0 +1,93 @@
+# Incremental JSON scanning for streamed OCR responses
+import json
+from typing import Any, Dict, List, Tuple
+
+
+QUESTIONS_PATH = ('structured_data', 'questions')
+
+
+def streaming_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """An OCRResponse schema with structured_data first and extracted_text last.
+    
+    The model writes properties in schema order; with the raw text last,
+    the first question is complete after a few hundred tokens instead of
+    after the whole page has been transcribed.
+    """
+    properties = schema['properties']
+    order = ['structured_data'] + [name for name in properties if name not in ('structured_data', 'extracted_text')]
+    if 'extracted_text' in properties:
+        order.append('extracted_text')
+    return dict(schema, properties={name: properties[name] for name in order})
+
+
+class ArrayItemStream:
+    """Yields the object items of one nested JSON array as soon as each is complete.
+    
+    Text is fed in arbitrary chunks (as the model streams it). The scanner
+    tracks only strings, escapes and the stack of open objects and arrays
+    with the key each value sits under, so every character is looked at
+    once; a finished item is parsed with json.loads from its own span.
+    `path` names the object keys leading to the array, e.g.
+    ('structured_data', 'questions').
+    """
+    
+    def __init__(self, path: Tuple[str, ...] = QUESTIONS_PATH):
+        self.path = list(path)
+        self._text = ''
+        self._pos = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._stack: List[list] = []  # [kind, key, pending key] per open container
+        self._item_start = None
+    
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._text
+    
+    def _at_target(self) -> bool:
+        # The innermost container is the array at `path`
+        stack = self._stack
+        return (len(stack) == len(self.path) + 1 and stack[-1][0] == '['
+                and all(frame[0] == '{' and frame[1] == key for frame, key in zip(stack, self.path)))
+    
+    def feed(self, chunk: str) -> List[Any]:
+        """Add streamed text; returns the array items completed by it."""
+        self._text += chunk
+        items = []
+        text, stack = self._text, self._stack
+        for index in range(self._pos, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    top = stack[-1] if stack else None
+                    if top is not None and top[0] == '{' and top[2] is True:
+                        top[2] = json.loads(text[self._string_start:index + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char in '{[':
+                if self._item_start is None and self._at_target():
+                    self._item_start = index
+                stack.append([char, None, True])
+            elif char in '}]':
+                if stack:
+                    stack.pop()
+                if self._item_start is not None and self._at_target():
+                    items.append(json.loads(text[self._item_start:index + 1]))
+                    self._item_start = None
+            elif char == ':' and stack and stack[-1][0] == '{':
+                # The key just read now names the value that follows
+                stack[-1][1] = stack[-1][2]
+                stack[-1][2] = None
+            elif char == ',' and stack and stack[-1][0] == '{':
+                stack[-1][1] = None
+                stack[-1][2] = True
+        self._pos = len(text)
+        return items
@@ -1,19 +1,16 @@
 # Open-ended grading service using Gemini AI
 import json
 from typing import Dict, Any, List
-from collections import Counter
-from google import genai
 
 from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader
 
 
-class OpenEndedGradingService:
+class OpenEndedGradingService(MultiPassGrader):
     # Grade open-ended questions using fixed criteria and multi-pass grading
     
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+    CACHE_NAMESPACE = 'open_ended'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     def _build_grading_prompt(self, model_answer: str, student_answer: str, 
                                expected_keywords: List[str]) -> str:
@@ -57,37 +54,28 @@ Return ONLY valid JSON in this exact format:
 {json_template}"""
         return prompt
     
-    def _call_gemini(self, prompt: str) -> Dict[str, Any]:
-        # Call Gemini and parse JSON response
-        try:
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[prompt],
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            # Return neutral result on error
-            return {
-                name: {"status": "partial", "reason": f"Grading error: {str(e)}"}
-                for name in Config.get_criteria_names()
-            }
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        return json.loads(text)
+    
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        # Return neutral result on error
+        return {
+            name: {"status": "partial", "reason": f"Grading error: {str(e)}"}
+            for name in Config.get_criteria_names()
+        }
     
-    def _calculate_mode_or_median(self, statuses: List[str]) -> str:
-        # Get mode (most frequent), or median if all different
-        counts = Counter(statuses)
-        
-        # Mode: find status appearing 2+ times
-        for status, count in counts.items():
-            if count >= 2:
-                return status
-        
-        # Median: order is absent < partial < full
-        order = {'absent': 0, 'partial': 1, 'full': 2}
-        sorted_statuses = sorted(statuses, key=lambda x: order.get(x, 1))
-        return sorted_statuses[len(sorted_statuses) // 2]
+    def _collect_votes(self, pass_results: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        # Status of each criterion in every pass (invalid -> partial)
+        votes = {}
+        for criterion in Config.get_criteria_names():
+            statuses = []
+            for pr in pass_results:
+                status = pr.get(criterion, {}).get('status', 'partial')
+                if status not in ['full', 'partial', 'absent']:
+                    status = 'partial'
+                statuses.append(status)
+            votes[criterion] = statuses
+        return votes
     
     def _calculate_final_scores(self, final_statuses: Dict[str, str], 
                                   max_points: float) -> Dict[str, Any]:
@@ -114,8 +102,8 @@ Return ONLY valid JSON in this exact format:
             'points_possible': max_points
         }
     
-    def grade_question(self, question: Dict[str, Any], 
-                       student_answer: str) -> Dict[str, Any]:
+    def _grade_steps(self, question: Dict[str, Any], 
+                     student_answer: str) -> GradingSteps:
         # Grade a single open-ended question
         model_answer = question.get('model_answer', '')
         expected_keywords = question.get('expected_keywords', [])
@@ -139,37 +127,26 @@ Return ONLY valid JSON in this exact format:
             result['pass_results'] = []
             return result
         
-        # Run multiple grading passes
+        # Run grading passes concurrently
         prompt = self._build_grading_prompt(model_answer, student_answer, expected_keywords)
-        pass_results = []
-        
-        for _ in range(Config.OPEN_ENDED_GRADING_PASSES):
-            result = self._call_gemini(prompt)
-            pass_results.append(result)
+        pass_results = yield Consensus([prompt], self._collect_votes, Config.OPEN_ENDED_GRADING_PASSES)
         
         # Calculate mode/median for each criterion and track variance
         final_statuses = {}
         high_variance_criteria = []
         
-        for criterion in Config.get_criteria_names():
-            statuses = []
-            for pr in pass_results:
-                status = pr.get(criterion, {}).get('status', 'partial')
-                if status not in ['full', 'partial', 'absent']:
-                    status = 'partial'
-                statuses.append(status)
+        for criterion, statuses in self._collect_votes(pass_results).items():
+            final_statuses[criterion], flagged = resolve_vote(statuses)
             
-            # Flag if all 3 passes differ (high variance)
-            if len(set(statuses)) == len(statuses) and len(statuses) >= 3:
+            # Flag if all passes differ (high variance)
+            if flagged:
                 high_variance_criteria.append(criterion)
-            
-            final_statuses[criterion] = self._calculate_mode_or_median(statuses)
         
         # Calculate final scores
         result = self._calculate_final_scores(final_statuses, max_points)
         result['question_number'] = q_num
         result['student_answer'] = student_answer[:200] + '...' if len(student_answer) > 200 else student_answer
-        result['grading_passes'] = Config.OPEN_ENDED_GRADING_PASSES
+        result['grading_passes'] = len(pass_results)
         
         # Add high variance flag
         result['flag_for_review'] = len(high_variance_criteria) > 0
@@ -184,21 +161,14 @@ Return ONLY valid JSON in this exact format:
         
         return result
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_answers: Dict[str, str]) -> Dict[str, Any]:
-        # Grade multiple open-ended questions
-        results = []
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Summarize the graded open-ended questions
         total_earned = 0.0
         total_possible = 0.0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            student_answer = student_answers.get(q_num, '')
-            
-            result = self.grade_question(q, student_answer)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -209,6 +179,7 @@ Return ONLY valid JSON in this exact format:
             'question_type': 'open_ended',
             'total_questions': len(questions),
             'grading_passes_per_question': Config.OPEN_ENDED_GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'criteria_used': list(Config.OPEN_ENDED_CRITERIA.keys()),
             'flagged_for_review': flagged_count,
             'points_earned': round(total_earned, 2),
@@ -0,0 +1,256 @@
+# Local pre-flight checks on page images before any OCR call
+from typing import Any, Dict, List, Optional
+
+import fitz
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.config import Config
+
+
+PREFLIGHT_SIDE = 1024  # Long side of the grayscale thumbnail pages are checked on
+MIN_FLIP_LINES = 5     # Fewer text lines than this are too few to call a page upside down
+ROTATE_MIN_SHARPNESS = 0.5  # Softer pages are still sent, but not judged for rotation
+RULE_MIN_RUN = 60      # Straight ink runs this long are rules and boxes, not text
+TILE = 96              # Side of the tiles that vote on the text direction
+TILE_MIN_INK = 0.02    # Ink share below which a tile has too little text to vote
+LINE_STRIP = 200       # Width of the strips glyph baselines are measured in
+MIN_LINE_HEIGHT, MAX_LINE_HEIGHT = 6, 80  # Text line heights on the thumbnail
+MIN_LINE_COLUMNS = 20  # Inked columns a line needs before its baseline counts
+MAX_LINE_INK = 0.55    # Denser "lines" are solid shapes (a pen, a shadow), not strokes of text
+
+SEND = 'sent'
+ROTATED = 'rotated'
+SKIPPED = 'skipped'
+REJECTED = 'rejected'
+
+
+class PageRejected(ValueError):
+    """No page of the upload is worth sending (blank, blurred or washed out)."""
+    
+    def __init__(self, diagnostics: List[Dict[str, Any]]):
+        reasons = '; '.join(f"page {d['page']}: {d['reason']}" for d in diagnostics if d.get('reason'))
+        super().__init__(f"No readable pages to OCR ({reasons})")
+        self.diagnostics = diagnostics
+
+
+def thumbnail_array(image: Image.Image) -> np.ndarray:
+    """Grayscale uint8 array of the page, long side at most PREFLIGHT_SIDE."""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((PREFLIGHT_SIDE, PREFLIGHT_SIDE), Image.BILINEAR)
+    return np.asarray(thumbnail.convert('L'))
+
+
+def pdf_page_array(page: fitz.Page) -> np.ndarray:
+    """thumbnail_array for a PDF page, rendered by MuPDF in grayscale at that size."""
+    zoom = PREFLIGHT_SIDE / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    # Rows of the sample buffer may be padded past the page width
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width].copy()
+
+
+def _line_bands(profile: np.ndarray) -> list:
+    # (start, stop) of the runs of rows holding ink: the text lines
+    rows = profile > 0.03 * profile.max()
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+    return [(start, stop) for start, stop in zip(edges[::2], edges[1::2]) if stop - start >= 4]
+
+
+def _long_runs(ink: np.ndarray, min_run: int) -> np.ndarray:
+    # Pixels in horizontal runs of ink at least min_run long
+    height, width = ink.shape
+    edges = np.diff(np.pad(ink.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)
+    long = stops - starts >= min_run
+    runs = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(runs, (rows[long], starts[long]), 1)
+    np.add.at(runs, (rows[long], stops[long]), -1)
+    return np.cumsum(runs, axis=1)[:, :width] > 0
+
+
+def _strip_rules(ink: np.ndarray) -> np.ndarray:
+    # Answer lines, boxes and table rules are not text, and only blur the line shapes
+    return ink & ~_long_runs(ink, RULE_MIN_RUN) & ~_long_runs(ink.T, RULE_MIN_RUN).T
+
+
+def _tile_scores(ink: np.ndarray) -> List[float]:
+    # (row profile variance - column profile variance) / ink share² of each inked tile
+    scores = []
+    for y in range(0, ink.shape[0] - TILE + 1, TILE // 2):
+        for x in range(0, ink.shape[1] - TILE + 1, TILE // 2):
+            tile = ink[y:y + TILE, x:x + TILE]
+            share = tile.mean()
+            if share >= TILE_MIN_INK:
+                scores.append(float((tile.mean(axis=1).var() - tile.mean(axis=0).var()) / share ** 2))
+    return scores
+
+
+def _sideways(ink: np.ndarray) -> Optional[bool]:
+    """True when the text lines run vertically (page turned 90 degrees), False
+    when they run horizontally, None when the page does not clearly say.
+    
+    Across horizontal lines the rows of a tile swing between ink and gap
+    while its columns stay even, so text tiles score positive upright and
+    negative sideways. The median tile must pass OCR_PREFLIGHT_SIDEWAYS_MARGIN:
+    a photo, a table or a diagram sways its own tiles, not the page.
+    """
+    scores = _tile_scores(ink)
+    if not scores:
+        return None
+    median = float(np.median(scores))
+    if median < -Config.OCR_PREFLIGHT_SIDEWAYS_MARGIN:
+        return True
+    if median > Config.OCR_PREFLIGHT_SIDEWAYS_MARGIN:
+        return False
+    return None
+
+
+def _upright_score(ink: np.ndarray) -> Optional[float]:
+    """+1..-1: how upright (positive) or upside down (negative) horizontal text looks.
+    
+    Each text line has a dense body (the x-height rows) with sparser ink
+    above and below it. Ascenders, capitals and dots above the body are far
+    more common than descenders below it, so ink above outweighs ink below
+    when the page is upright. None when there are too few lines to tell.
+    """
+    profile = ink.mean(axis=1)
+    bands = _line_bands(profile)
+    if len(bands) < MIN_FLIP_LINES:
+        return None
+    above = below = 0.0
+    for start, stop in bands:
+        band = profile[start:stop]
+        body = np.flatnonzero(band > 0.5 * band.max())
+        above += band[:body[0]].sum()
+        below += band[body[-1] + 1:].sum()
+    return float((above - below) / max(above + below, 1e-6))
+
+
+def _aligned(offsets: np.ndarray) -> float:
+    # Share of the offsets within the most common three rows
+    return float(np.convolve(np.bincount(offsets), np.ones(3)).max() / len(offsets))
+
+
+def _baseline_score(ink: np.ndarray) -> Optional[float]:
+    """+1..-1: how much better the bottoms of the glyphs line up than their tops.
+    
+    Most glyphs of a line stand on its baseline, while their tops spread
+    over the x-height, capitals, ascenders and dots, in Latin and Arabic
+    script alike. Lines are measured in LINE_STRIP-wide strips so a slightly
+    skewed scan does not smear the baseline. None with too few lines.
+    """
+    score = columns = 0.0
+    lines = 0
+    for x in range(0, ink.shape[1], LINE_STRIP):
+        strip = ink[:, x:x + LINE_STRIP]
+        profile = strip.mean(axis=1)
+        if not profile.any():
+            continue
+        for start, stop in _line_bands(profile):
+            # A line cut by the page edge has its tops or bottoms pinned to the edge
+            if start == 0 or stop == len(profile) or not MIN_LINE_HEIGHT <= stop - start <= MAX_LINE_HEIGHT:
+                continue
+            line = strip[start:stop]
+            line = line[:, line.any(axis=0)]
+            if line.shape[1] < MIN_LINE_COLUMNS or line.mean() > MAX_LINE_INK:
+                continue
+            tops, bottoms = line.argmax(axis=0), line[::-1].argmax(axis=0)
+            score += (_aligned(bottoms) - _aligned(tops)) * line.shape[1]
+            columns += line.shape[1]
+            lines += 1
+    if lines < MIN_FLIP_LINES:
+        return None
+    return score / columns
+
+
+def _upright(ink: np.ndarray) -> Optional[bool]:
+    # True/False when both cues read upright/upside down by more than their
+    # margins (OCR_PREFLIGHT_FLIP_MARGIN, OCR_PREFLIGHT_BASELINE_MARGIN), None otherwise
+    mass, baseline = _upright_score(ink), _baseline_score(ink)
+    if mass is None or baseline is None:
+        return None
+    if mass > Config.OCR_PREFLIGHT_FLIP_MARGIN and baseline > Config.OCR_PREFLIGHT_BASELINE_MARGIN:
+        return True
+    if mass < -Config.OCR_PREFLIGHT_FLIP_MARGIN and baseline < -Config.OCR_PREFLIGHT_BASELINE_MARGIN:
+        return False
+    return None
+
+
+def _rotation(ink: np.ndarray, sharp: bool) -> int:
+    """Clockwise degrees that make the page upright (0, 90, 180 or 270).
+    
+    A wrong turn garbles the OCR of a page that was readable, so a page is
+    only turned when its direction cue is clear and both upright cues agree;
+    otherwise 0. Blur smears ascenders into the line body, so only sharp
+    pages are judged, and a sideways page is only turned once its direction
+    is known.
+    """
+    if not sharp or ink.mean() < 1e-4:
+        return 0
+    ys, xs = np.nonzero(ink)
+    ink = _strip_rules(ink[ys.min():ys.max() + 1, xs.min():xs.max() + 1])
+    sideways = _sideways(ink)
+    if sideways is None:
+        return 0
+    upright = _upright(np.rot90(ink, -1) if sideways else ink)
+    if upright is None:
+        return 0
+    return (90 if sideways else 0) + (0 if upright else 180)
+
+
+def inspect_page(gray: np.ndarray, page: int = 1) -> Dict[str, Any]:
+    """Diagnose one page from its grayscale thumbnail.
+    
+    Returns the page's measurements, the `rotation` that makes it upright
+    and an `action`: sent (or rotated) when it should be OCR'd, skipped when
+    it is blank, rejected when it is too blurred or faint to read.
+    """
+    # Measured on a median-filtered copy: scanner grain would read as ink and edges
+    raw = gray
+    gray = np.asarray(Image.fromarray(gray).filter(ImageFilter.MedianFilter(3)), dtype=np.float32)
+    paper = float(np.median(gray))
+    marks = gray < paper - 15
+    ink_share = float(marks.mean())
+    diagnostics = {'page': page, 'action': SEND, 'rotation': 0, 'reason': None,
+                   'ink_share': round(ink_share, 5), 'contrast': None, 'sharpness': None}
+    
+    if ink_share < Config.OCR_PREFLIGHT_BLANK_INK:
+        diagnostics.update(action=SKIPPED, reason='blank page')
+        return diagnostics
+    
+    # Darkest ink against the paper, and the steepest edges relative to that
+    # contrast: a sharp stroke goes from paper to ink within a pixel or two
+    contrast = paper - float(np.percentile(gray[marks], 5))
+    gradient = np.maximum(np.abs(np.diff(gray, axis=0))[:, :-1], np.abs(np.diff(gray, axis=1))[:-1, :])
+    sharpness = float(np.percentile(gradient, 99.5)) / max(contrast, 1.0)
+    diagnostics.update(contrast=round(contrast, 1), sharpness=round(sharpness, 3))
+    
+    if contrast < Config.OCR_PREFLIGHT_MIN_CONTRAST:
+        diagnostics.update(action=REJECTED, reason=f'contrast too low ({contrast:.0f})')
+    elif sharpness < Config.OCR_PREFLIGHT_MIN_SHARPNESS:
+        diagnostics.update(action=REJECTED, reason=f'too blurred (sharpness {sharpness:.2f})')
+    elif Config.OCR_PREFLIGHT_AUTO_ROTATE:
+        # Only the stroke cores: the faint rim around scanned glyphs blurs line shapes
+        core = raw < paper - 0.8 * contrast
+        rotation = _rotation(core, sharpness >= ROTATE_MIN_SHARPNESS)
+        if rotation:
+            diagnostics.update(action=ROTATED, rotation=rotation)
+    return diagnostics
+
+
+def upright(image: Image.Image, rotation: int) -> Image.Image:
+    # Turn an image clockwise by 0/90/180/270 degrees
+    turns = {90: Image.Transpose.ROTATE_270, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_90}
+    return image.transpose(turns[rotation]) if rotation in turns else image
+
+
+def should_send(diagnostics: Optional[Dict[str, Any]]) -> bool:
+    return diagnostics is None or diagnostics['action'] in (SEND, ROTATED)
+
+
+def check_sendable(parts: list, diagnostics: List[Dict[str, Any]]) -> list:
+    # Nothing left to send: blank uploads get an empty result, unreadable ones an error
+    if not parts and any(d['action'] == REJECTED for d in diagnostics):
+        raise PageRejected(diagnostics)
+    return parts
@@ -0,0 +1,157 @@
+# Concurrent executor for multi-pass AI grading
+import asyncio
+import contextvars
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Iterable, List, Optional, TypeVar
+
+from app.config import Config
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_lock = threading.Lock()
+_pass_pool: Optional[ThreadPoolExecutor] = None
+_question_pool: Optional[ThreadPoolExecutor] = None
+_local = threading.local()
+
+# Global cap on grading calls in flight to Gemini, across questions and passes
+_call_slots = threading.BoundedSemaphore(Config.GRADING_MAX_CONCURRENT_CALLS)
+
+# The async path gets the same cap per event loop (asyncio semaphores are loop-bound)
+_async_call_slots = weakref.WeakKeyDictionary()
+
+
+def _get_pass_pool() -> ThreadPoolExecutor:
+    global _pass_pool
+    if _pass_pool is None:
+        with _lock:
+            if _pass_pool is None:
+                _pass_pool = ThreadPoolExecutor(max_workers=Config.GRADING_PASS_WORKERS,
+                                                thread_name_prefix='grading-pass')
+    return _pass_pool
+
+
+def _get_question_pool() -> ThreadPoolExecutor:
+    # Separate from the pass pool: question workers block on pass futures,
+    # so sharing one pool could deadlock once every worker is waiting
+    global _question_pool
+    if _question_pool is None:
+        with _lock:
+            if _question_pool is None:
+                _question_pool = ThreadPoolExecutor(max_workers=Config.GRADING_QUESTION_WORKERS,
+                                                    thread_name_prefix='grading-question')
+    return _question_pool
+
+
+@contextmanager
+def call_slot():
+    # Hold one of the global Gemini call slots for the duration of a call
+    _call_slots.acquire()
+    try:
+        yield
+    finally:
+        _call_slots.release()
+
+
+def _limited(call: Callable[[int], T], index: int) -> T:
+    with call_slot():
+        return call(index)
+
+
+def run_passes(call: Callable[[int], T], passes: int) -> List[T]:
+    """Run independent grading passes concurrently; call(i) runs pass i.
+
+    At most GRADING_PASS_FANOUT passes of one question are in flight at once.
+    Results are returned in pass order, so callers that read the last pass
+    (e.g. for reasons) behave exactly as with a sequential loop.
+    """
+    fanout = max(1, Config.GRADING_PASS_FANOUT)
+    if passes <= 1 or fanout == 1:
+        return [_limited(call, i) for i in range(passes)]
+    
+    pool = _get_pass_pool()
+    results: List[T] = []
+    while len(results) < passes:
+        done = len(results)
+        wave = min(fanout, passes - done)
+        # copy_context keeps per-request settings (e.g. scheduler priority) in the workers
+        futures = [pool.submit(contextvars.copy_context().run, _limited, call, done + i) for i in range(wave)]
+        results.extend(f.result() for f in futures)
+    return results
+
+
+def _run_question(fn: Callable[[T], R], item: T) -> R:
+    _local.in_question = True
+    try:
+        return fn(item)
+    finally:
+        _local.in_question = False
+
+
+def map_questions(fn: Callable[[T], R], items: Iterable[T]) -> List[R]:
+    """Grade questions in parallel, returning results in input order.
+
+    Parallelism is bounded by GRADING_QUESTION_WORKERS; the Gemini calls the
+    questions make are additionally bounded by the global call slots.
+    """
+    items = list(items)
+    if len(items) <= 1 or Config.GRADING_QUESTION_WORKERS <= 1 or getattr(_local, 'in_question', False):
+        return [fn(item) for item in items]
+    
+    pool = _get_question_pool()
+    futures = [pool.submit(contextvars.copy_context().run, _run_question, fn, item) for item in items]
+    return [f.result() for f in futures]
+
+
+@asynccontextmanager
+async def async_call_slot():
+    # Async counterpart of call_slot for coroutines on the running loop
+    loop = asyncio.get_running_loop()
+    slots = _async_call_slots.get(loop)
+    if slots is None:
+        slots = _async_call_slots[loop] = asyncio.Semaphore(Config.GRADING_MAX_CONCURRENT_CALLS)
+    async with slots:
+        yield
+
+
+async def _limited_async(call: Callable[[int], Awaitable[T]], index: int) -> T:
+    async with async_call_slot():
+        return await call(index)
+
+
+async def run_passes_async(call: Callable[[int], Awaitable[T]], passes: int) -> List[T]:
+    # Coroutine version of run_passes: same waves, no threads
+    fanout = max(1, Config.GRADING_PASS_FANOUT)
+    results: List[T] = []
+    while len(results) < passes:
+        done = len(results)
+        wave = min(fanout, passes - done)
+        results.extend(await asyncio.gather(*(_limited_async(call, done + i) for i in range(wave))))
+    return results
+
+
+async def map_questions_async(fn: Callable[[T], Awaitable[R]], items: Iterable[T]) -> List[R]:
+    """Grade questions concurrently on the running loop, in input order.
+
+    Questions cost no thread here, so they are not bounded by
+    GRADING_QUESTION_WORKERS; the Gemini calls still take async call slots.
+    """
+    return list(await asyncio.gather(*(fn(item) for item in items)))
+
+
+def _reset_after_fork():
+    global _lock, _pass_pool, _question_pool, _call_slots, _async_call_slots
+    _lock = threading.Lock()
+    _pass_pool = None
+    _question_pool = None
+    _call_slots = threading.BoundedSemaphore(Config.GRADING_MAX_CONCURRENT_CALLS)
+    _async_call_slots = weakref.WeakKeyDictionary()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,153 @@
+# Streaming PDF rasterizer: pages become PIL images straight from pixmap samples
+import io
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import fitz
+from PIL import Image
+
+from app.config import Config
+from app.services.image_prep import prepare_pdf_page
+from app.services.page_preflight import inspect_page, pdf_page_array, should_send, upright
+
+
+# Lossless either way; level 1 is several times faster than PIL's default 6
+# for a few percent more bytes on scanned pages
+PNG_COMPRESS_LEVEL = 1
+
+
+def render_page(page: fitz.Page, zoom: float = None) -> Image.Image:
+    # One copy into PIL's pixel layout; samples_mv avoids a bytes copy first
+    matrix = fitz.Matrix(zoom or Config.OCR_PDF_ZOOM, zoom or Config.OCR_PDF_ZOOM)
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csRGB, alpha=False)
+    return Image.frombytes('RGB', (pix.width, pix.height), pix.samples_mv, 'raw', 'RGB', pix.stride)
+
+
+def iter_pdf_pages(pdf_data: bytes, pages: Optional[Sequence[int]] = None, zoom: float = None,
+                   render: Callable[[fitz.Page], Any] = None) -> Iterator[Any]:
+    """Yield pages of a PDF as RGB PIL images, one at a time.
+    
+    The image is filled from the pixmap's sample buffer (no PNG encode and
+    decode), and the pixmap is released before the next page is rendered, so
+    only one raw page is alive at a time however long the document is.
+    Each call opens its own document, so page groups can render in parallel.
+    `render(page)` replaces render_page for callers that need more than the
+    pixels, such as pdf_page_parts; the page is only valid during the call.
+    """
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_doc:
+        for page_num in pages if pages is not None else range(len(pdf_doc)):
+            page = pdf_doc.load_page(page_num)
+            yield render(page) if render else render_page(page, zoom)
+
+
+def encode_page(image: Image.Image) -> Dict[str, Any]:
+    # Inline PNG part for generate_content; the raw page can be freed right after
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return {'inline_data': {'mime_type': 'image/png', 'data': buffer.getvalue()}}
+
+
+def pdf_page_parts(pdf_data: bytes, pages: Optional[Sequence[int]] = None,
+                   stats: Optional[List[Dict[str, Any]]] = None,
+                   diagnostics: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Encoded request parts for the pages of a PDF.
+    
+    Pages are encoded as they are rendered, so peak memory is one raw page
+    plus the compressed pages, not every raw page of a 40-page class PDF.
+    With OCR_IMAGE_PREP each page is sized and encoded by image_prep, and its
+    stats are appended to `stats`. With OCR_PREFLIGHT each page is checked
+    first: blank and unreadable pages are left out, turned pages are turned
+    back, and the page diagnostics are appended to `diagnostics`.
+    """
+    def page_part(page: fitz.Page) -> Optional[Dict[str, Any]]:
+        rotation = 0
+        if Config.OCR_PREFLIGHT:
+            page_diagnostics = inspect_page(pdf_page_array(page), page.number + 1)
+            if diagnostics is not None:
+                diagnostics.append(page_diagnostics)
+            if not should_send(page_diagnostics):
+                return None
+            rotation = page_diagnostics['rotation']
+        
+        if Config.OCR_IMAGE_PREP:
+            part, page_stats = prepare_pdf_page(page, rotation)
+            if stats is not None:
+                stats.append(page_stats)
+            return part
+        return encode_page(upright(render_page(page), rotation))
+    
+    return [part for part in iter_pdf_pages(pdf_data, pages, render=page_part) if part is not None]
+
+
+def page_count(pdf_data: bytes) -> int:
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_doc:
+        return len(pdf_doc)
+
+
+# ============ Benchmark ============
+
+def _legacy_pages(pdf_data: bytes) -> list:
+    # The previous pipeline: PNG round trip through MuPDF and PIL, every page held
+    pdf_doc = fitz.open(stream=pdf_data, filetype="pdf")
+    images = []
+    for page_num in range(len(pdf_doc)):
+        pix = pdf_doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(Config.OCR_PDF_ZOOM, Config.OCR_PDF_ZOOM))
+        image = Image.open(io.BytesIO(pix.tobytes("png")))
+        image.load()
+        images.append(image)
+    pdf_doc.close()
+    return images
+
+
+def _peak_rss_mb() -> float:
+    import resource  # POSIX only; the benchmark is not run on Windows
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def benchmark(pdf_data: bytes, mode: str = 'stream') -> Dict[str, Any]:
+    """Rasterize and PNG-encode a PDF once with `mode` ('stream' or 'legacy'); pages/sec and peak RSS.
+    
+    Both modes turn every page into one PNG and nothing else: 'stream' is
+    iter_pdf_pages + encode_page, 'legacy' the PNG round trip plus the
+    request encode. Both encode at PNG_COMPRESS_LEVEL, so the difference is
+    the rendering path alone. Pre-flight and image prep are left out of both
+    (they are OCR_PREFLIGHT/OCR_IMAGE_PREP work, not rasterization). Peak
+    RSS is for the whole process, so compare modes in separate processes
+    (as the command line entry point does).
+    """
+    started = time.perf_counter()
+    if mode == 'legacy':
+        # ...and the PNG encode of each PIL page when building the request
+        images = _legacy_pages(pdf_data)
+        for image in images:
+            image.save(io.BytesIO(), format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+        pages = len(images)
+    else:
+        pages = 0
+        for image in iter_pdf_pages(pdf_data):
+            encode_page(image)
+            pages += 1
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': mode,
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 2) if elapsed else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1)
+    }
+
+
+if __name__ == '__main__':
+    # python -m app.services.pdf_raster exam.pdf [stream|legacy]
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m app.services.pdf_raster FILE.pdf [stream|legacy]")
+    if len(sys.argv) > 2:
+        with open(sys.argv[1], 'rb') as f:
+            print(benchmark(f.read(), sys.argv[2]))
+    else:
+        for run_mode in ('legacy', 'stream'):
+            subprocess.run([sys.executable, '-m', 'app.services.pdf_raster', sys.argv[1], run_mode], check=True)
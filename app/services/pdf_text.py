@@ -0,0 +1,258 @@
+# Text-layer extraction for born-digital PDFs: question structure without a vision call
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz
+
+from app.config import Config
+
+
+TEXT_LAYER_CONFIDENCE = 0.9  # Reported for pages parsed from their text layer
+FREEHAND_SEGMENTS = 12       # A drawn path with this many slanted or curved segments is pen ink, not print
+
+# Annotations that carry no student marks (links and widgets are listed apart)
+PASSIVE_ANNOTS = {fitz.PDF_ANNOT_POPUP, fitz.PDF_ANNOT_LINK}
+
+DIGITS = '0-9٠-٩'  # Western and Arabic-Indic digits
+
+QUESTION_RE = re.compile(
+    rf'^\s*(?:(?:Q|Question|Exercise|Exercice|السؤال|سؤال)\s*)?([{DIGITS}]{{1,3}}[a-z]?)\s*[.):\-–]\s*(\S.*)?$',
+    re.IGNORECASE)
+OPTION_RE = re.compile(r'^\s*\(?([A-Ha-h]|[أبجده])\s*[).]\s+(\S.*)$')
+INLINE_OPTION_RE = re.compile(r'(?:^|\s)\(?([A-H])[).]\s+(.+?)(?=\s+\(?[A-H][).]\s|$)')
+ANSWER_RE = re.compile(r'^\s*(?:correct answer|answer|ans|réponse|الإجابة|الجواب)\s*[:：]\s*(.+)$', re.IGNORECASE)
+ANSWER_KEY_RE = re.compile(r'\b(?:answer key|model answers|marking scheme|mark scheme|corrigé)\b|'
+                           r'نموذج الإجابة|الإجابة النموذجية|مفتاح الإجابة', re.IGNORECASE)
+SECTION_RE = re.compile(r'^\s*(?:section|part|partie|القسم|الجزء)\s+\S{1,10}\s*[:.\-–]?', re.IGNORECASE)
+POINTS_RE = re.compile(r'\(\s*(\d+(?:\.\d+)?)\s*(?:pts?|points?|marks?|نقاط|نقطة|درجات|درجة)\s*\)', re.IGNORECASE)
+BLANK_RE = re.compile(r'_{3,}|\.{6,}|…{2,}')
+TRUE_FALSE_RE = re.compile(r'\btrue\s*(?:/|or)\s*false\b|\bT\s*/\s*F\b|\bvrai\s*(?:/|ou)\s*faux\b|صح\s*(?:/|أو)\s*خطأ|صواب\s*(?:/|أو)\s*خطأ',
+                           re.IGNORECASE)
+COUNT_RE = re.compile(r'\b(?:state|list|name|give|mention|cite)\s+(\d+|two|three|four|five|six)\b', re.IGNORECASE)
+NUMBER_WORDS = {'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6}
+
+# Question wording -> type, first match wins (the same cues the OCR prompts describe)
+TYPE_CUES = [
+    ('definition', re.compile(r'^\s*(?:define|what is meant by|définir|définissez|عرّف|عرف)\b', re.IGNORECASE)),
+    ('compare_contrast', re.compile(r'\b(?:compare|contrast|differences? between|comparer|comparez|قارن)\b', re.IGNORECASE)),
+    ('ordering', re.compile(r'\b(?:arrange|put .{0,30} in (?:the correct )?order|ordonner|ordonnez|رتب)\b', re.IGNORECASE)),
+    ('math_equation', re.compile(r'\b(?:solve|calculate|simplify|résoudre|résolvez|calculer|calculez|احسب|حل)\b', re.IGNORECASE)),
+    ('open_ended', re.compile(r'\b(?:explain|why|discuss|analy[sz]e|justify|evaluate|expliquer|expliquez|pourquoi|'
+                              r'justifiez|اشرح|علل|لماذا|ناقش|فسر)\b', re.IGNORECASE)),
+]
+# Questions laid out in two dimensions or drawn: left to vision OCR
+VISION_CUES = re.compile(r'\b(?:match|label|diagram|figure|table below|complete the table|relier|reliez|associez|'
+                         r'légende|schéma|tableau|صل|وصل|الشكل|الرسم|الجدول)\b', re.IGNORECASE)
+METADATA_CUES = {
+    'duration': re.compile(r'(?:time|duration|durée|الزمن|المدة)\s*[:：]\s*(.+)', re.IGNORECASE),
+    'date': re.compile(r'(?:date|التاريخ)\s*[:：]\s*(.+)', re.IGNORECASE),
+    'subject': re.compile(r'(?:subject|matière|المادة)\s*[:：]\s*(.+)', re.IGNORECASE),
+    'grade_level': re.compile(r'(?:grade|class|classe|niveau|الصف)\s*[:：]\s*(.+)', re.IGNORECASE),
+}
+TOTAL_POINTS_RE = re.compile(r'total\s*(?:marks|points)?\s*[:=]?\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+NAME_FIELD_RE = re.compile(r'(?:student\s+)?name\s*[:_]|nom\s*[:_]|الاسم\s*[:_]', re.IGNORECASE)
+
+
+def _lines(page: fitz.Page) -> List[Tuple[str, float, int]]:
+    # (text, font size, block number) of each text line, in reading order
+    lines = []
+    for block in page.get_text('dict', sort=True)['blocks']:
+        for line in block.get('lines', []):
+            text = ''.join(span['text'] for span in line['spans']).strip()
+            if text:
+                lines.append((text, max(span['size'] for span in line['spans']), block['number']))
+    return lines
+
+
+def _answer_key(lines: List[Tuple[str, float, int]]) -> bool:
+    # Whether the header above the first question calls the document an answer key
+    for text, _, _ in lines:
+        if QUESTION_RE.match(text):
+            return False
+        if ANSWER_KEY_RE.search(text):
+            return True
+    return False
+
+
+def _freehand(path: Dict[str, Any]) -> bool:
+    # Stylus strokes flattened into the page: long runs of curves and slanted lines
+    # (printed boxes, rules and option circles are a few straight or four curved segments)
+    slanted = sum(1 for item in path['items']
+                  if item[0] == 'c' or (item[0] == 'l' and item[1].x != item[2].x and item[1].y != item[2].y))
+    return slanted >= FREEHAND_SEGMENTS
+
+
+def student_marks(page: fitz.Page) -> Optional[str]:
+    """What a digitally answered page carries beyond its printed text, or None.
+    
+    Answers written on a PDF do not reach the text layer: stylus ink and
+    typed notes are annotations, filled-in forms are widget values, and
+    flattened ink is drawn into the page. Pages carrying any of them need
+    vision OCR, which renders all of it.
+    """
+    if any(annot.type[0] not in PASSIVE_ANNOTS for annot in page.annots()):
+        return 'annotations'
+    for widget in page.widgets():
+        if (widget.field_type != fitz.PDF_WIDGET_TYPE_BUTTON
+                and widget.field_value not in (None, '', 'Off', False)):
+            return 'filled form fields'
+    if any(_freehand(path) for path in page.get_drawings()):
+        return 'drawn ink'
+    return None
+
+
+def text_layer_usable(page: fitz.Page) -> bool:
+    """Whether a page's text layer can stand in for vision OCR.
+    
+    It needs OCR_TEXT_LAYER_MIN_WORDS real words, almost no unmapped glyphs,
+    little of the page under images (a scan, even with an OCR'd text layer,
+    carries handwriting and drawings only the images show) and no answers
+    written on the PDF (see student_marks).
+    """
+    words = page.get_text('words')
+    if len(words) < Config.OCR_TEXT_LAYER_MIN_WORDS:
+        return False
+    text = ''.join(word[4] for word in words)
+    if text.count('�') > 0.02 * len(text):
+        return False
+    area = abs(page.rect)
+    covered = sum(abs(fitz.Rect(info['bbox']) & page.rect) for info in page.get_image_info())
+    return covered < Config.OCR_TEXT_LAYER_MAX_IMAGE_SHARE * area and student_marks(page) is None
+
+
+def _question_type(question: Dict[str, Any], text: str) -> str:
+    if question.get('options'):
+        return 'ordering' if TYPE_CUES[2][1].search(text) else 'multiple_choice'
+    if TRUE_FALSE_RE.search(text):
+        return 'true_false'
+    if BLANK_RE.search(text):
+        return 'fill_in_blank'
+    for question_type, cue in TYPE_CUES:
+        if cue.search(text):
+            return question_type
+    return 'short_answer'
+
+
+def _finish(question: Dict[str, Any], lines: List[str]) -> Dict[str, Any]:
+    # Question text, type and type-specific fields from its collected lines
+    text = ' '.join(lines).strip()
+    points = POINTS_RE.search(text)
+    if points:
+        question['points'] = float(points.group(1))
+        text = POINTS_RE.sub('', text).strip()
+    if not question.get('options'):
+        inline = dict(INLINE_OPTION_RE.findall(text))
+        if len(inline) >= 2:
+            question['options'] = inline
+            text = text[:INLINE_OPTION_RE.search(text).start()].strip()
+    
+    question['question_text'] = text
+    question['question_type'] = _question_type(question, text)
+    if question['question_type'] == 'fill_in_blank':
+        question['blanks'] = [''] * len(BLANK_RE.findall(text))
+    elif question['question_type'] == 'ordering':
+        question['ordering_items'] = [{'item_id': key, 'content': value} for key, value in question.pop('options').items()]
+    elif question['question_type'] == 'math_equation':
+        question['math_content'] = text
+    elif question['question_type'] == 'definition':
+        question['term_to_define'] = re.sub(r'^\s*\S+\s*', '', text).strip(' :?.')
+    elif question['question_type'] == 'open_ended':
+        question['answer_length'] = 'long' if re.search(r'\b(?:discuss|essay|in detail|ناقش)\b', text, re.IGNORECASE) else 'short'
+    
+    count = COUNT_RE.search(text)
+    if count:
+        value = count.group(1).lower()
+        question['expected_answer_count'] = int(value) if value.isdigit() else NUMBER_WORDS[value]
+    return question
+
+
+def parse_page(lines: List[Tuple[str, float, int]], first_page: bool = False,
+               answer_key: bool = False) -> Optional[Dict[str, Any]]:
+    """OCRResponse-shaped result for one page's text lines, or None if it needs vision OCR.
+    
+    Question starts, options and answer lines are found with the number and
+    option patterns the OCR prompts describe. Answer lines are read as
+    correct answers only in an `answer_key` document; elsewhere they, like
+    any text in its own block under a question (wrapped question text stays
+    in the question's block), are a student's typed answers, which only
+    vision OCR reads into student_answer. Lines before the first question
+    continue the previous page's last question (they are returned as a
+    numberless question, which the page merge joins back).
+    """
+    questions: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    current_lines: List[str] = []
+    current_block = None
+    preamble: List[Tuple[str, float, int]] = []
+    
+    for text, size, block in lines:
+        start = QUESTION_RE.match(text)
+        option = OPTION_RE.match(text) if current is not None else None
+        answer = ANSWER_RE.match(text) if current is not None else None
+        if start:
+            if current is not None:
+                questions.append(_finish(current, current_lines))
+            current = {'order': len(questions) + 1, 'question_number': start.group(1)}
+            current_lines = [start.group(2) or '']
+            current_block = block
+        elif answer:
+            if not answer_key:
+                return None
+            current['correct_answer'] = answer.group(1).strip()
+        elif option:
+            current.setdefault('options', {})[option.group(1)] = option.group(2).strip()
+        elif current is not None and SECTION_RE.match(text):
+            continue
+        elif current is not None:
+            if block != current_block or current.get('options'):
+                return None
+            current_lines.append(text)
+        else:
+            preamble.append((text, size, block))
+    if current is not None:
+        questions.append(_finish(current, current_lines))
+    
+    if any(VISION_CUES.search(q['question_text']) for q in questions):
+        return None
+    
+    metadata: Dict[str, Any] = {}
+    if first_page and preamble:
+        metadata['exam_title'] = max(preamble, key=lambda line: line[1])[0]
+    elif preamble and not first_page:
+        # Text above the first question number continues the previous page
+        questions.insert(0, _finish({'order': 0, 'question_number': ''}, [text for text, _, _ in preamble]))
+    
+    header = '\n'.join(text for text, _, _ in (preamble if first_page else []))
+    for field, cue in METADATA_CUES.items():
+        match = cue.search(header)
+        if match:
+            # Header fields often share a line: "Time: 1 hour    Total marks: 20"
+            metadata[field] = re.split(r'\s{2,}', match.group(1).strip())[0]
+    total = TOTAL_POINTS_RE.search(header)
+    if total:
+        metadata['total_points'] = float(total.group(1))
+    if first_page and NAME_FIELD_RE.search(header):
+        metadata['student_name_field'] = True
+    
+    return {
+        'extracted_text': '\n'.join(text for text, _, _ in lines),
+        'structured_data': {'questions': questions, 'metadata': metadata},
+        'confidence_score': TEXT_LAYER_CONFIDENCE,
+        'source': 'text_layer'
+    }
+
+
+def read_text_layer(pdf_data: bytes) -> List[Optional[Dict[str, Any]]]:
+    """Per page: the result parsed from the text layer, or None where vision OCR is needed.
+    
+    All None when the text layer yields no question at all (e.g. a form
+    whose questions are drawn as images): the document goes to vision OCR.
+    """
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_doc:
+        pages = [_lines(page) if text_layer_usable(page) else None for page in pdf_doc]
+    answer_key = bool(pages and pages[0] and _answer_key(pages[0]))
+    results = [parse_page(lines, index == 0, answer_key) if lines is not None else None
+               for index, lines in enumerate(pages)]
+    if not any(r and any(q['question_number'] for q in r['structured_data']['questions']) for r in results):
+        return [None] * len(results)
+    return results
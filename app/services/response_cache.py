@@ -0,0 +1,221 @@
+# Content-addressed cache for Gemini responses: in-memory LRU over a SQLite store
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from app.config import Config
+
+
+def _feed(digest: Any, part: Any) -> None:
+    # Hash every kind of content we send: text, raw bytes, images, dict parts
+    if part is None:
+        digest.update(b'\x00')
+    elif isinstance(part, bytes):
+        digest.update(b'b%d:' % len(part))
+        digest.update(part)
+    elif isinstance(part, str):
+        data = part.encode('utf-8')
+        digest.update(b's%d:' % len(data))
+        digest.update(data)
+    elif isinstance(part, (list, tuple)):
+        digest.update(b'l%d:' % len(part))
+        for item in part:
+            _feed(digest, item)
+    elif isinstance(part, dict):
+        digest.update(b'd%d:' % len(part))
+        for key in sorted(part, key=str):
+            _feed(digest, str(key))
+            _feed(digest, part[key])
+    elif hasattr(part, 'tobytes') and hasattr(part, 'size') and hasattr(part, 'mode'):
+        # PIL image: hash pixels, not the object
+        digest.update(f'i{part.mode}{part.size}:'.encode('utf-8'))
+        digest.update(part.tobytes())
+    else:
+        _feed(digest, json.dumps(part, sort_keys=True, default=str))
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """sha256 over namespace + model, prompt, image bytes, config, ..."""
+    digest = hashlib.sha256()
+    _feed(digest, namespace)
+    for part in parts:
+        _feed(digest, part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe two-level cache of response texts.
+
+    Entries expire after `ttl` seconds; the memory level holds at most
+    `memory_items` entries (LRU) and the disk level at most `max_bytes`
+    of payload, evicting the least recently used rows first.
+    """
+    
+    def __init__(self, path: str, memory_items: int = 512,
+                 max_bytes: int = 256 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                         'stores': 0, 'evictions': 0, 'expired': 0}
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,'
+            ' created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._db.commit()
+    
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+            
+            row = self._db.execute('SELECT value, created_at FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                self.counters['misses'] += 1
+                return None
+            
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._db.commit()
+                self.counters['expired'] += 1
+                self.counters['misses'] += 1
+                return None
+            
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self._remember(key, value, created_at)
+            self.counters['disk_hits'] += 1
+            return value
+    
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            self._db.commit()
+            self._remember(key, value, now)
+            self.counters['stores'] += 1
+            self._writes += 1
+            if self._writes % 64 == 0:
+                self._evict(now)
+    
+    async def get_async(self, key: str) -> Optional[str]:
+        # get from the event loop; the SQLite read runs in a worker thread
+        return await asyncio.to_thread(self.get, key)
+    
+    async def set_async(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self.set, key, value)
+    
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+    
+    def _evict(self, now: float) -> None:
+        # Drop expired rows, then least recently used rows until under max_bytes
+        expired = self._db.execute('DELETE FROM responses WHERE created_at < ?',
+                                   (now - self.ttl,)).rowcount
+        self.counters['expired'] += max(expired, 0)
+        
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total > self.max_bytes:
+            rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            self._db.executemany('DELETE FROM responses WHERE key = ?', doomed)
+            for (key,) in doomed:
+                self._memory.pop(key, None)
+            self.counters['evictions'] += len(doomed)
+        self._db.commit()
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = lookups - self.counters['misses']
+            return {
+                **self.counters,
+                'memory_entries': len(self._memory),
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+            }
+
+
+_lock = threading.Lock()
+_cache: Optional[ResponseCache] = None
+
+
+def _enabled_namespaces() -> Iterable[str]:
+    return {name.strip() for name in Config.RESPONSE_CACHE_SERVICES.split(',') if name.strip()}
+
+
+def get_response_cache(namespace: str) -> Optional[ResponseCache]:
+    """Return the shared cache if `namespace` opted in via RESPONSE_CACHE_SERVICES."""
+    enabled = _enabled_namespaces()
+    if namespace not in enabled and 'all' not in enabled:
+        return None
+    
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache(Config.RESPONSE_CACHE_PATH,
+                                       memory_items=Config.RESPONSE_CACHE_MEMORY_ITEMS,
+                                       max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+                                       ttl=Config.RESPONSE_CACHE_TTL_SECONDS)
+    return _cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _cache.stats() if _cache is not None else {'enabled': False}
+
+
+def _reset_after_fork():
+    # SQLite connections must not cross fork(); children reopen lazily
+    global _lock, _cache
+    _lock = threading.Lock()
+    _cache = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,13 +1,12 @@
 # Short answer grading service using AI multi-pass for consistency
 import json
 from typing import Dict, Any, List
-from collections import Counter
-from google import genai
 
-from app.config import Config
+from app.services.consensus import resolve_vote
+from app.services.grading_engine import Consensus, GradingSteps, MultiPassGrader
 
 
-class ShortAnswerGradingService:
+class ShortAnswerGradingService(MultiPassGrader):
     """
     Grade short answer questions (brief factual responses).
     Uses 3-pass grading with present/partial/absent status for consistency.
@@ -20,6 +19,7 @@ class ShortAnswerGradingService:
     """
     
     GRADING_PASSES = 3  # Number of AI passes for consistency
+    CACHE_NAMESPACE = 'short_answer'  # Opt-in key for RESPONSE_CACHE_SERVICES
     
     # Criteria for short answer grading
     CRITERIA = {
@@ -43,11 +43,6 @@ class ShortAnswerGradingService:
         'absent': 0.0
     }
     
-    def __init__(self):
-        if not Config.GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set")
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
-    
     def _build_grading_prompt(self, question: Dict[str, Any], student_answer: str) -> str:
         """Build prompt for grading a short answer question"""
         
@@ -101,52 +96,44 @@ Return ONLY valid JSON:
 }}"""
         return prompt
     
-    def _call_gemini(self, prompt: str) -> Dict[str, Any]:
-        """Call Gemini and parse JSON response"""
-        try:
-            response = self.client.models.generate_content(
-                model=Config.GEMINI_MODEL,
-                contents=[prompt],
-                config={"response_mime_type": "application/json"}
-            )
-            result = json.loads(response.text)
-            
-            # Ensure we have a dict with the expected structure
-            if isinstance(result, list):
-                # If Gemini returned a list, try to use first item or create default
-                result = result[0] if result and isinstance(result[0], dict) else {}
-            
-            if not isinstance(result, dict):
-                result = {}
-            
-            # Ensure all required criteria are present
-            for criterion in self.CRITERIA.keys():
-                if criterion not in result or not isinstance(result.get(criterion), dict):
-                    result[criterion] = {"status": "partial", "reason": "Could not parse AI response"}
-            
-            return result
-        except Exception as e:
-            return {
-                "factual_accuracy": {"status": "partial", "reason": f"Grading error: {e}"},
-                "completeness": {"status": "partial", "reason": f"Grading error: {e}"},
-                "terminology": {"status": "partial", "reason": f"Grading error: {e}"}
-            }
-    
-    def _calculate_mode_or_median(self, statuses: List[str]) -> tuple:
-        """Calculate mode, or median if all different. Returns (status, flag_for_review)"""
-        STATUS_ORDER = {'absent': 0, 'partial': 1, 'present': 2}
+    def _parse_response(self, text: str) -> Dict[str, Any]:
+        """Parse one JSON response into the expected criteria structure"""
+        result = json.loads(text)
         
-        counts = Counter(statuses)
-        most_common = counts.most_common()
+        # Ensure we have a dict with the expected structure
+        if isinstance(result, list):
+            # If Gemini returned a list, try to use first item or create default
+            result = result[0] if result and isinstance(result[0], dict) else {}
         
-        # If there's a clear mode (count > 1), use it
-        if most_common[0][1] > 1:
-            return most_common[0][0], False
+        if not isinstance(result, dict):
+            result = {}
         
-        # All 3 different - use median and flag for review
-        sorted_statuses = sorted(statuses, key=lambda s: STATUS_ORDER.get(s, 1))
-        median_status = sorted_statuses[len(sorted_statuses) // 2]
-        return median_status, True
+        # Ensure all required criteria are present
+        for criterion in self.CRITERIA.keys():
+            if criterion not in result or not isinstance(result.get(criterion), dict):
+                result[criterion] = {"status": "partial", "reason": "Could not parse AI response"}
+        
+        return result
+    
+    def _error_response(self, e: Exception) -> Dict[str, Any]:
+        return {
+            "factual_accuracy": {"status": "partial", "reason": f"Grading error: {e}"},
+            "completeness": {"status": "partial", "reason": f"Grading error: {e}"},
+            "terminology": {"status": "partial", "reason": f"Grading error: {e}"}
+        }
+    
+    def _collect_votes(self, pass_results: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Status of each criterion in every pass (invalid -> partial)"""
+        votes = {}
+        for criterion in self.CRITERIA.keys():
+            statuses = []
+            for pr in pass_results:
+                status = pr.get(criterion, {}).get('status', 'partial')
+                if status not in ['present', 'partial', 'absent']:
+                    status = 'partial'
+                statuses.append(status)
+            votes[criterion] = statuses
+        return votes
     
     def _calculate_scores(self, final_statuses: Dict[str, str], max_points: float) -> Dict[str, Any]:
         """Calculate final scores from statuses"""
@@ -172,7 +159,7 @@ Return ONLY valid JSON:
             'points_possible': max_points
         }
     
-    def grade_question(self, question: Dict[str, Any], student_answer: str) -> Dict[str, Any]:
+    def _grade_steps(self, question: Dict[str, Any], student_answer: str) -> GradingSteps:
         """Grade a single short answer question with multi-pass grading"""
         
         q_num = question.get('question_number', '')
@@ -187,27 +174,16 @@ Return ONLY valid JSON:
             result['grading_passes'] = 0
             return result
         
-        # Run multiple grading passes
+        # Run grading passes concurrently
         prompt = self._build_grading_prompt(question, student_answer)
-        pass_results = []
-        
-        for _ in range(self.GRADING_PASSES):
-            result = self._call_gemini(prompt)
-            pass_results.append(result)
+        pass_results = yield Consensus([prompt], self._collect_votes, self.GRADING_PASSES)
         
         # Calculate mode/median for each criterion
         final_statuses = {}
         high_variance_criteria = []
         
-        for criterion in self.CRITERIA.keys():
-            statuses = []
-            for pr in pass_results:
-                status = pr.get(criterion, {}).get('status', 'partial')
-                if status not in ['present', 'partial', 'absent']:
-                    status = 'partial'
-                statuses.append(status)
-            
-            final_status, flag_for_review = self._calculate_mode_or_median(statuses)
+        for criterion, statuses in self._collect_votes(pass_results).items():
+            final_status, flag_for_review = resolve_vote(statuses)
             
             if flag_for_review:
                 high_variance_criteria.append(criterion)
@@ -219,7 +195,7 @@ Return ONLY valid JSON:
         result['question_number'] = q_num
         result['question_type'] = 'short_answer'
         result['student_answer'] = student_answer[:200] + '...' if len(student_answer) > 200 else student_answer
-        result['grading_passes'] = self.GRADING_PASSES
+        result['grading_passes'] = len(pass_results)
         result['flag_for_review'] = len(high_variance_criteria) > 0
         result['high_variance_criteria'] = high_variance_criteria
         
@@ -230,22 +206,15 @@ Return ONLY valid JSON:
         
         return result
     
-    def grade_questions(self, questions: List[Dict[str, Any]], 
-                        student_answers: Dict[str, str]) -> Dict[str, Any]:
-        """Grade multiple short answer questions"""
+    def _summarize(self, questions: List[Dict[str, Any]], 
+                   results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Summarize the graded short answer questions"""
         
-        results = []
         total_earned = 0.0
         total_possible = 0.0
         flagged_count = 0
         
-        for q in questions:
-            q_num = str(q.get('question_number', ''))
-            student_answer = student_answers.get(q_num, '')
-            
-            result = self.grade_question(q, student_answer)
-            results.append(result)
-            
+        for result in results:
             if 'points_earned' in result:
                 total_earned += result['points_earned']
                 total_possible += result['points_possible']
@@ -256,6 +225,7 @@ Return ONLY valid JSON:
             'question_type': 'short_answer',
             'total_questions': len(questions),
             'grading_passes_per_question': self.GRADING_PASSES,
+            'grading_passes_used': sum(r.get('grading_passes', 0) for r in results),
             'criteria_used': list(self.CRITERIA.keys()),
             'flagged_for_review': flagged_count,
             'points_earned': round(total_earned, 2),
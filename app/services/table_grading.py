@@ -3,14 +3,15 @@
 from typing import Dict, Any, List
 
 from app.services.compare_contrast_grading import CompareContrastGradingService
+from app.services.gemini_client import get_service
 
 
 class TableGradingService:
     # Grade table questions using same checklist logic as compare/contrast
     
     def __init__(self):
-        # Reuse the compare_contrast service internally
-        self.cc_service = CompareContrastGradingService()
+        # Reuse the shared compare_contrast service internally
+        self.cc_service = get_service(CompareContrastGradingService)
     
     def grade_question(self, question: Dict[str, Any], 
                        student_answer: str) -> Dict[str, Any]:
@@ -20,9 +21,22 @@ class TableGradingService:
             result['question_type'] = 'table'
         return result
     
+    async def grade_question_async(self, question: Dict[str, Any], 
+                                   student_answer: str) -> Dict[str, Any]:
+        result = await self.cc_service.grade_question_async(question, student_answer)
+        if 'question_type' in result:
+            result['question_type'] = 'table'
+        return result
+    
     def grade_questions(self, questions: List[Dict[str, Any]], 
                         student_answers: Dict[str, str]) -> Dict[str, Any]:
         # Grade multiple table questions
         result = self.cc_service.grade_questions(questions, student_answers)
         result['question_type'] = 'table'
         return result
+    
+    async def grade_questions_async(self, questions: List[Dict[str, Any]], 
+                                    student_answers: Dict[str, str]) -> Dict[str, Any]:
+        result = await self.cc_service.grade_questions_async(questions, student_answers)
+        result['question_type'] = 'table'
+        return result
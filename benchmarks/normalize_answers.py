@@ -0,0 +1,105 @@
+# Micro-benchmark: answer normalization and matching, before and after the compiled normalizer
+#
+#     python -m benchmarks.normalize_answers [--answers 1000000] [--seed 7]
+#
+# Grades a synthetic set of (student answer, correct answer) pairs shaped like
+# class uploads: option letters and numbers, Arabic letters, true/false words
+# in three languages, and short words with stray punctuation and spacing.
+import argparse
+import random
+import re
+import time
+from typing import Any, List, Tuple
+
+from app.services.grading import GradingService, _normalize_text
+
+
+# ============ Previous implementation (for comparison) ============
+
+def legacy_normalize(answer: Any) -> str:
+    if answer is None:
+        return ""
+    answer_str = str(answer).strip().lower()
+    answer_str = re.sub(r'[.,:;!?\-_()[\]{}]', '', answer_str)
+    answer_str = re.sub(r'\s+', ' ', answer_str).strip()
+    for arabic, latin in GradingService.ARABIC_LETTERS.items():
+        answer_str = answer_str.replace(arabic, latin)
+    if len(answer_str) == 1 and answer_str in GradingService.NUMBER_TO_LETTER:
+        return GradingService.NUMBER_TO_LETTER[answer_str]
+    return answer_str
+
+
+def legacy_match(student: Any, correct: Any) -> bool:
+    if student is None or correct is None:
+        return False
+    norm_student = legacy_normalize(student)
+    norm_correct = legacy_normalize(correct)
+    if not norm_student or not norm_correct:
+        return False
+    if norm_student == norm_correct:
+        return True
+    if len(norm_student) == 1 and len(norm_correct) == 1:
+        s = GradingService.NUMBER_TO_LETTER.get(norm_student, norm_student)
+        c = GradingService.NUMBER_TO_LETTER.get(norm_correct, norm_correct)
+        return s == c
+    true_vals = {'true', 't', 'yes', 'y', '1', 'صحيح', 'صح', 'vrai', 'oui'}
+    false_vals = {'false', 'f', 'no', 'n', '0', 'خطأ', 'خاطئ', 'faux', 'non'}
+    if norm_student in true_vals and norm_correct in true_vals:
+        return True
+    if norm_student in false_vals and norm_correct in false_vals:
+        return True
+    return False
+
+
+# ============ Synthetic answers ============
+
+OPTIONS = ['A', 'B', 'C', 'D', 'a', 'b', 'c', 'd', '1', '2', '3', '4', 'أ', 'ب', 'ج', 'د', '(b)', 'C.', ' d ']
+BOOLEANS = ['True', 'False', 'true', 'F', 'T', 'yes', 'No', 'صح', 'خطأ', 'Vrai', 'faux', True, False]
+WORDS = ['photosynthesis', 'Mitochondria', 'the nucleus', 'Paris', 'H2O', 'oxygen!', 'Newton', 'la cellule',
+         'الخلية', 'carbon dioxide', 'gravity', 'Ribosome.', 'evaporation', '  water   cycle ']
+
+
+def synthetic_pairs(count: int, seed: int) -> List[Tuple[Any, Any]]:
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        pool = rng.choices((OPTIONS, BOOLEANS, WORDS), weights=(6, 3, 1))[0]
+        correct = rng.choice(pool)
+        student = correct if rng.random() < 0.6 else rng.choice(pool)
+        if rng.random() < 0.02:
+            student = None
+        elif rng.random() < 0.05:
+            student = f'{student} ({rng.randint(0, 999)})'  # scribbled, mostly unique answers
+        pairs.append((student, correct))
+    return pairs
+
+
+def _rate(label: str, match, pairs: List[Tuple[Any, Any]]) -> Tuple[float, List[bool]]:
+    started = time.perf_counter()
+    results = [match(student, correct) for student, correct in pairs]
+    seconds = time.perf_counter() - started
+    rate = len(pairs) / seconds
+    print(f"{label:<10} {seconds:7.2f} s  {rate:12,.0f} answers/s")
+    return rate, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--answers', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    
+    pairs = synthetic_pairs(args.answers, args.seed)
+    print(f"{len(pairs):,} answer pairs")
+    before, expected = _rate('before', legacy_match, pairs)
+    _normalize_text.cache_clear()
+    after, results = _rate('after', GradingService.answers_match, pairs)
+    
+    mismatches = sum(a != b for a, b in zip(expected, results))
+    print(f"speed-up   {after / before:.1f}x  ({mismatches} results differ)")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+
+from app.config import Config
+from app.services import candidate_sampling
+from app.services.candidate_sampling import sample_passes, sample_passes_async
+from app.services.consensus import run_until_consensus
+from app.services.llm_backend import BackendError, SyntheticBackend
+
+
+VERDICTS = ['full', 'partial', 'full']
+
+
+def verdict_responder(contents, config, index):
+    return json.dumps({'status': VERDICTS[index % len(VERDICTS)]})
+
+
+class Grader:
+    """The hooks sample_passes needs from a grading service."""
+    
+    CACHE_NAMESPACE = 'test_grader'
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def _parse_response(self, text):
+        return json.loads(text)
+    
+    def _error_response(self, error):
+        return {'status': 'absent', 'error': str(error)}
+
+
+@pytest.fixture(autouse=True)
+def candidate_sampling_on(monkeypatch):
+    monkeypatch.setattr(Config, 'GRADING_CANDIDATE_SAMPLING', True)
+    monkeypatch.setattr(Config, 'GRADING_EARLY_STOP', False)
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE_SERVICES', '')
+    monkeypatch.setattr(candidate_sampling, '_unsupported_models', set())
+
+
+def test_candidates_feed_the_vote_from_one_request():
+    backend = SyntheticBackend(responder=verdict_responder)
+    
+    results = run_until_consensus(lambda start, n: sample_passes(Grader(backend), ['q'], n, start),
+                                  lambda passes: {'q': [p['status'] for p in passes]}, 3)
+    
+    assert [r['status'] for r in results] == VERDICTS
+    assert backend.requests == 1
+    assert backend.candidates_returned == 3
+
+
+def test_backend_without_candidates_gets_separate_calls():
+    backend = SyntheticBackend(responder=verdict_responder, supports_candidates=False)
+    
+    results = sample_passes(Grader(backend), ['q'], 3)
+    
+    assert len(results) == 3
+    assert backend.requests == 3
+    assert backend.candidates_returned == 3
+
+
+def test_rejected_candidate_count_falls_back_and_is_remembered():
+    class RejectingBackend(SyntheticBackend):
+        # Claims support, like a live model whose limits are only known from its errors
+        def _start(self, config):
+            if int(config.get('candidate_count') or 1) > 1:
+                with self._lock:
+                    self.requests += 1
+                raise BackendError(400, "INVALID_ARGUMENT: candidate_count is not supported for this model")
+            return super()._start(config)
+    
+    backend = RejectingBackend(responder=verdict_responder)
+    
+    assert len(sample_passes(Grader(backend), ['q'], 3)) == 3
+    assert backend.requests == 1 + 3
+    assert len(sample_passes(Grader(backend), ['q'], 3)) == 3
+    assert backend.requests == 1 + 3 + 3
+
+
+def test_other_errors_do_not_disable_candidates():
+    error = BackendError(503, "UNAVAILABLE: too many candidates in flight")
+    
+    assert not candidate_sampling._rejected_candidates(Config.GEMINI_MODEL, error)
+    assert Config.GEMINI_MODEL not in candidate_sampling._unsupported_models
+
+
+def test_async_candidates_from_one_request():
+    backend = SyntheticBackend(responder=verdict_responder)
+    
+    results = asyncio.run(sample_passes_async(Grader(backend), ['q'], 3))
+    
+    assert [r['status'] for r in results] == VERDICTS
+    assert backend.requests == 1
@@ -0,0 +1,82 @@
+import glob
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app.services.exam_templates import EmptyTemplate, TemplateRegistry, fingerprint_document
+
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'app', 'static', 'samples', '*.png')))
+STRUCTURE = {'questions': [{'order': 1, 'question_number': '1', 'question_text': 'Q', 'question_type': 'open_ended'}]}
+
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def samples():
+    # One entry per distinct page: some samples are byte-for-byte copies under two names
+    pages = {}
+    for path in SAMPLES:
+        with open(path, 'rb') as f:
+            fingerprints = fingerprint_document(f.read(), False)
+        if not any(np.array_equal(fingerprints[0]['layout'], other[0]['layout']) for other in pages.values()):
+            pages[os.path.basename(path)] = fingerprints
+    return pages
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return TemplateRegistry(str(tmp_path / 'templates.sqlite3'))
+
+
+def test_samples_do_not_match_each_other(registry, samples):
+    ids = {name: registry.register(name, 'english', fingerprints, STRUCTURE)['id']
+           for name, fingerprints in samples.items()}
+    cross = {}
+    for name, fingerprints in samples.items():
+        registry.delete(ids[name])
+        match = registry.match(fingerprints)
+        if match is not None:
+            cross[name] = (match['name'], match['overlap'], match['explained'])
+        ids[name] = registry.register(name, 'english', fingerprints, STRUCTURE)['id']
+    assert cross == {}
+
+
+def test_sample_matches_its_own_template(registry, samples):
+    for name, fingerprints in samples.items():
+        registry.register(name, 'english', fingerprints, STRUCTURE)
+    for name, fingerprints in samples.items():
+        match = registry.match(fingerprints)
+        assert match is not None and match['name'] == name
+
+
+def test_filled_in_copy_matches(registry, samples):
+    path = next(p for p in SAMPLES if os.path.basename(p).startswith('sample_true_false'))
+    blank = Image.open(path).convert('L')
+    registry.register('true_false', 'english', fingerprint_document(_png(blank), False), STRUCTURE)
+    
+    # Shifted a few millimetres, with a handful of pen strokes in the margins and answer spaces
+    copy = Image.new('L', blank.size, int(np.median(np.asarray(blank))))
+    copy.paste(blank, (9, 6))
+    pen = ImageDraw.Draw(copy)
+    rng = np.random.default_rng(0)
+    for _ in range(8):
+        x, y = int(rng.integers(0, blank.width - 150)), int(rng.integers(0, blank.height - 20))
+        pen.line([(x + 10 * i, y + int(rng.integers(0, 12))) for i in range(12)], fill=60, width=2)
+    
+    match = registry.match(fingerprint_document(_png(copy), False))
+    assert match is not None and match['name'] == 'true_false'
+
+
+def test_register_rejects_results_without_questions(registry, samples):
+    fingerprints = next(iter(samples.values()))
+    with pytest.raises(EmptyTemplate):
+        registry.register('empty', 'english', fingerprints, {'questions': [], 'metadata': {}})
+    assert registry.is_empty()
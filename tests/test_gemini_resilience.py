@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.config import Config
+from app.services import gemini_resilience
+from app.services.gemini_resilience import DeadlineExceeded, _ResilientAsyncModels
+
+
+class FlakyAsyncModels:
+    """Async models whose first calls raise the given errors, then answer 'ok'."""
+    
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+    
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class SlowAsyncModels:
+    def __init__(self):
+        self.calls = 0
+    
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(10)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(Config, 'GEMINI_HEDGE', False)
+    monkeypatch.setattr(Config, 'GEMINI_RETRY_ATTEMPTS', 3)
+    monkeypatch.setattr(Config, 'GEMINI_RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(Config, 'GEMINI_CALL_DEADLINE_SECONDS', 5)
+
+
+def test_attempt_timeout_is_retried():
+    models = FlakyAsyncModels(TimeoutError('timeout'))
+    before = gemini_resilience.metrics.snapshot()
+    
+    response = asyncio.run(_ResilientAsyncModels(models).generate_content(model='m', contents='hi'))
+    
+    after = gemini_resilience.metrics.snapshot()
+    assert response == 'ok'
+    assert models.calls == 2
+    assert after['retries'] - before['retries'] == 1
+    assert after['deadline_exceeded'] == before['deadline_exceeded']
+
+
+def test_call_deadline_raises_deadline_exceeded(monkeypatch):
+    monkeypatch.setattr(Config, 'GEMINI_CALL_DEADLINE_SECONDS', 0.05)
+    models = SlowAsyncModels()
+    before = gemini_resilience.metrics.snapshot()
+    
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(_ResilientAsyncModels(models).generate_content(model='m', contents='hi'))
+    
+    after = gemini_resilience.metrics.snapshot()
+    assert models.calls == 1
+    assert after['deadline_exceeded'] - before['deadline_exceeded'] == 1
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from app.config import Config
+from app.services.gemini_scheduler import (
+    BULK, INTERACTIVE, GeminiScheduler, ScheduledClient, TokenBucket, priority
+)
+from app.services.llm_backend import SyntheticBackend
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(Config, 'GEMINI_SCHEDULER_POLL_SECONDS', 0.005)
+
+
+def scheduled(scheduler, **backend_options):
+    backend = SyntheticBackend(**backend_options)
+    return backend, ScheduledClient(backend, scheduler)
+
+
+async def call(client, level, contents='hi'):
+    with priority(level):
+        await client.aio.models.generate_content(model='m', contents=contents)
+
+
+def test_bucket_refills_at_its_per_minute_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.take(60)
+    
+    assert bucket.wait_time(1, now=now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now=now + 1) == 0.0
+    # Never past one minute of burst
+    assert bucket.wait_time(0, now=now + 3600) == 0.0
+    assert bucket.level == 60
+
+
+def test_large_requests_wait_for_a_full_token_bucket():
+    bucket = TokenBucket(1000)
+    now = bucket.updated
+    bucket.take(400)
+    
+    assert bucket.wait_time(5000, now=now) == pytest.approx(400 / (1000 / 60))
+
+
+def test_disabled_buckets_never_wait():
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 6)
+    
+    assert bucket.wait_time(10 ** 6) == 0.0
+
+
+def test_requests_wait_for_the_rpm_budget():
+    scheduler = GeminiScheduler(rpm=600, tpm=0, reserve=0.0)
+    backend, client = scheduled(scheduler)
+    scheduler.requests.level = 0
+    
+    async def timed():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(call(client, INTERACTIVE) for _ in range(3)))
+        return loop.time() - started
+    
+    # 600 rpm refills one request every 0.1 s
+    assert asyncio.run(timed()) >= 0.25
+    assert backend.requests == 3
+
+
+def test_interactive_requests_go_before_queued_bulk():
+    scheduler = GeminiScheduler(rpm=600, tpm=0, reserve=0.0)
+    _, client = scheduled(scheduler)
+    scheduler.requests.level = 0
+    order = []
+    
+    async def tracked(level, name):
+        await call(client, level)
+        order.append(name)
+    
+    async def run():
+        bulk = [asyncio.create_task(tracked(BULK, f'bulk{i}')) for i in range(2)]
+        await asyncio.sleep(0.01)  # bulk is queued first
+        interactive = asyncio.create_task(tracked(INTERACTIVE, 'interactive'))
+        await asyncio.gather(*bulk, interactive)
+    
+    asyncio.run(run())
+    
+    assert order[0] == 'interactive'
+
+
+def test_bulk_leaves_the_interactive_reserve():
+    scheduler = GeminiScheduler(rpm=600, tpm=0, reserve=0.5)
+    backend, client = scheduled(scheduler)
+    scheduler.requests.level = 250  # below the 300 requests bulk must leave
+    
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(call(client, BULK), 0.05)
+        await asyncio.wait_for(call(client, INTERACTIVE), 0.05)
+    
+    asyncio.run(run())
+    
+    assert backend.requests == 1
+    assert scheduler.stats()['granted'] == {INTERACTIVE: 1, BULK: 0}
+
+
+def test_stats_report_queue_depth_and_usage():
+    scheduler = GeminiScheduler(rpm=600, tpm=0, reserve=0.0)
+    _, client = scheduled(scheduler)
+    scheduler.requests.level = 0
+    
+    async def run():
+        tasks = [asyncio.create_task(call(client, BULK)) for _ in range(3)]
+        await asyncio.sleep(0.02)
+        queued = scheduler.stats()
+        await asyncio.gather(*tasks)
+        return queued
+    
+    queued = asyncio.run(run())
+    done = scheduler.stats()
+    
+    assert queued['queue_depth'] == {INTERACTIVE: 0, BULK: 3}
+    assert done['queue_depth'] == {INTERACTIVE: 0, BULK: 0}
+    assert done['max_queue_depth'][BULK] == 3
+    assert done['granted'][BULK] == 3
+    assert done['avg_wait_ms'][BULK] > 0
+    assert done['in_flight'] == 0
+
+
+def test_tokens_are_settled_with_actual_usage():
+    scheduler = GeminiScheduler(rpm=0, tpm=100000, reserve=0.0)
+    _, client = scheduled(scheduler, responder=lambda contents, config, index: 'y' * 4000)
+    contents = 'x' * 4000  # charged up front at an estimated 1000 tokens
+    
+    asyncio.run(call(client, INTERACTIVE, contents))
+    
+    # The response reports 1000 input + 1000 output tokens; the extra 1000 is charged on settle
+    assert scheduler.tokens.level == pytest.approx(100000 - 2000, abs=5)
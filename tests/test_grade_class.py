@@ -0,0 +1,31 @@
+import pytest
+
+from app import create_app
+
+
+QUESTIONS = [{'question_number': 1, 'correct_answer': 'A', 'points': 1}]
+
+
+@pytest.fixture(scope='module')
+def client():
+    return create_app().test_client()
+
+
+def post_rows(client, student_ids):
+    return client.post('/api/grading/class', json={
+        'questions': QUESTIONS, 'question_type': 'multiple_choice',
+        'answer_rows': [['A'], ['B']], 'student_ids': student_ids})
+
+
+def test_student_ids_must_match_rows(client):
+    response = post_rows(client, ['s1'])
+    
+    assert response.status_code == 400
+    assert 'student_ids' in response.get_json()['error']
+
+
+def test_student_ids_label_rows(client):
+    response = post_rows(client, ['s1', 's2'])
+    
+    assert response.status_code == 200
+    assert response.get_json()['data']['student_count'] == 2
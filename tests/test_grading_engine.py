@@ -0,0 +1,13 @@
+import pytest
+
+from app.services.grading_engine import MultiPassGrader
+
+
+def test_grader_without_summarize_cannot_be_built():
+    class Incomplete(MultiPassGrader):
+        def _grade_steps(self, question, student_answer):
+            return {}
+            yield
+    
+    with pytest.raises(TypeError):
+        Incomplete()
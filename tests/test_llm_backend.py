@@ -0,0 +1,11 @@
+import pytest
+
+from app.services.llm_backend import LLMBackend
+
+
+def test_backend_without_generate_cannot_be_built():
+    class Incomplete(LLMBackend):
+        name = 'incomplete'
+    
+    with pytest.raises(TypeError):
+        Incomplete()
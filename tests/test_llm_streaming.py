@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from app.config import Config
+from app.services.gemini_resilience import ResilientClient
+from app.services.gemini_scheduler import GeminiScheduler, ScheduledClient
+from app.services.llm_backend import SyntheticBackend
+
+
+TEXT = 'x' * (SyntheticBackend.STREAM_CHUNK * 5)
+
+
+@pytest.fixture(autouse=True)
+def no_hedging(monkeypatch):
+    monkeypatch.setattr(Config, 'GEMINI_HEDGE', False)
+
+
+def build_client():
+    backend = SyntheticBackend(responder=lambda contents, config, index: TEXT, latency_ms=200)
+    return ResilientClient(ScheduledClient(backend, GeminiScheduler(0, 0, 0.0)))
+
+
+async def stream_with_ticker(client):
+    ticks = 0
+    
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    
+    task = asyncio.create_task(ticker())
+    try:
+        chunks = [chunk.text async for chunk in await client.aio.models.generate_content_stream(
+            model='m', contents='hi', config={})]
+    finally:
+        task.cancel()
+    return chunks, ticks
+
+
+def test_async_stream_does_not_block_event_loop():
+    chunks, ticks = asyncio.run(stream_with_ticker(build_client()))
+    
+    assert len(chunks) == 5
+    assert ''.join(chunks) == TEXT
+    assert ticks >= 5
+
+
+def test_async_stream_of_plain_backend():
+    backend = SyntheticBackend(responder=lambda contents, config, index: TEXT)
+    
+    async def collect():
+        return [chunk.text async for chunk in await backend.aio.models.generate_content_stream(
+            model='m', contents='hi')]
+    
+    assert ''.join(asyncio.run(collect())) == TEXT
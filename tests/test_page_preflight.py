@@ -0,0 +1,76 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from app.config import Config
+from app.services.page_preflight import REJECTED, SKIPPED, inspect_page, should_send, thumbnail_array
+
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'app', 'static', 'samples', '*.png')))
+
+
+@pytest.fixture(scope='module')
+def sample_pages():
+    return {os.path.basename(path): thumbnail_array(Image.open(path).convert('RGB')) for path in SAMPLES}
+
+
+@pytest.fixture(autouse=True)
+def auto_rotate(monkeypatch):
+    monkeypatch.setattr(Config, 'OCR_PREFLIGHT_AUTO_ROTATE', True)
+
+
+def test_samples_are_bundled(sample_pages):
+    assert len(sample_pages) >= 60
+
+
+def test_upright_samples_are_not_rotated(sample_pages):
+    turned = {name: inspect_page(gray)['rotation'] for name, gray in sample_pages.items()}
+    assert {name: rotation for name, rotation in turned.items() if rotation} == {}
+
+
+@pytest.mark.parametrize('turn, fix', [(-1, 270), (2, 180), (1, 90)])
+def test_turned_samples_are_turned_back_never_the_wrong_way(sample_pages, turn, fix):
+    # np.rot90 with k=-1 turns the page 90 degrees clockwise, so 270 more make it upright
+    rotations = {name: inspect_page(np.ascontiguousarray(np.rot90(gray, turn)))['rotation']
+                 for name, gray in sample_pages.items()}
+    assert {name: rotation for name, rotation in rotations.items() if rotation not in (0, fix)} == {}
+    # Pages without a clear cue are left alone, but most text pages have one
+    fixed = sum(rotation == fix for rotation in rotations.values())
+    assert fixed >= 0.35 * len(sample_pages)
+
+
+def _filtered(gray, image_filter):
+    return np.asarray(image_filter(Image.fromarray(gray)))
+
+
+def test_slightly_blurred_pages_are_sent(sample_pages):
+    # Text blurred by two pixels is still readable
+    blurred = {name: inspect_page(_filtered(gray, lambda image: image.filter(ImageFilter.GaussianBlur(2))))
+               for name, gray in sample_pages.items()}
+    assert {name: d['reason'] for name, d in blurred.items() if not should_send(d)} == {}
+
+
+def test_blurred_pages_are_rejected(sample_pages):
+    for gray in list(sample_pages.values())[::4]:
+        diagnostics = inspect_page(_filtered(gray, lambda image: image.filter(ImageFilter.GaussianBlur(8))))
+        assert diagnostics['action'] == REJECTED
+        assert diagnostics['reason'].startswith('too blurred')
+
+
+def test_washed_out_pages_are_rejected(sample_pages):
+    washed = [inspect_page(_filtered(gray, lambda image: ImageEnhance.Contrast(image).enhance(0.1)))
+              for gray in list(sample_pages.values())[::4]]
+    rejected = [d for d in washed if d['action'] == REJECTED]
+    # A page faded all the way to blank is skipped instead
+    assert not any(should_send(d) for d in washed)
+    assert len(rejected) >= len(washed) - 1
+    assert all(d['reason'].startswith('contrast too low') for d in rejected)
+
+
+def test_blank_page_is_skipped():
+    diagnostics = inspect_page(np.full((1024, 768), 245, dtype=np.uint8))
+    assert diagnostics['action'] == SKIPPED
+    assert diagnostics['rotation'] == 0
@@ -0,0 +1,38 @@
+import fitz
+import pytest
+
+from app.config import Config
+from app.services.pdf_raster import iter_pdf_pages, pdf_page_parts
+
+
+def _pdf(pages) -> bytes:
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for number, line in enumerate(lines):
+            page.insert_text((72, 72 + 24 * number), line, fontsize=11)
+    return doc.tobytes()
+
+
+EXAM = ['1. Which planet is closest to the Sun? ' * 2] * 20
+
+
+@pytest.fixture(autouse=True)
+def plain_pages(monkeypatch):
+    monkeypatch.setattr(Config, 'OCR_IMAGE_PREP', False)
+    monkeypatch.setattr(Config, 'OCR_PREFLIGHT', True)
+
+
+def test_iter_pdf_pages_yields_requested_pages():
+    images = list(iter_pdf_pages(_pdf([EXAM, EXAM, EXAM]), pages=[0, 2], zoom=1.0))
+    
+    assert [image.size for image in images] == [(595, 842), (595, 842)]  # A4 at 72 dpi
+
+
+def test_page_parts_leave_out_blank_pages():
+    diagnostics = []
+    parts = pdf_page_parts(_pdf([EXAM, [], EXAM]), diagnostics=diagnostics)
+    
+    assert len(parts) == 2
+    assert all(part['inline_data']['data'].startswith(b'\x89PNG') for part in parts)
+    assert [page['page'] for page in diagnostics] == [1, 2, 3]
@@ -0,0 +1,112 @@
+import fitz
+import pytest
+
+from app.services.pdf_text import read_text_layer, student_marks, text_layer_usable
+
+
+LINES = [
+    'Science Quiz',
+    'Time: 30 minutes',
+    '1. Explain why the sky looks blue during the day. (4 points)',
+    '2. Which planet is closest to the Sun?',
+    'A) Venus',
+    'B) Mercury',
+    'C) Mars',
+    '3. Water boils at ______ degrees Celsius at sea level.',
+]
+
+
+def _exam(mark=None, lines=LINES) -> fitz.Document:
+    doc = fitz.open()
+    page = doc.new_page()
+    for number, line in enumerate(lines):
+        page.insert_text((72, 72 + 24 * number), line, fontsize=11)
+    # Printed answer circles next to the options: four curves each
+    for number in range(4, 7):
+        page.draw_circle((60, 68 + 24 * number), 4)
+    if mark is not None:
+        mark(page)
+    return doc
+
+
+def _ink(page):
+    page.add_ink_annot([[(80 + 6 * i, 300 + (i % 3) * 4) for i in range(20)]])
+
+
+def _typed_note(page):
+    page.add_freetext_annot(fitz.Rect(72, 320, 300, 340), 'Because of Rayleigh scattering')
+
+
+def _filled_field(page, value='Mercury'):
+    widget = fitz.Widget()
+    widget.field_name = 'q2'
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.rect = fitz.Rect(300, 110, 450, 125)
+    widget.field_value = value
+    page.add_widget(widget)
+
+
+def _flattened_stroke(page):
+    shape = page.new_shape()
+    shape.draw_polyline([(80 + 5 * i, 400 + (i % 4) * 3) for i in range(25)])
+    shape.finish(closePath=False)
+    shape.commit()
+
+
+def test_printed_exam_is_read_from_its_text_layer():
+    doc = _exam()
+    assert student_marks(doc[0]) is None
+    assert text_layer_usable(doc[0])
+    result = read_text_layer(doc.tobytes())[0]
+    assert [q['question_number'] for q in result['structured_data']['questions']] == ['1', '2', '3']
+
+
+def test_unfilled_form_field_keeps_the_text_layer():
+    doc = _exam(lambda page: _filled_field(page, ''))
+    assert student_marks(doc[0]) is None
+
+
+@pytest.mark.parametrize('mark, reason', [
+    (_ink, 'annotations'),
+    (_typed_note, 'annotations'),
+    (_filled_field, 'filled form fields'),
+    (_flattened_stroke, 'drawn ink'),
+])
+def test_answered_pdf_goes_to_vision_ocr(mark, reason):
+    doc = _exam(mark)
+    assert student_marks(doc[0]) == reason
+    assert not text_layer_usable(doc[0])
+    assert read_text_layer(doc.tobytes()) == [None]
+
+
+def _with(after: str, *extra: str):
+    # LINES with extra lines typed under the line starting with `after`
+    index = next(i for i, line in enumerate(LINES) if line.startswith(after)) + 1
+    return LINES[:index] + list(extra) + LINES[index:]
+
+
+@pytest.mark.parametrize('lines', [
+    _with('1.', 'Sunlight scatters off the air, and blue light scatters the most.'),
+    _with('C)', 'Mercury'),
+    _with('C)', 'Answer: B'),
+])
+def test_typed_answers_go_to_vision_ocr(lines):
+    # A copy answered in a word processor: the answers are part of the text layer
+    doc = _exam(lines=lines)
+    assert text_layer_usable(doc[0])
+    assert read_text_layer(doc.tobytes()) == [None]
+
+
+def test_answer_key_lines_are_correct_answers():
+    doc = _exam(lines=['Science Quiz - Answer Key'] + _with('C)', 'Answer: B')[1:])
+    questions = read_text_layer(doc.tobytes())[0]['structured_data']['questions']
+    assert questions[1]['correct_answer'] == 'B'
+    assert 'student_answer' not in questions[1]
+
+
+def test_wrapped_question_text_stays_on_the_text_layer():
+    doc = _exam()
+    doc[0].insert_textbox(fitz.Rect(72, 300, 250, 400), '4. Name two gases found in the air we breathe every day.',
+                          fontsize=11)
+    questions = read_text_layer(doc.tobytes())[0]['structured_data']['questions']
+    assert questions[-1]['question_text'] == 'Name two gases found in the air we breathe every day.'
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.config import Config
+from app.services import response_cache
+from app.services.response_cache import ResponseCache, get_response_cache, make_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return ResponseCache(str(tmp_path / 'cache.db'), memory_items=2, ttl=60)
+
+
+def test_memory_then_sqlite_lookup(cache):
+    for name in ('a', 'b', 'c'):
+        cache.set(name, name.upper())
+    
+    assert cache.get('c') == 'C'
+    assert cache.counters['memory_hits'] == 1
+    # 'a' fell out of the two-item LRU but is still on disk, and comes back into memory
+    assert cache.get('a') == 'A'
+    assert cache.counters['disk_hits'] == 1
+    assert cache.get('a') == 'A'
+    assert cache.counters['memory_hits'] == 2
+    assert cache.get('missing') is None
+    assert cache.counters['misses'] == 1
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.set('a', 'A')
+    clock.now += 59
+    assert cache.get('a') == 'A'
+    
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.counters['expired'] == 1
+    assert cache.get('a') is None  # the stale row is gone from disk too
+
+
+def test_disk_is_kept_under_max_bytes(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.db'), memory_items=1, max_bytes=100 * 10, ttl=3600)
+    for index in range(64):  # eviction runs every 64 writes
+        clock.now += 1
+        cache.set(f'key{index}', 'x' * 100)
+    
+    assert cache.counters['evictions'] == 54
+    assert cache.get('key0') is None
+    assert cache.get('key63') == 'x' * 100
+    assert cache.get('key54') == 'x' * 100
+
+
+def test_async_lookups_run_off_the_event_loop(cache):
+    threads = []
+    get = cache.get
+    
+    def recording_get(key):
+        threads.append(threading.get_ident())
+        return get(key)
+    
+    cache.get = recording_get
+    
+    async def roundtrip():
+        await cache.set_async('a', 'A')
+        return await cache.get_async('a'), threading.get_ident()
+    
+    value, loop_thread = asyncio.run(roundtrip())
+    
+    assert value == 'A'
+    assert threads and loop_thread not in threads
+
+
+def test_services_opt_in_by_namespace(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE_PATH', str(tmp_path / 'shared.db'))
+    monkeypatch.setattr(response_cache, '_cache', None)
+    
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE_SERVICES', 'ocr, annotation')
+    assert get_response_cache('ocr') is not None
+    assert get_response_cache('annotation') is get_response_cache('ocr')
+    assert get_response_cache('short_answer') is None
+    
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE_SERVICES', 'all')
+    assert get_response_cache('short_answer') is not None
+    
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE_SERVICES', '')
+    assert get_response_cache('ocr') is None
+
+
+def test_keys_separate_namespaces_and_contents():
+    assert make_key('ocr', 'model', b'page') == make_key('ocr', 'model', b'page')
+    assert make_key('ocr', 'model', b'page') != make_key('annotation', 'model', b'page')
+    assert make_key('ocr', 'model', b'page') != make_key('ocr', 'model', b'page2')